@@ -0,0 +1,147 @@
+import math
+
+# PortAudio callback constants (the same values as pyaudio.paInputOverflow / pyaudio.paContinue),
+# so this module does not import PyAudio itself
+PA_INPUT_OVERFLOW = 0x2
+PA_CONTINUE = 0
+
+# Integer sample formats usable for recording, as PyAudio format constant names. Every one of them
+# has a matching FFmpeg raw PCM format and WAV sample width (see ffmpeg_tools.PCM_FORMATS).
+AUDIO_SAMPLE_FORMATS = {"int16": "paInt16", "int24": "paInt24", "int32": "paInt32"}
+
+
+class AudioRingBuffer:
+    """
+    Fixed-size ring of audio chunks between one producer (PortAudio's callback thread) and one
+    consumer (the recording thread). Each side only ever moves its own index and a slot is filled
+    before the write index that publishes it, so neither side takes a lock and the callback never
+    waits for the consumer. When the consumer falls behind and the ring is full, new chunks are
+    dropped and counted in overruns; the number of bytes lost travels with the next chunk that is
+    stored, so the consumer can put silence in their place.
+    """
+    def __init__(self, capacity, chunk_bytes):
+        self.capacity = capacity
+        self.chunk_bytes = chunk_bytes
+        self.overruns = 0 # Chunks dropped because the ring was full
+        self._data = bytearray(capacity * chunk_bytes)
+        self._view = memoryview(self._data)
+        self._lengths = [0] * capacity
+        self._times = [0.0] * capacity
+        self._lost = [0] * capacity        # Bytes dropped just before each chunk
+        self._overflowed = [False] * capacity # PortAudio reported an input overflow before each chunk
+        self._write_index = 0 # Chunks stored; written by the producer only
+        self._read_index = 0  # Chunks taken; written by the consumer only
+        self._lost_pending = 0
+        self._overflow_pending = False
+
+    def __len__(self):
+        return self._write_index - self._read_index
+
+    def put(self, data, timestamp, overflow=False):
+        """Producer: stores a chunk of at most chunk_bytes. Returns False if it had to be dropped."""
+        self._overflow_pending = self._overflow_pending or overflow
+        if self._write_index - self._read_index >= self.capacity:
+            self.overruns += 1
+            self._lost_pending += len(data)
+            return False
+        slot = self._write_index % self.capacity
+        start = slot * self.chunk_bytes
+        self._view[start:start + len(data)] = data
+        self._lengths[slot] = len(data)
+        self._times[slot] = timestamp
+        self._lost[slot] = self._lost_pending
+        self._overflowed[slot] = self._overflow_pending
+        self._lost_pending = 0
+        self._overflow_pending = False
+        self._write_index += 1 # Publishes the slot
+        return True
+
+    def get(self):
+        """Consumer: returns (timestamp, data, lost_bytes, overflow) of the oldest chunk, or None if empty."""
+        if self._read_index == self._write_index:
+            return None
+        slot = self._read_index % self.capacity
+        start = slot * self.chunk_bytes
+        # Copied out before the slot is handed back to the producer
+        item = (self._times[slot], bytes(self._view[start:start + self._lengths[slot]]),
+                self._lost[slot], self._overflowed[slot])
+        self._read_index += 1
+        return item
+
+
+class CallbackAudioInput:
+    """
+    Microphone input in PyAudio's callback mode. PortAudio calls us on its own thread with every
+    buffer, and the callback only stamps the buffer with the session time of its first sample and
+    copies it into an AudioRingBuffer of buffer_seconds, so a recording thread stalled by video
+    encoding can never make the device overflow: it catches up from the ring. read() returns the
+    chunks in order, with silence in place of any audio lost on the way (ring overruns, or
+    overflows inside PortAudio), so the samples keep matching the session clock.
+    While paused is set, the stream keeps running and its buffers are discarded; nothing has to
+    stop or restart the stream from another thread.
+    """
+    def __init__(self, pyaudio_instance, device_index, sample_format, channels, rate, chunk, buffer_seconds, clock):
+        self.rate = rate
+        self.chunk = chunk
+        self.sample_width = pyaudio_instance.get_sample_size(sample_format)
+        self.frame_bytes = channels * self.sample_width
+        self.clock = clock # SessionClock the chunks are stamped with
+        self.paused = False
+        self.overflows = 0 # Buffers PortAudio flagged as overflowed
+        self.silence_frames = 0 # Frames of silence read() inserted for lost audio
+        self.ring = AudioRingBuffer(max(2, math.ceil(buffer_seconds * rate / chunk)), chunk * self.frame_bytes)
+        self._expected_time = None # Session time just after the last chunk read
+        self._stream = pyaudio_instance.open(format=sample_format, channels=channels, rate=rate, input=True,
+                                             input_device_index=device_index, frames_per_buffer=chunk,
+                                             stream_callback=self._callback, start=False)
+        # Age of a buffer's first sample when its callback runs, for host APIs without ADC times
+        self._latency = chunk / rate + self._stream.get_input_latency()
+
+    def start(self):
+        self._stream.start_stream()
+        return self
+
+    def stop(self):
+        """Stops the callbacks; chunks already in the ring can still be read."""
+        if self._stream is not None and self._stream.is_active():
+            self._stream.stop_stream()
+
+    def close(self):
+        if self._stream is not None:
+            self.stop()
+            self._stream.close()
+            self._stream = None
+
+    def read(self):
+        """Returns the next chunk as (timestamp, data), or None if none is waiting."""
+        item = self.ring.get()
+        if item is None:
+            return None
+        timestamp, data, lost_bytes, overflow = item
+        silence = lost_bytes // self.frame_bytes
+        if overflow and self._expected_time is not None:
+            # PortAudio does not say how much it lost; the gap in the timestamps does
+            silence = max(silence, int(round((timestamp - self._expected_time) * self.rate)))
+        if silence > 0:
+            data = bytes(silence * self.frame_bytes) + data
+            timestamp -= silence / self.rate
+            self.silence_frames += silence
+        self._expected_time = timestamp + len(data) // self.frame_bytes / self.rate
+        return timestamp, data
+
+    def _callback(self, in_data, frame_count, time_info, status_flags):
+        overflow = bool(status_flags & PA_INPUT_OVERFLOW)
+        if overflow:
+            self.overflows += 1
+        if self.paused or not in_data:
+            return None, PA_CONTINUE
+        # PortAudio's own timing gives the age of the first sample when the host API reports it
+        age = time_info.get("current_time", 0.0) - time_info.get("input_buffer_adc_time", 0.0)
+        if not 0.0 < age < 1.0:
+            age = self._latency
+        timestamp = self.clock.now() - age
+        chunk_bytes = self.ring.chunk_bytes
+        for start in range(0, len(in_data), chunk_bytes): # One piece unless PortAudio sent a larger buffer
+            self.ring.put(in_data[start:start + chunk_bytes], timestamp + start // self.frame_bytes / self.rate, overflow)
+            overflow = False
+        return None, PA_CONTINUE
@@ -0,0 +1,117 @@
+import queue
+import subprocess
+import threading
+import wave
+
+from ffmpeg_tools import PCM_FORMATS, ffmpeg_popen
+
+
+class StreamingAudioSink:
+    """
+    Writes recorded audio to disk while recording instead of keeping it in memory.
+
+    write() hands chunks to a bounded queue and a writer thread appends them to the file, so memory
+    use stays at most max_queued_chunks chunks whatever the recording length. With compression=None
+    the output is a WAV whose header is rewritten and flushed after every batch, so a killed process
+    still leaves a valid file; with compression="flac" the chunks are piped to FFmpeg, whose FLAC
+    frames stay decodable up to the last one written (and FFmpeg finishes the file by itself when
+    our end of the pipe closes, even if we crash). Given a stream instead (such as the audio pipe of
+    video_writers.FFmpegPipeWriter), raw PCM is written to it and filename is ignored.
+    """
+    def __init__(self, filename, channels, sample_width, rate, compression=None, max_queued_chunks=256,
+                 stream=None):
+        if compression not in (None, "flac"):
+            raise ValueError(f"Unknown audio compression: {compression}")
+        self.filename = filename
+        self.channels = channels
+        self.sample_width = sample_width
+        self.rate = rate
+        self.compression = compression
+        self.bytes_written = 0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=max_queued_chunks)
+        self._thread = None
+        self._file = None
+        self._wav = None
+        self._process = None
+        self._stream = stream
+
+    def open(self):
+        if self._stream is not None:
+            pass # Raw PCM straight into the caller's stream
+        elif self.compression == "flac":
+            self._process = ffmpeg_popen(["-y", "-f", PCM_FORMATS[self.sample_width], "-ar", str(self.rate),
+                                          "-ac", str(self.channels), "-i", "pipe:0",
+                                          "-c:a", "flac", self.filename],
+                                         stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.PIPE)
+        else:
+            self._file = open(self.filename, "wb")
+            self._wav = wave.open(self._file, "wb")
+            self._wav.setnchannels(self.channels)
+            self._wav.setsampwidth(self.sample_width)
+            self._wav.setframerate(self.rate)
+            self._wav.writeframes(b"") # Header goes to disk right away
+            self._file.flush()
+        self._thread = threading.Thread(target=self._write_loop, name="audio-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def write(self, data):
+        """Queues a chunk of PCM data; blocks only if the disk falls far behind."""
+        if self.error is not None:
+            raise self.error
+        self._queue.put(data)
+
+    def close(self):
+        """Writes what is still queued and finalizes the file."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        try:
+            if self._stream is not None:
+                self._stream.close()
+            if self._wav is not None:
+                self._wav.close()
+                self._file.close()
+            if self._process is not None:
+                self._process.stdin.close()
+                if self._process.wait() != 0:
+                    raise RuntimeError("FFmpeg failed to encode audio: "
+                                       + self._process.stderr.read().decode(errors='ignore'))
+        finally:
+            self._wav = self._file = self._process = self._stream = None
+        if self.error is not None:
+            raise self.error
+
+    def _write_loop(self):
+        done = False
+        while not done:
+            batch = [self._queue.get()]
+            # Write everything already waiting in one go to keep the number of syscalls low
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if not batch or self.error is not None:
+                continue
+
+            data = b"".join(batch)
+            try:
+                if self._wav is not None:
+                    self._wav.writeframes(data) # Also rewrites the RIFF/data sizes in the header
+                    self._file.flush()
+                else:
+                    target = self._stream if self._stream is not None else self._process.stdin
+                    target.write(data)
+                    target.flush()
+                self.bytes_written += len(data)
+            except Exception as e:
+                self.error = e
@@ -0,0 +1,356 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import ffmpeg_tools
+from audio_sink import StreamingAudioSink
+from capture_backends import SyntheticBackend
+from frame_pipeline import FramePipeline, _TO_BGR, INTERPOLATIONS, scaled_frame_size
+from video_writers import MjpegAviWriter, FFmpegPipeWriter
+from mjpeg_pool import MjpegProcessPool
+from cursor_overlay import CursorOverlay, CursorState
+
+# Headless benchmarks of the recording hot path, using synthetic frames and audio (no display,
+# microphone or network needed):
+#   python benchmark.py --resolutions 720p,1080p,4k --codecs mjpg,x264 --fps 30,60 --output bench.json
+#   python benchmark.py --compare bench.json   (runs again and prints the change against an earlier run)
+#
+# Two kinds of results are produced:
+# - "stage": each step of the hot path timed on its own for --frames frames (grab, colour conversion
+#   from the real backends' pixel formats, cursor overlay, encode, audio write), as latency
+#   percentiles in milliseconds, plus the memory each call allocates (alloc_bytes; frame_allocs is the
+#   same in whole frames) and, where the stage counts them, the bytes it copies;
+# - "pipeline": the full FramePipeline paced at an fps target for --seconds, with the sustained fps,
+#   the pipeline counters, CPU use of this process, peak Python/NumPy memory (tracemalloc) and the
+#   pixel bytes copied per frame by the backend, the pipeline and the writer.
+
+RESOLUTIONS = {"480p": (854, 480), "720p": (1280, 720), "1080p": (1920, 1080), "1440p": (2560, 1440), "4k": (3840, 2160)}
+CODECS = ("mjpg", "mjpg-pool", "x264") # mjpg-pool: MJPG compressed by one worker process per core
+AUDIO_RATE = 44100
+AUDIO_CHUNK = 1024
+
+
+def latency_summary(samples):
+    """Percentiles (ms) of a list of durations in seconds."""
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"count": len(values), "mean_ms": round(float(values.mean()), 3), "p50_ms": round(float(p50), 3),
+            "p90_ms": round(float(p90), 3), "p99_ms": round(float(p99), 3), "max_ms": round(float(values.max()), 3)}
+
+
+def time_calls(function, count):
+    """Calls function(i) count times and returns the duration of each call."""
+    durations = []
+    for i in range(count):
+        start = time.perf_counter()
+        function(i)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def measure_allocations(function, count):
+    """
+    Bytes allocated per call of function(i), averaged over count calls: for each call, the most
+    Python/NumPy memory (tracemalloc) held at once beyond what was held before it. Buffers freed
+    within a call are included; buffers reused across calls are not, so an allocation-free stage
+    scores (close to) zero.
+    """
+    function(0) # Warm up: lazily created buffers are not per-frame allocations
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(count):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            function(i)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+    finally:
+        tracemalloc.stop()
+    return total / count
+
+
+def create_writer(codec, filename, fps, frame_size):
+    if codec == "mjpg":
+        return MjpegAviWriter(filename + ".avi", fps, frame_size)
+    if codec == "mjpg-pool":
+        return MjpegProcessPool(MjpegAviWriter(filename + ".avi", fps, frame_size), frame_size)
+    if codec == "x264":
+        return FFmpegPipeWriter(filename + ".mp4", fps, frame_size)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def bench_stages(resolution, codecs, frames, work_dir):
+    """Times every stage of the hot path separately at one resolution."""
+    width, height = RESOLUTIONS[resolution]
+    results = []
+
+    frame_bytes = width * height * 3
+
+    def add(stage, function, copied_bytes=None, **extra):
+        """Times function(i) over frames calls, then measures what it allocates per call."""
+        durations = time_calls(function, frames)
+        alloc_bytes = measure_allocations(function, frames)
+        result = {"kind": "stage", "stage": stage, "resolution": resolution, **extra, **latency_summary(durations),
+                  "alloc_bytes": round(alloc_bytes), "frame_allocs": round(alloc_bytes / frame_bytes, 2)}
+        if copied_bytes is not None:
+            result["copied_bytes"] = round(copied_bytes() / (2 * frames + 1)) # Per call, timed and measured runs
+        results.append(result)
+
+    backend = SyntheticBackend((0, 0, width, height))
+    backend.open()
+    bgr = np.empty(backend.frame_shape, dtype=np.uint8)
+    add("grab", lambda i: backend.grab_into(bgr), copied_bytes=lambda: backend.copied_bytes)
+
+    # The real backends deliver RGB (ImageGrab) or BGRA (mss); the encoder converts them into a reused buffer
+    converted = np.empty_like(bgr)
+    for pixel_format in ("RGB", "BGRA"):
+        source = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB if pixel_format == "RGB" else cv2.COLOR_BGR2BGRA)
+        add("convert", lambda i: cv2.cvtColor(source, _TO_BGR[pixel_format], dst=converted),
+            pixel_format=pixel_format)
+
+    # Highlight ring, a trail of 6 points and one click ripple, as a busy cursor would show
+    cursor = CursorOverlay(trail_seconds=0.2)
+    add("overlay", lambda i: cursor.draw(bgr, CursorState(i % width, i % height,
+                                                          tuple(((i - k) % width, (i - k) % height) for k in range(6, 0, -1)),
+                                                          ((i % width, i % height, i % cursor.ripple_steps),))))
+
+    # Optional downscale stage, run before the conversion on the real backends' BGRA frames
+    bgra = cv2.cvtColor(bgr, cv2.COLOR_BGR2BGRA)
+    scaled_size = scaled_frame_size((width, height), scale=0.5)
+    scaled = np.empty((scaled_size[1], scaled_size[0], 4), dtype=np.uint8)
+    for name, interpolation in INTERPOLATIONS.items():
+        add("scale", lambda i: cv2.resize(bgra, scaled_size, dst=scaled, interpolation=interpolation),
+            interpolation=name)
+
+    test_frames = []
+    for _ in range(min(frames, 8)): # A few distinct frames, so JPEG/x264 cannot coast on identical input
+        backend.grab_into(bgr)
+        test_frames.append(bgr.copy())
+    backend.close()
+    for codec in codecs:
+        try:
+            writer = create_writer(codec, os.path.join(work_dir, f"stage_{resolution}_{codec}"), 30, (width, height))
+        except FileNotFoundError:
+            results.append({"kind": "stage", "stage": "encode", "resolution": resolution, "codec": codec,
+                            "error": "FFmpeg not found"})
+            continue
+        # MJPG is compressed by encode() (on the encoder threads); the x264 pipe encodes inside write()
+        encode = writer.encode if hasattr(writer, "encode") else getattr(writer, "write_borrowed", writer.write)
+        add("encode", lambda i: encode(test_frames[i % len(test_frames)]), codec=codec,
+            copied_bytes=lambda: getattr(writer, "copied_bytes", 0))
+        writer.release()
+    return results
+
+
+def bench_audio(chunks, work_dir):
+    """Times StreamingAudioSink.write() with a synthetic 440 Hz tone."""
+    t = np.arange(AUDIO_CHUNK) / AUDIO_RATE
+    tone = (np.sin(2 * np.pi * 440 * t) * 10000).astype("<i2").tobytes()
+    sink = StreamingAudioSink(os.path.join(work_dir, "audio.wav"), 1, 2, AUDIO_RATE).open()
+    durations = time_calls(lambda i: sink.write(tone), chunks)
+    sink.close()
+    return {"kind": "stage", "stage": "audio_write", "chunk_samples": AUDIO_CHUNK, **latency_summary(durations)}
+
+
+def bench_pipeline(resolution, codec, fps, seconds, work_dir, encoder_threads=1, scale=None):
+    """Runs the full capture -> encode pipeline for seconds and measures what it sustains."""
+    width, height = RESOLUTIONS[resolution]
+    output_size = scaled_frame_size((width, height), scale=scale)
+    result = {"kind": "pipeline", "resolution": resolution, "codec": codec, "fps_target": fps,
+              "encoder_threads": encoder_threads}
+    if scale:
+        result["scale"] = scale
+    try:
+        writer = create_writer(codec, os.path.join(work_dir, f"pipeline_{resolution}_{codec}_{fps}"), fps, output_size)
+    except FileNotFoundError:
+        result["error"] = "FFmpeg not found"
+        return result
+
+    backend = SyntheticBackend((0, 0, width, height))
+    backend.open()
+    grab_times = []
+
+    def grab_frame(dst):
+        start = time.perf_counter()
+        backend.grab_into(dst)
+        grab_times.append(time.perf_counter() - start)
+
+    if codec == "mjpg-pool":
+        encoder_threads = max(encoder_threads, writer.workers) # One encoder thread per worker process
+        result["encoder_threads"] = encoder_threads
+    pipeline = FramePipeline(grab_frame, writer, (width, height), fps, encoder_threads=encoder_threads,
+                             pixel_format=backend.pixel_format, output_size=output_size)
+    timer = threading.Timer(seconds, pipeline.stop)
+
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    timer.start()
+    release_seconds = 0.0
+    cpu = None
+    try:
+        pipeline.run() # Returns once the queued frames are written
+        cpu = time.process_time() - cpu_start
+        release_start = time.perf_counter()
+        writer.release()
+        release_seconds = time.perf_counter() - release_start
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        timer.cancel()
+        wall = time.perf_counter() - wall_start - release_seconds
+        if cpu is None:
+            cpu = time.process_time() - cpu_start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        backend.close()
+
+    stats = pipeline.stats()
+    copied_bytes = stats["copied_bytes"] + backend.copied_bytes + getattr(writer, "copied_bytes", 0)
+    result.update({
+        "seconds": round(wall, 3),
+        "release_seconds": round(release_seconds, 3), # Finishing the file after the last frame
+        "sustained_fps": round(stats["captured"] / wall, 2), # Frames actually grabbed per second
+        "output_fps": round(stats["written"] / wall, 2), # Frames in the file per second (incl. repeats)
+        "cpu_percent": round(100.0 * cpu / wall, 1), # Of one core; this process only (not FFmpeg)
+        "peak_memory_mb": round(peak_memory / (1024 * 1024), 1),
+        "copied_bytes_per_frame": round(copied_bytes / max(1, stats["captured"])),
+        "stats": stats,
+    })
+    if grab_times:
+        result["grab"] = latency_summary(grab_times)
+    return result
+
+
+def result_key(result):
+    """Identifies the same measurement across runs."""
+    return tuple(str(result.get(field)) for field in
+                 ("kind", "stage", "resolution", "codec", "pixel_format", "interpolation", "fps_target",
+                  "encoder_threads", "scale"))
+
+
+def compare_results(previous, current):
+    """Prints the change of the headline number of every measurement present in both runs."""
+    previous_by_key = {result_key(r): r for r in previous["results"]}
+    print(f"\nCompared with {previous.get('created', '?')}:")
+    for result in current["results"]:
+        old = previous_by_key.get(result_key(result))
+        metric = "sustained_fps" if result["kind"] == "pipeline" else "p50_ms"
+        if not old or metric not in old or metric not in result:
+            continue
+        before, after = old[metric], result[metric]
+        change = (after - before) / before * 100 if before else math.inf
+        better = change > 0 if metric == "sustained_fps" else change < 0
+        flag = "" if abs(change) < 5 else (" (better)" if better else " (WORSE)")
+        print(f"  {describe(result):<40} {metric}: {before} -> {after} ({change:+.1f}%){flag}")
+
+
+def describe(result):
+    if result["kind"] == "pipeline":
+        scale = f" x{result['scale']}" if result.get("scale") else ""
+        return f"pipeline {result['resolution']}{scale} {result['codec']} @{result['fps_target']}fps"
+    extra = result.get("codec") or result.get("pixel_format") or result.get("interpolation") or ""
+    return f"{result['stage']} {result.get('resolution', '')} {extra}".strip()
+
+
+def print_result(result):
+    if "error" in result:
+        print(f"  {describe(result):<40} skipped: {result['error']}")
+    elif result["kind"] == "pipeline":
+        print(f"  {describe(result):<40} {result['sustained_fps']:>7} fps  cpu {result['cpu_percent']:>5}%  "
+              f"peak {result['peak_memory_mb']} MB  copied {result['copied_bytes_per_frame'] / 1e6:.1f} MB/frame  "
+              f"late {result['stats']['late']}  dropped {result['stats']['dropped']}")
+    else:
+        line = (f"  {describe(result):<40} p50 {result['p50_ms']:>8} ms  p90 {result['p90_ms']:>8} ms  "
+                f"p99 {result['p99_ms']:>8} ms")
+        if "alloc_bytes" in result:
+            line += f"  alloc {result['alloc_bytes'] / 1e6:.2f} MB ({result['frame_allocs']} frames)"
+        if "copied_bytes" in result:
+            line += f"  copied {result['copied_bytes'] / 1e6:.2f} MB"
+        print(line)
+
+
+def run_benchmarks(resolutions, codecs, fps_targets, frames, seconds, encoder_threads=1, scale=None):
+    """Runs the whole suite and returns the results document."""
+    document = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "settings": {"frames": frames, "seconds": seconds, "encoder_threads": encoder_threads, "scale": scale},
+        "results": [],
+    }
+    work_dir = tempfile.mkdtemp(prefix="screen_recorder_bench_")
+    try:
+        def add(result):
+            document["results"].append(result)
+            print_result(result)
+
+        print("Stage latencies:")
+        add(bench_audio(frames, work_dir))
+        for resolution in resolutions:
+            for result in bench_stages(resolution, codecs, frames, work_dir):
+                add(result)
+        print("Pipeline throughput:")
+        for resolution in resolutions:
+            for codec in codecs:
+                for fps in fps_targets:
+                    add(bench_pipeline(resolution, codec, fps, seconds, work_dir, encoder_threads, scale))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return document
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the screen recorder's capture/encode path headless.")
+    parser.add_argument("--resolutions", default="720p,1080p,4k", help=f"Comma-separated, from: {', '.join(RESOLUTIONS)}")
+    parser.add_argument("--codecs", default="mjpg,x264", help=f"Comma-separated, from: {', '.join(CODECS)}")
+    parser.add_argument("--fps", default="30,60", help="Comma-separated fps targets for the pipeline runs")
+    parser.add_argument("--frames", type=int, default=60, help="Frames timed per stage")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Duration of each pipeline run")
+    parser.add_argument("--encoder-threads", type=int, default=1)
+    parser.add_argument("--scale", type=float, help="Downscale factor for the pipeline runs (e.g. 0.5)")
+    parser.add_argument("--ffmpeg", help="FFmpeg executable (default: ffmpeg from PATH)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier JSON results to compare this run against")
+    args = parser.parse_args(argv)
+
+    resolutions = args.resolutions.split(",")
+    codecs = args.codecs.split(",")
+    for name, allowed in ((resolutions, RESOLUTIONS), (codecs, CODECS)):
+        unknown = [value for value in name if value not in allowed]
+        if unknown:
+            parser.error(f"unknown value(s): {', '.join(unknown)}")
+    if args.ffmpeg:
+        ffmpeg_tools.FFMPEG = args.ffmpeg
+
+    document = run_benchmarks(resolutions, codecs, [int(v) for v in args.fps.split(",")],
+                              args.frames, args.seconds, args.encoder_threads, args.scale)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), document)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import numpy as np
+
+from PIL import ImageGrab
+
+try:
+    import mss # Optional: persistent X11/Win32/Quartz grabber, much cheaper than ImageGrab per frame
+except ImportError:
+    mss = None
+
+# Number of channels each pixel format occupies in a frame buffer
+PIXEL_CHANNELS = {"RGB": 3, "BGR": 3, "BGRA": 4}
+
+
+class CaptureBackend:
+    """
+    Base class for screen grabbers.
+    A backend is opened once per recording, then grab_into() is called for every frame and writes
+    the region straight into a preallocated numpy array of shape (height, width, channels) in the
+    backend's pixel_format. open(), grab_into() and close() are all called from the capture thread.
+    copied_bytes counts the pixel copies grab_into() makes on the way (not those inside the OS).
+    """
+    name = "base"
+    pixel_format = "RGB"
+
+    def __init__(self, region):
+        self.region = region # (x, y, width, height) in virtual desktop coordinates
+        self.copied_bytes = 0
+
+    @property
+    def frame_shape(self):
+        _, _, width, height = self.region
+        return (height, width, PIXEL_CHANNELS[self.pixel_format])
+
+    def open(self):
+        """Acquires long-lived resources (display connection, buffers)."""
+
+    def grab_into(self, dst):
+        """Captures the region into dst."""
+        raise NotImplementedError
+
+    def close(self):
+        """Releases what open() acquired."""
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ImageGrabBackend(CaptureBackend):
+    """Fallback backend using Pillow's ImageGrab, which grabs (and on Linux connects to X) per frame."""
+    name = "imagegrab"
+    pixel_format = "RGB"
+
+    def grab_into(self, dst):
+        x, y, width, height = self.region
+        img = ImageGrab.grab(bbox=(x, y, x + width, y + height))
+        # Pillow exposes its pixels to NumPy through tobytes(), so this is two copies (still RGB)
+        np.copyto(dst, np.asarray(img))
+        self.copied_bytes += 2 * dst.nbytes
+
+
+class MssBackend(CaptureBackend):
+    """
+    Persistent grabber built on mss. The display connection (and MIT-SHM segment on X11, where the
+    installed mss supports it) is opened once and reused, and the raw BGRA pixels are viewed without
+    an intermediate image object before being copied into the caller's frame.
+    """
+    name = "mss"
+    pixel_format = "BGRA"
+
+    def __init__(self, region):
+        super().__init__(region)
+        self._sct = None
+        x, y, width, height = region
+        self._monitor = {"left": x, "top": y, "width": width, "height": height}
+
+    def open(self):
+        if mss is None:
+            raise RuntimeError("The mss capture backend needs the 'mss' package (pip install mss).")
+        self._sct = mss.mss() # mss handles are bound to the thread that created them
+
+    def grab_into(self, dst):
+        shot = self._sct.grab(self._monitor)
+        np.copyto(dst, np.frombuffer(shot.raw, dtype=np.uint8).reshape(dst.shape)) # A view of mss's buffer, one copy
+        self.copied_bytes += dst.nbytes
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+
+class SyntheticBackend(CaptureBackend):
+    """
+    Test-pattern backend that needs no display: a static gradient with a bar sweeping across it and
+    a block that changes every frame. Used to benchmark and exercise the pipeline headless.
+    """
+    name = "synthetic"
+    pixel_format = "BGR"
+
+    def __init__(self, region):
+        super().__init__(region)
+        self._background = None
+        self._frame_index = 0
+
+    def open(self):
+        height, width, _ = self.frame_shape
+        gradient_x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+        gradient_y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self._background = np.empty(self.frame_shape, dtype=np.uint8)
+        self._background[..., 0] = gradient_x
+        self._background[..., 1] = gradient_y
+        self._background[..., 2] = (gradient_x + gradient_y) / 2
+        self._frame_index = 0
+
+    def grab_into(self, dst):
+        height, width, _ = dst.shape
+        np.copyto(dst, self._background)
+        self.copied_bytes += dst.nbytes
+        bar_width = max(1, width // 32)
+        bar_x = (self._frame_index * bar_width) % width
+        dst[:, bar_x:bar_x + bar_width] = 255 # Moving bar
+        block = min(32, height, width)
+        dst[:block, :block] = self._frame_index % 256 # Per-frame marker, top-left corner
+        self._frame_index += 1
+
+    def close(self):
+        self._background = None
+
+
+CAPTURE_BACKENDS = {
+    backend.name: backend for backend in (MssBackend, ImageGrabBackend, SyntheticBackend)
+}
+
+
+def create_capture_backend(name, region):
+    """
+    Returns an unopened backend for region. "auto" picks mss when it is installed and falls back
+    to ImageGrab otherwise.
+    """
+    if name == "auto":
+        name = MssBackend.name if mss is not None else ImageGrabBackend.name
+    try:
+        backend_class = CAPTURE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown capture backend: {name}. Choose from: auto, {', '.join(CAPTURE_BACKENDS)}")
+    return backend_class(region)
+
+
+def list_monitors():
+    """
+    Returns the (x, y, width, height) of every monitor in virtual desktop coordinates, e.g. to
+    record each monitor to its own file. Needs mss.
+    """
+    if mss is None:
+        raise RuntimeError("Listing monitors needs the 'mss' package (pip install mss).")
+    with mss.mss() as sct:
+        # Entry 0 is the bounding box of all monitors
+        return [(m["left"], m["top"], m["width"], m["height"]) for m in sct.monitors[1:]]
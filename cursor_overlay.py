@@ -0,0 +1,189 @@
+import collections
+import threading
+
+import cv2
+import numpy as np
+
+try:
+    from pynput import mouse as pynput_mouse # Optional: mouse button events, for click ripples
+except ImportError:
+    pynput_mouse = None
+
+# Cursor state at one frame's grab time: position, the recent path (oldest first, repeated points
+# merged) and the click ripples still animating as (x, y, animation step). Everything is in screen
+# coordinates and hashable, so two frames with the same state compare equal (see FrameChangeDetector).
+CursorState = collections.namedtuple("CursorState", "x y trail ripples")
+
+
+class CursorSampler:
+    """
+    Samples the mouse on its own thread at rate Hz into a timestamped buffer of history_seconds,
+    so the capture path never waits on the windowing system: it only looks up state_at(time) for
+    each frame. position() returns the pointer's screen coordinates (e.g. pyautogui.position);
+    clock is the recording's SessionClock. When pynput is installed and listen_clicks is set,
+    button presses are recorded as they happen, for click ripples.
+    """
+    def __init__(self, position, clock, rate=120, history_seconds=1.0, listen_clicks=True):
+        self.position = position
+        self.clock = clock
+        self.rate = rate
+        self.history_seconds = history_seconds
+        self._samples = collections.deque(maxlen=max(2, int(rate * history_seconds))) # (time, x, y)
+        self._clicks = collections.deque(maxlen=32) # (time, x, y)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listener = None
+        self._listen_clicks = listen_clicks and pynput_mouse is not None
+
+    def start(self):
+        self._sample() # A first position before any frame is grabbed
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cursor-sampler", daemon=True)
+        self._thread.start()
+        if self._listen_clicks:
+            self._listener = pynput_mouse.Listener(on_click=self._on_click)
+            self._listener.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def state_at(self, timestamp, trail_seconds=0.0, ripple_seconds=0.0, ripple_steps=1):
+        """CursorState at session time timestamp, or None before the first sample."""
+        with self._lock:
+            samples = list(self._samples)
+            clicks = list(self._clicks)
+        current = None
+        trail = []
+        for sample_time, x, y in samples:
+            if sample_time > timestamp:
+                break
+            current = (x, y)
+            if sample_time > timestamp - trail_seconds and (not trail or trail[-1] != current):
+                trail.append(current)
+        if current is None:
+            if not samples:
+                return None
+            current = samples[0][1:] # Grabbed before the first sample; the first one is closest
+        ripples = []
+        for click_time, x, y in clicks:
+            age = timestamp - click_time
+            if 0 <= age < ripple_seconds:
+                ripples.append((x, y, int(age / ripple_seconds * ripple_steps)))
+        return CursorState(current[0], current[1], tuple(trail[:-1]), tuple(ripples))
+
+    def _run(self):
+        interval = 1.0 / self.rate
+        while not self._stop.wait(interval):
+            try:
+                self._sample()
+            except Exception as e:
+                print(f"Cursor sampling failed: {e}") # Debugging; e.g. the display went away
+                return
+
+    def _sample(self):
+        x, y = self.position()
+        sample = (self.clock.now(), int(x), int(y))
+        with self._lock:
+            self._samples.append(sample)
+
+    def _on_click(self, x, y, button, pressed):
+        if pressed:
+            with self._lock:
+                self._clicks.append((self.clock.now(), int(x), int(y)))
+
+
+class CursorSprite:
+    """
+    A BGRA image rendered once, kept as premultiplied colour and inverse alpha in float32 so that
+    blending it into a frame is two multiply-adds over the small region it covers.
+    """
+    def __init__(self, bgra):
+        self.height, self.width = bgra.shape[:2]
+        alpha = bgra[..., 3:4].astype(np.float32) / 255
+        self.color = bgra[..., :3].astype(np.float32) * alpha
+        self.inverse_alpha = 1.0 - alpha
+
+    def blend(self, frame, x, y):
+        """Blends the sprite centred on (x, y) into frame (BGR), clipped to its edges."""
+        frame_height, frame_width = frame.shape[:2]
+        left, top = x - self.width // 2, y - self.height // 2
+        x0, y0 = max(0, left), max(0, top)
+        x1, y1 = min(frame_width, left + self.width), min(frame_height, top + self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        roi = frame[y0:y1, x0:x1]
+        sprite = (slice(y0 - top, y1 - top), slice(x0 - left, x1 - left))
+        roi[...] = roi * self.inverse_alpha[sprite] + self.color[sprite] + 0.5 # Rounded back to uint8
+
+
+def render_ring(radius, color, thickness, opacity=1.0):
+    """Anti-aliased ring of radius pixels as a CursorSprite."""
+    size = 2 * (radius + thickness) + 1
+    canvas = np.zeros((size, size, 4), dtype=np.uint8)
+    cv2.circle(canvas, (size // 2, size // 2), radius, (*color, int(255 * opacity)), thickness, cv2.LINE_AA)
+    return CursorSprite(canvas)
+
+
+def render_dot(radius, color, opacity=1.0):
+    """Anti-aliased filled dot as a CursorSprite."""
+    size = 2 * radius + 3
+    canvas = np.zeros((size, size, 4), dtype=np.uint8)
+    cv2.circle(canvas, (size // 2, size // 2), radius, (*color, int(255 * opacity)), -1, cv2.LINE_AA)
+    return CursorSprite(canvas)
+
+
+class CursorOverlay:
+    """
+    Draws CursorStates onto frames from sprites rendered once up front: a highlight ring around
+    the pointer, a fading trail of dots along its recent path, and for every click a ripple that
+    grows and fades over ripple_steps frames of its animation. Each sprite is blended only into
+    the pixels it covers, so the cost is independent of the frame size.
+    """
+    def __init__(self, radius=15, color=(0, 0, 255), thickness=2, trail_seconds=0.0, ripple_seconds=0.4,
+                 ripple_radius=40, ripple_steps=8, trail_steps=6):
+        self.trail_seconds = trail_seconds
+        self.ripple_seconds = ripple_seconds
+        self.ripple_steps = ripple_steps
+        self.highlight = render_ring(radius, color, thickness)
+        self.trail = [render_dot(max(2, radius // 4), color, opacity=0.6 * (i + 1) / trail_steps)
+                      for i in range(trail_steps)] # Faintest first
+        self.ripples = [render_ring(radius + (ripple_radius - radius) * (i + 1) // ripple_steps, color, thickness,
+                                    opacity=1.0 - i / ripple_steps)
+                        for i in range(ripple_steps)]
+
+    def state_at(self, sampler, timestamp):
+        return sampler.state_at(timestamp, self.trail_seconds, self.ripple_seconds, self.ripple_steps)
+
+    def draw(self, frame, state, origin=(0, 0), scale=(1.0, 1.0)):
+        """
+        Draws state onto frame, a BGR capture of the screen area starting at origin and resized by
+        scale (output pixels per screen pixel).
+        """
+        if state is None:
+            return
+        origin_x, origin_y = origin
+        scale_x, scale_y = scale
+
+        def to_frame(x, y):
+            return int((x - origin_x) * scale_x), int((y - origin_y) * scale_y)
+
+        count, sprites = len(state.trail), len(self.trail)
+        for index, point in enumerate(state.trail):
+            # The newest point gets the strongest dot, older ones fainter ones
+            sprite = sprites - count + index if count <= sprites else index * sprites // count
+            self.trail[sprite].blend(frame, *to_frame(*point))
+        for x, y, step in state.ripples:
+            self.ripples[step].blend(frame, *to_frame(x, y))
+        x, y = to_frame(state.x, state.y)
+        height, width = frame.shape[:2]
+        # No highlight when the pointer is outside the recorded area (e.g. on another monitor)
+        if 0 <= x < width and 0 <= y < height:
+            self.highlight.blend(frame, x, y)
@@ -0,0 +1,187 @@
+import collections
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+
+from capture_backends import SyntheticBackend
+from video_writers import MjpegAviWriter, FFmpegPipeWriter, PIPE_ENCODERS, PIPE_CONTAINERS
+
+# Encoders the engine can record with, as (name, encoder, x264 preset)
+CANDIDATES = (("mjpg", "mjpg", None), ("xvid", "xvid", None), ("ffv1", "ffv1", None),
+              ("x264-ultrafast", "x264", "ultrafast"), ("x264-superfast", "x264", "superfast"),
+              ("x264-veryfast", "x264", "veryfast"), ("x264-faster", "x264", "faster"))
+MJPG_CONTAINERS = (".mp4", ".mkv", ".mov", ".avi")
+
+# Results are kept per host and frame size; calibrate() again after changing hardware or FFmpeg
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".screen_recorder", "encoder_calibration.json")
+
+# The engine's encoder settings picked by choose_encoder(), with the measurement behind them
+EncoderChoice = collections.namedtuple("EncoderChoice", "encoder preset result reason results")
+
+
+def containers(result):
+    """Output file extensions the measured encoder can be written to."""
+    if result["encoder"] == "mjpg":
+        return MJPG_CONTAINERS
+    return PIPE_CONTAINERS[PIPE_ENCODERS[result["encoder"]]]
+
+
+def _cpu_seconds():
+    """CPU time of this process and its finished children (FFmpeg); children are 0 on Windows."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def measure_encoder(candidate, frame_size, frames=60, max_seconds=3.0, temp_dir=None):
+    """
+    Encodes up to frames synthetic frames of frame_size (stopping after max_seconds) with one
+    candidate of CANDIDATES on this thread, and returns its throughput: frames per second, CPU
+    (percent of one core, FFmpeg included) and bytes per frame. Grabbing the frames is not counted;
+    closing the file is. A candidate that cannot run (e.g. FFmpeg missing) gets an "error" instead.
+    """
+    name, encoder, preset = candidate
+    width, height = frame_size
+    result = {"name": name, "encoder": encoder, "preset": preset}
+    backend = SyntheticBackend((0, 0, width, height))
+    backend.open()
+    frame = np.empty(backend.frame_shape, dtype=np.uint8)
+    with tempfile.TemporaryDirectory(prefix="calibration_", dir=temp_dir) as directory:
+        filename = os.path.join(directory, "clip.avi" if encoder == "mjpg" else "clip.mkv")
+        writer = None
+        grab_wall = grab_cpu = 0.0
+        count = 0
+        cpu_start = _cpu_seconds()
+        wall_start = time.perf_counter()
+        try:
+            if encoder == "mjpg":
+                writer = MjpegAviWriter(filename, 30, frame_size)
+            else:
+                writer = FFmpegPipeWriter(filename, 30, frame_size, codec=PIPE_ENCODERS[encoder],
+                                          preset=preset or "veryfast")
+            while count < frames and (count < 5 or time.perf_counter() - wall_start - grab_wall < max_seconds):
+                grab_start, grab_cpu_start = time.perf_counter(), time.process_time()
+                backend.grab_into(frame)
+                grab_wall += time.perf_counter() - grab_start
+                grab_cpu += time.process_time() - grab_cpu_start
+                writer.write(frame)
+                count += 1
+            writer.release()
+            writer = None
+        except FileNotFoundError:
+            result["error"] = "FFmpeg not found"
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            if writer is not None:
+                try:
+                    writer.release()
+                except Exception:
+                    pass
+            backend.close()
+        if "error" in result:
+            return result
+        wall = max(time.perf_counter() - wall_start - grab_wall, 1e-9)
+        cpu = max(_cpu_seconds() - cpu_start - grab_cpu, 0.0)
+        result.update({
+            "frames": count,
+            "fps": round(count / wall, 1),
+            "cpu_percent": round(100.0 * cpu / wall, 1),
+            "bytes_per_frame": round(os.path.getsize(filename) / count),
+        })
+    return result
+
+
+def select_encoder(results, fps, headroom=1.5, container=None):
+    """
+    Picks from calibration results the cheapest encoder that keeps up with fps: of those that
+    encoded at least headroom * fps frames per second (so a busy machine still keeps up), the one
+    with the smallest output per frame; if none is fast enough, the fastest. Only encoders that
+    fit the output's container (e.g. ".mp4") are considered. Returns (result, reason), or
+    (None, reason) if nothing could be measured.
+    """
+    usable = [r for r in results if "error" not in r and (container is None or container in containers(r))]
+    if not usable:
+        return None, "no usable encoder could be measured"
+    target = fps * headroom
+    fast_enough = [r for r in usable if r["fps"] >= target]
+    if fast_enough:
+        best = min(fast_enough, key=lambda r: r["bytes_per_frame"])
+        return best, (f"smallest output of the {len(fast_enough)} encoders sustaining {target:g} fps "
+                      f"({fps:g} fps with {headroom:g}x headroom)")
+    best = max(usable, key=lambda r: r["fps"])
+    return best, f"fastest encoder; none sustains {target:g} fps ({fps:g} fps with {headroom:g}x headroom)"
+
+
+def describe_result(result):
+    """One line of a calibration table."""
+    if "error" in result:
+        return f"{result['name']:<15} failed: {result['error']}"
+    return (f"{result['name']:<15} {result['fps']:>7.1f} fps  cpu {result['cpu_percent']:>5.1f}%  "
+            f"{result['bytes_per_frame'] / 1024:>8.1f} KiB/frame")
+
+
+def _cache_key(frame_size):
+    return f"{platform.node()} {frame_size[0]}x{frame_size[1]}"
+
+
+def load_calibration(frame_size, cache_file=CACHE_FILE):
+    """Cached calibration results for frame_size on this host, or None."""
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f).get(_cache_key(frame_size))
+    except (OSError, ValueError):
+        return None
+
+
+def calibrate(frame_size, candidates=CANDIDATES, cache_file=CACHE_FILE, on_result=None, **measure_options):
+    """
+    Measures every candidate at frame_size (see measure_encoder), stores the results in
+    cache_file and returns them as {"measured_at", "host", "frame_size", "results"}.
+    on_result(result) is called after each candidate.
+    """
+    results = []
+    for candidate in candidates:
+        result = measure_encoder(candidate, frame_size, **measure_options)
+        results.append(result)
+        print(f"Encoder calibration: {describe_result(result)}") # Debugging
+        if on_result:
+            on_result(result)
+    entry = {"measured_at": datetime.datetime.now().isoformat(timespec="seconds"), "host": platform.node(),
+             "frame_size": list(frame_size), "results": results}
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[_cache_key(frame_size)] = entry
+        temp_file = cache_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temp_file, cache_file) # Never leaves a half-written cache behind
+    except OSError as e:
+        print(f"Could not save the encoder calibration: {e}") # Debugging; the results are still used
+    return entry
+
+
+def choose_encoder(frame_size, fps, container=".mp4", headroom=1.5, refresh=False, cache_file=CACHE_FILE,
+                   on_result=None):
+    """
+    Returns an EncoderChoice for recording frame_size at fps into a container file, from the
+    cached calibration of this host and size, calibrating first if there is none (or refresh).
+    Falls back to MJPG when nothing could be measured.
+    """
+    entry = None if refresh else load_calibration(frame_size, cache_file)
+    if entry is None:
+        entry = calibrate(frame_size, cache_file=cache_file, on_result=on_result)
+    result, reason = select_encoder(entry["results"], fps, headroom, container)
+    if result is None:
+        return EncoderChoice("mjpg", None, None, reason + "; using mjpg", entry["results"])
+    return EncoderChoice(result["encoder"], result["preset"], result,
+                         f"{result['name']}: {reason} (calibrated {entry['measured_at']})", entry["results"])
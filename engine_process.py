@@ -0,0 +1,223 @@
+import multiprocessing
+import queue
+import threading
+
+from recorder_engine import RecorderEngine, RecorderError
+
+# Messages on the control channel, a multiprocessing Pipe (frames never cross it):
+#   parent -> child: ("start",), ("pause",), ("resume",), ("stats",), ("save_replay", filename),
+#                    ("stop",), ("finalize",)
+#   child -> parent: ("status", text), ("error", title, message), ("failure",), ("progress", fraction),
+#                    ("replay_saved", filename, saved), ("reply", result, error message or None)
+# Commands the parent waits for a reply to; the others are fire-and-forget
+REPLY_COMMANDS = ("start", "stats", "save_replay", "finalize")
+
+
+def _serve(region, options, conn, engine_class=RecorderEngine):
+    """Child process: runs a RecorderEngine and answers the commands of its RecorderProcess."""
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock: # Called from the engine's threads as well as this one
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass # The parent is gone; the recording is still finished below
+
+    engine = None
+    try:
+        engine = engine_class(region, on_status=lambda text: send("status", text),
+                              on_error=lambda title, message: send("error", title, message),
+                              on_failure=lambda: send("failure"), **options)
+    except Exception as e:
+        send("reply", None, str(e))
+        return
+    while True:
+        try:
+            command, *args = conn.recv()
+        except (OSError, EOFError):
+            # The app exited or crashed: save what was recorded rather than lose it
+            print("Recorder control channel closed; finishing the recording...") # Debugging
+            engine.stop_capture()
+            engine.finalize()
+            return
+        try:
+            if command == "start":
+                engine.start()
+                send("reply", (engine.encoder_choice, engine.final_output_filename, engine.output_filenames), None)
+            elif command == "pause":
+                engine.pause()
+            elif command == "resume":
+                engine.resume()
+            elif command == "stats":
+                send("reply", engine.stats(), None)
+            elif command == "save_replay":
+                filename = args[0]
+                engine.save_replay(filename, on_done=lambda saved: send("replay_saved", filename, saved))
+                send("reply", None, None)
+            elif command == "stop":
+                engine.stop_capture()
+            elif command == "finalize":
+                saved = engine.finalize(lambda fraction: send("progress", fraction))
+                send("reply", (saved, engine.final_output_filename, engine.output_filenames), None)
+                return
+        except Exception as e:
+            if command not in REPLY_COMMANDS:
+                send("error", "Recording Error", str(e))
+                continue
+            send("reply", None, str(e))
+            if command in ("start", "finalize"):
+                return
+
+
+class RecorderProcess:
+    """
+    Runs a RecorderEngine in a child process, with the engine's surface (start, pause, resume,
+    stats, save_replay, stop_capture, finalize), so capture, conversion, encoding and audio never
+    compete with the Tk mainloop for the GIL. Only commands, status lines, errors, progress and
+    stats cross the control channel; frames stay in the child. The engine options are the same as
+    RecorderEngine's and must be picklable; pyaudio_instance is not passed on (the child opens its
+    own PyAudio). Callbacks run on this object's reader thread, like the engine's run on its
+    threads. start() and finalize() wait for the child (it opens the capture, audio and encoder
+    first), so a UI calls them off its own thread; stop_capture() only sends the command, so the
+    caller never waits for the capture threads. If the app exits with the recording still open,
+    the child stops and finalizes it by itself. engine_class is what the child runs: RecorderEngine,
+    or any picklable class with its surface (e.g. a stub in tests).
+    """
+    def __init__(self, region, on_status=None, on_error=None, on_failure=None, pyaudio_instance=None,
+                 engine_class=RecorderEngine, **options):
+        self.on_status = on_status
+        self.on_error = on_error
+        self.on_failure = on_failure
+        self.final_output_filename = options.get("output_filename")
+        self.output_filenames = options.get("output_filenames")
+        self.replay_seconds = options.get("replay_seconds")
+        self.encoder_choice = None # EncoderChoice behind encoder "auto", once started
+        self.is_recording = False
+        self._on_progress = None
+        self._replay_callbacks = {} # filename -> on_done of save_replay()
+        self._replies = queue.Queue()
+        self._send_lock = threading.Lock()
+        self._call_lock = threading.Lock()
+        self._closed = False
+        self._died = False # Set when the child exited in the middle of a recording
+
+        context = multiprocessing.get_context("spawn") # Same behaviour on every platform; no forked threads
+        self._conn, child_conn = context.Pipe()
+        # Not a daemon: the engine may start processes of its own (encode_processes)
+        self._process = context.Process(target=_serve, name="recorder-engine",
+                                        args=(region, options, child_conn, engine_class))
+        self._process.start()
+        child_conn.close() # Only the child holds it now, so its exit ends the reader below
+        self._reader = threading.Thread(target=self._read, name="recorder-events", daemon=True)
+        self._reader.start()
+
+    def start(self):
+        """Starts recording in the child; raises RecorderError if the engine could not start."""
+        self.encoder_choice, self.final_output_filename, self.output_filenames = self._call("start")
+        self.is_recording = True
+
+    def pause(self):
+        self._send("pause")
+
+    def resume(self):
+        self._send("resume")
+
+    def stats(self):
+        """Counters of the child's pipeline."""
+        return {} if self._closed else self._call("stats")
+
+    def save_replay(self, filename, on_done=None):
+        """Asks the child to write the replay window to filename; on_done(saved) when it is written."""
+        self._replay_callbacks[filename] = on_done
+        try:
+            self._call("save_replay", filename)
+        except RecorderError:
+            self._replay_callbacks.pop(filename, None)
+            raise
+
+    def stop_capture(self):
+        """Tells the child to stop capturing, without waiting for it (finalize() does)."""
+        if not self.is_recording:
+            return
+        self.is_recording = False
+        self._send("stop")
+
+    def finalize(self, on_progress=None):
+        """Finishes the output in the child (see RecorderEngine.finalize()) and ends it."""
+        self._on_progress = on_progress
+        try:
+            saved, self.final_output_filename, self.output_filenames = self._call("finalize")
+        except RecorderError as e:
+            if not self._died: # Already reported
+                self._report_error("Recording Error", str(e))
+            saved = False
+        finally:
+            self._on_progress = None
+        self._process.join()
+        return saved
+
+    def _send(self, *message):
+        with self._send_lock: # The UI and finalizer threads both send
+            try:
+                self._conn.send(message)
+            except (OSError, EOFError):
+                pass # The reader reports the child's exit
+
+    def _call(self, command, *args):
+        """Sends a command and waits for its reply; raises RecorderError on failure."""
+        with self._call_lock:
+            if not self._closed:
+                self._send(command, *args)
+            # Once the child has exited, a reply it sent first (e.g. why the engine could not be
+            # created) is still queued ahead of the None the reader puts last
+            reply = self._replies.get()
+            if reply is None:
+                self._replies.put(None) # Every later call sees the exit too
+        if reply is None:
+            raise RecorderError("The recording process has exited.")
+        result, error = reply
+        if error is not None:
+            raise RecorderError(error)
+        return result
+
+    def _read(self):
+        """Reader thread: dispatches the child's messages until it exits."""
+        while True:
+            try:
+                kind, *args = self._conn.recv()
+            except (OSError, EOFError):
+                break
+            if kind == "reply":
+                self._replies.put(tuple(args))
+            elif kind == "status":
+                if self.on_status:
+                    self.on_status(args[0])
+            elif kind == "error":
+                self._report_error(*args)
+            elif kind == "failure":
+                if self.on_failure:
+                    self.on_failure()
+            elif kind == "progress":
+                if self._on_progress:
+                    self._on_progress(args[0])
+            elif kind == "replay_saved":
+                filename, saved = args
+                on_done = self._replay_callbacks.pop(filename, None)
+                if on_done:
+                    on_done(saved)
+        self._closed = True
+        self._replies.put(None) # Wakes a call still waiting
+        if self.is_recording:
+            # The child died while recording (e.g. a crash in a native library)
+            self.is_recording = False
+            self._died = True
+            self._report_error("Recording Error", "The recording process exited unexpectedly.")
+            if self.on_failure:
+                self.on_failure()
+
+    def _report_error(self, title, message):
+        if self.on_error:
+            self.on_error(title, message)
+        else:
+            print(f"{title}: {message}")
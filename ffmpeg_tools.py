@@ -0,0 +1,64 @@
+import subprocess
+import sys
+import threading
+
+FFMPEG = "ffmpeg" # Must be installed and in PATH
+
+# FFmpeg raw PCM formats by sample width in bytes (PyAudio integer formats)
+PCM_FORMATS = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}
+
+
+def _hidden_window_kwargs():
+    """On Windows, keeps FFmpeg from flashing a console window."""
+    if sys.platform == "win32":
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        return {"startupinfo": startupinfo}
+    return {}
+
+
+def ffmpeg_popen(args, **kwargs):
+    """Starts a long-running FFmpeg process; raises FileNotFoundError when FFmpeg is missing."""
+    command = [FFMPEG, "-hide_banner", "-loglevel", "error"] + list(args)
+    return subprocess.Popen(command, **_hidden_window_kwargs(), **kwargs)
+
+
+def run_ffmpeg(args, on_progress=None):
+    """
+    Runs FFmpeg to completion; returns the CompletedProcess (stderr captured, no exception on failure).
+    With on_progress, FFmpeg reports its progress on stdout (-progress) and on_progress(seconds) is
+    called with the output time written so far, about twice a second.
+    """
+    if on_progress is None:
+        command = [FFMPEG, "-hide_banner"] + list(args)
+        return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **_hidden_window_kwargs())
+
+    command = [FFMPEG, "-hide_banner", "-nostats", "-progress", "pipe:1"] + list(args)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **_hidden_window_kwargs())
+    stderr = []
+    # Read stderr alongside, so a chatty FFmpeg never blocks on a full pipe while we read progress
+    stderr_reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), name="ffmpeg-stderr", daemon=True)
+    stderr_reader.start()
+    out_seconds = None
+    for line in process.stdout:
+        key, _, value = line.decode(errors="ignore").strip().partition("=")
+        if key in ("out_time_us", "out_time_ms"): # Both are microseconds (out_time_ms is misnamed)
+            try:
+                out_seconds = int(value) / 1e6
+            except ValueError:
+                pass # "N/A" before the first packet
+        elif key == "progress" and out_seconds is not None: # Ends every progress block
+            on_progress(out_seconds)
+    process.wait()
+    stderr_reader.join()
+    return subprocess.CompletedProcess(command, process.returncode, b"", b"".join(stderr))
+
+
+def audio_sync_filter(offset, actual_rate, rate):
+    """
+    Audio filter placing a recorded audio file on the video's timeline: each sample gets an explicit
+    timestamp from the measured sample rate and start offset (see frame_clock.estimate_audio_sync),
+    and aresample stretches, pads or trims the stream to honour them at the nominal rate.
+    """
+    return (f"asetpts=(N/{actual_rate:.6f}+{offset:.6f})/TB,"
+            f"aresample={rate}:async=1000:first_pts=0")
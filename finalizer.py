@@ -0,0 +1,124 @@
+import collections
+import threading
+import time
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+def format_eta(seconds):
+    """Formats a remaining time as m:ss (or h:mm:ss)."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class FinalizationJob:
+    """
+    One recording being finished in the background. work(report_progress) does the job and
+    returns its result; report_progress(fraction) may be called with 0..1 (or None when the total
+    is unknown) as it goes. The fields are written by the queue's worker thread only.
+    """
+    def __init__(self, name, work):
+        self.name = name
+        self.work = work
+        self.state = JOB_QUEUED
+        self.progress = None # Fraction done, when known
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def eta(self):
+        """Estimated seconds left, from the time spent so far and the progress; None when unknown."""
+        if self.state != JOB_RUNNING or not self.progress or self.started is None:
+            return None
+        elapsed = time.monotonic() - self.started
+        return elapsed * (1.0 - self.progress) / self.progress
+
+    def describe(self):
+        """One line for a status display, e.g. "demo.mp4: 42% (ETA 0:07)"."""
+        if self.state == JOB_QUEUED:
+            return f"{self.name}: waiting"
+        if self.state == JOB_RUNNING:
+            if self.progress is None:
+                return f"{self.name}: finalizing..."
+            eta = self.eta()
+            text = f"{self.name}: {self.progress * 100:.0f}%"
+            return text + (f" (ETA {format_eta(eta)})" if eta is not None else "")
+        return f"{self.name}: {'done' if self.state == JOB_DONE else 'failed'}"
+
+
+class FinalizationQueue:
+    """
+    Runs FinalizationJobs one after another on a background thread, so stopping a recording never
+    waits for FFmpeg and a new recording can start while earlier ones are still being merged.
+    on_update(job) is called from the worker thread whenever a job starts, reports progress or
+    finishes. The worker only runs while there are jobs and is not a daemon thread, so exiting the
+    program still lets the queued recordings finish.
+    """
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self.jobs = [] # Every submitted job, in order
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, name, work):
+        """Queues work(report_progress) and returns its FinalizationJob."""
+        job = FinalizationJob(name, work)
+        with self._lock:
+            self.jobs.append(job)
+            self._queue.append(job)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="finalizer")
+                self._worker.start()
+        self._notify(job)
+        return job
+
+    def pending(self):
+        """Jobs that are waiting or running."""
+        with self._lock:
+            return [job for job in self.jobs if job.state in (JOB_QUEUED, JOB_RUNNING)]
+
+    def wait(self):
+        """Blocks until every submitted job has finished."""
+        with self._lock:
+            worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._worker = None
+                    return
+                job = self._queue.popleft()
+            job.state = JOB_RUNNING
+            job.started = time.monotonic()
+            self._notify(job)
+
+            def report_progress(fraction, job=job):
+                job.progress = None if fraction is None else min(max(fraction, 0.0), 1.0)
+                self._notify(job)
+
+            try:
+                job.result = job.work(report_progress)
+                job.state = JOB_DONE
+            except Exception as e:
+                job.error = e
+                job.state = JOB_FAILED
+                print(f"Finalization of {job.name} failed: {e}") # Debugging
+            job.finished = time.monotonic()
+            self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                print(f"Finalization update failed: {e}") # Debugging; e.g. the window is already gone
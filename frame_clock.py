@@ -0,0 +1,171 @@
+import csv
+import threading
+import time
+
+
+class SessionClock:
+    """
+    Monotonic clock shared by every thread of one recording.
+    now() is the recording time in seconds since start(), not counting pauses, so video frames and
+    audio chunks stamped with it line up no matter which thread captured them or when it started.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._origin = None
+        self._paused_total = 0.0
+        self._paused_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self):
+        return self._origin is not None
+
+    def start(self):
+        with self._lock:
+            self._origin = self._clock()
+            self._paused_total = 0.0
+            self._paused_at = None
+
+    def pause(self):
+        with self._lock:
+            if self._paused_at is None:
+                self._paused_at = self._clock()
+
+    def resume(self):
+        with self._lock:
+            if self._paused_at is not None:
+                self._paused_total += self._clock() - self._paused_at
+                self._paused_at = None
+
+    def now(self):
+        """Recording time in seconds, not counting pauses."""
+        with self._lock:
+            now = self._paused_at if self._paused_at is not None else self._clock()
+            return now - self._origin - self._paused_total
+
+
+class FrameScheduler:
+    """
+    Paces frame capture against absolute deadlines on a SessionClock.
+
+    Frame n is due at n / fps seconds of recording time, where recording time excludes pauses, so
+    a slow frame never shifts the frames after it. When capture falls behind, wait_for_next_frame()
+    reports how many frame slots went by without a capture; the caller fills them with repeats so
+    the number of frames written always equals recording time * fps and the video keeps the
+    duration (and the container fps) it was recorded with. Frame n of the file therefore shows the
+    screen at session time n / fps.
+    """
+    def __init__(self, fps, clock=None, sleep=time.sleep):
+        self.fps = fps
+        self.clock = clock if clock is not None else SessionClock()
+        self.frame_index = 0 # Next frame slot to be filled
+        self._sleep = sleep
+
+    def start(self):
+        """Starts pacing; a shared clock that is already running keeps its origin."""
+        if not self.clock.started:
+            self.clock.start()
+        self.frame_index = 0
+
+    def pause(self):
+        self.clock.pause()
+
+    def resume(self):
+        self.clock.resume()
+
+    def elapsed(self):
+        """Recording time in seconds, not counting pauses."""
+        return self.clock.now()
+
+    def wait_for_next_frame(self):
+        """
+        Sleeps until the next frame is due and claims its slot.
+        Returns the number of earlier slots that passed without a capture (0 when on time).
+        """
+        delay = self.frame_index / self.fps - self.clock.now()
+        if delay > 0:
+            self._sleep(delay)
+
+        due_index = int(self.clock.now() * self.fps) # Slot the capture about to happen falls into
+        missed = max(0, due_index - self.frame_index)
+        self.frame_index = max(self.frame_index, due_index) + 1
+        return missed
+
+
+class TimestampLog:
+    """
+    Sidecar CSV with the session-clock time of every captured video frame and audio chunk.
+    Rows are "video,<frame slot>,1,<time>" and "audio,<first sample>,<samples>,<time>", the time
+    being when the frame was grabbed or the chunk's first sample was recorded. The merge step reads
+    it back (see estimate_audio_sync) to line the audio up with the video.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(["stream", "index", "count", "time"])
+        self._lock = threading.Lock()
+
+    def video(self, frame_index, timestamp):
+        with self._lock:
+            self._writer.writerow(["video", frame_index, 1, f"{timestamp:.6f}"])
+
+    def audio(self, first_sample, samples, timestamp):
+        with self._lock:
+            self._writer.writerow(["audio", first_sample, samples, f"{timestamp:.6f}"])
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    @staticmethod
+    def load(filename):
+        """Returns {"video": [(index, count, time)], "audio": [(index, count, time)]}."""
+        rows = {"video": [], "audio": []}
+        with open(filename, newline="") as f:
+            for row in csv.DictReader(f):
+                rows[row["stream"]].append((int(row["index"]), int(row["count"]), float(row["time"])))
+        return rows
+
+
+def estimate_audio_sync(audio_rows, rate, min_span=10.0, max_drift=0.01):
+    """
+    Fits the audio chunk stamps from a TimestampLog to find where the audio file belongs on the
+    video's timeline. Returns (offset, actual_rate): the session time of the first audio sample,
+    and the sample rate the microphone really ran at measured against the session clock (equal to
+    rate when the recording is too short to tell, or the estimate is implausible).
+    """
+    if not audio_rows:
+        return 0.0, rate
+    # Least-squares line through (nominal time of the chunk's first sample, measured time)
+    xs = [first_sample / rate for first_sample, _, _ in audio_rows]
+    ys = [timestamp for _, _, timestamp in audio_rows]
+    count = len(xs)
+    mean_x = sum(xs) / count
+    mean_y = sum(ys) / count
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    if spread == 0 or xs[-1] - xs[0] < min_span:
+        return ys[0] - xs[0], rate
+
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+    if abs(slope - 1.0) > max_drift:
+        slope = 1.0 # Pauses or a stalled stream, not clock drift; keep the nominal rate
+    offset = mean_y - slope * mean_x
+    return offset, rate / slope
+
+
+def align_audio_chunk(data, timestamp, samples_written, rate, frame_bytes, tolerance=0.04):
+    """
+    For audio that cannot be corrected after recording (piped live into the encoder): pads the
+    chunk with leading silence, or drops its first samples, when the stream has drifted more than
+    tolerance seconds from the session clock. timestamp is the session time of the chunk's first
+    sample and samples_written the number of samples sent so far. Returns the data to send.
+    """
+    expected = int(round(timestamp * rate))
+    difference = expected - samples_written
+    if abs(difference) <= tolerance * rate:
+        return data
+    if difference > 0:
+        return b"\0" * (difference * frame_bytes) + data # Audio is behind the video: insert silence
+    return data[-difference * frame_bytes:] # Audio is ahead: skip the samples that overlap
@@ -0,0 +1,301 @@
+import bisect
+import collections
+import csv
+import os
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+from ffmpeg_tools import run_ffmpeg
+
+# One video frame of a file: its number in decode order, presentation time in seconds, the byte
+# offset and size of its compressed data in the file (None when unknown) and whether it is a keyframe
+IndexEntry = collections.namedtuple("IndexEntry", "frame pts offset size keyframe")
+INDEX_SUFFIX = ".index.csv"
+MP4_EXTENSIONS = (".mp4", ".m4v", ".mov")
+JPEG_SOI = b"\xff\xd8" # Start of every JPEG, i.e. of every MJPG frame
+
+
+def index_filename(video_filename):
+    """Sidecar index of a video file, next to it (like the .timestamps.csv sidecar)."""
+    return os.path.splitext(video_filename)[0] + INDEX_SUFFIX
+
+
+class FrameIndexLog:
+    """
+    Index sidecar written while recording, one CSV row per frame as it is written (see
+    MjpegAviWriter): "frame,pts,offset,size,keyframe". Rows already written survive a crash.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(IndexEntry._fields)
+        self._lock = threading.Lock()
+
+    def add(self, frame, pts, offset, size, keyframe):
+        with self._lock:
+            self._writer.writerow([frame, f"{pts:.6f}", "" if offset is None else offset,
+                                   "" if size is None else size, int(keyframe)])
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def write_index(filename, entries):
+    log = FrameIndexLog(filename)
+    try:
+        for entry in entries:
+            log.add(*entry)
+    finally:
+        log.close()
+
+
+def load_index(filename):
+    """Reads an index sidecar back into a list of IndexEntry."""
+    entries = []
+    with open(filename, newline="") as f:
+        for row in csv.DictReader(f):
+            entries.append(IndexEntry(int(row["frame"]), float(row["pts"]),
+                                      int(row["offset"]) if row["offset"] else None,
+                                      int(row["size"]) if row["size"] else None, row["keyframe"] == "1"))
+    return entries
+
+
+# --- MP4 sample tables ---
+
+def _boxes(data, start=0, end=None):
+    """Yields (type, payload start, payload end) of the boxes in data[start:end]."""
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield box_type, start + header, min(start + size, end)
+        start += size
+
+
+def _child(data, start, end, *path):
+    """Payload range of the first box along path below data[start:end], or None."""
+    for box_type in path:
+        for child_type, child_start, child_end in _boxes(data, start, end):
+            if child_type == box_type:
+                start, end = child_start, child_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _table(data, box, entry_format):
+    """Entries of a full box holding a counted table (stts, ctts, stss, stsc, stco, co64)."""
+    start, _ = box
+    count = struct.unpack_from(">I", data, start + 4)[0]
+    entry = struct.Struct(">" + entry_format)
+    return [entry.unpack_from(data, start + 8 + i * entry.size) for i in range(count)]
+
+
+def _read_moov(filename):
+    """The 'moov' box of an MP4/MOV file, read without touching the media data."""
+    with open(filename, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        position = 0
+        while position + 8 <= file_size:
+            f.seek(position)
+            header = f.read(16)
+            size, box_type = struct.unpack_from(">I4s", header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack_from(">Q", header, 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - position
+            if size < header_size:
+                break
+            if box_type == b"moov":
+                f.seek(position + header_size)
+                return f.read(size - header_size)
+            position += size # Skips 'mdat' whatever its size
+    raise ValueError(f"{filename} has no MP4 'moov' box (unfinished or not an MP4 file).")
+
+
+def read_mp4_index(filename):
+    """
+    Builds the index of the first video track of an MP4/MOV file from its sample tables. Only
+    the 'moov' box is read, so this takes about the same time for any recording length.
+    """
+    moov = _read_moov(filename)
+    for box_type, start, end in _boxes(moov):
+        if box_type != b"trak":
+            continue
+        mdia = _child(moov, start, end, b"mdia")
+        hdlr = mdia and _child(moov, *mdia, b"hdlr")
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        mdhd = _child(moov, *mdia, b"mdhd")
+        version = moov[mdhd[0]]
+        timescale = struct.unpack_from(">I", moov, mdhd[0] + (20 if version == 1 else 12))[0]
+        stbl = _child(moov, *mdia, b"minf", b"stbl")
+
+        # Decode times, plus composition offsets where frames are reordered (B-frames)
+        decode_times = []
+        time = 0
+        for count, delta in _table(moov, _child(moov, *stbl, b"stts"), "II"):
+            for _ in range(count):
+                decode_times.append(time)
+                time += delta
+        offsets = [0] * len(decode_times)
+        ctts = _child(moov, *stbl, b"ctts")
+        if ctts:
+            ctts_version = moov[ctts[0]]
+            sample = 0
+            for count, offset in _table(moov, ctts, "Ii" if ctts_version else "II"):
+                offsets[sample:sample + count] = [offset] * count
+                sample += count
+        # An edit list moves the first frame to time 0 (FFmpeg delays reordered streams this way)
+        shift = 0
+        elst = _child(moov, start, end, b"edts", b"elst")
+        if elst:
+            elst_version = moov[elst[0]]
+            for entry in _table(moov, elst, "QqI" if elst_version else "IiI"):
+                if entry[1] >= 0: # Skips empty edits
+                    shift = entry[1]
+                    break
+
+        stsz = _child(moov, *stbl, b"stsz")
+        sample_size, sample_count = struct.unpack_from(">II", moov, stsz[0] + 4)
+        sizes = ([sample_size] * sample_count if sample_size else
+                 list(struct.unpack_from(f">{sample_count}I", moov, stsz[0] + 12)))
+        stss = _child(moov, *stbl, b"stss")
+        keyframes = {number - 1 for number, in _table(moov, stss, "I")} if stss else None # None: all keyframes
+        stco = _child(moov, *stbl, b"stco")
+        chunk_offsets = [offset for offset, in (_table(moov, stco, "I") if stco else
+                                                 _table(moov, _child(moov, *stbl, b"co64"), "Q"))]
+
+        # Byte offset of every sample from its chunk's offset and the sizes before it in the chunk
+        stsc = _table(moov, _child(moov, *stbl, b"stsc"), "III")
+        entries = []
+        sample = 0
+        for i, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+            last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+            for chunk in range(first_chunk - 1, last_chunk):
+                offset = chunk_offsets[chunk]
+                for _ in range(samples_per_chunk):
+                    if sample >= sample_count:
+                        break
+                    pts = (decode_times[sample] + offsets[sample] - shift) / timescale
+                    entries.append(IndexEntry(sample, round(pts, 6), offset, sizes[sample],
+                                              keyframes is None or sample in keyframes))
+                    offset += sizes[sample]
+                    sample += 1
+        return entries
+    raise ValueError(f"{filename} has no video track.")
+
+
+def build_index(video_filename):
+    """Writes the index sidecar of a finished MP4/MOV file and returns its entries."""
+    entries = read_mp4_index(video_filename)
+    write_index(index_filename(video_filename), entries)
+    return entries
+
+
+def get_index(video_filename):
+    """
+    The index of video_filename: its sidecar when it is at least as new as the video, else one
+    read from the file itself (MP4/MOV only; the sidecar is then written). None if neither works.
+    """
+    sidecar = index_filename(video_filename)
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(video_filename):
+        return load_index(sidecar)
+    if os.path.splitext(video_filename)[1].lower() in MP4_EXTENSIONS:
+        try:
+            return build_index(video_filename)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Could not index {video_filename}: {e}") # Debugging; callers fall back to FFmpeg seeking
+    return None
+
+
+def _by_time(entries):
+    """Entries with data, in presentation order."""
+    return sorted((entry for entry in entries if entry.size != 0), key=lambda entry: entry.pts)
+
+
+def frame_at(entries, seconds):
+    """The frame shown at seconds: the last one presented at or before it."""
+    ordered = _by_time(entries)
+    position = bisect.bisect_right([entry.pts for entry in ordered], seconds + 1e-6)
+    return ordered[max(0, position - 1)] if ordered else None
+
+
+def keyframe_at(entries, seconds):
+    """The last keyframe presented at or before seconds (where a stream copy can start)."""
+    keyframes = [entry for entry in _by_time(entries) if entry.keyframe]
+    position = bisect.bisect_right([entry.pts for entry in keyframes], seconds + 1e-6)
+    return keyframes[max(0, position - 1)] if keyframes else None
+
+
+def trim_video(input_filename, output_filename, start, end=None, on_progress=None):
+    """
+    Copies start..end seconds of a recording into output_filename without re-encoding. The start
+    moves back to the keyframe before it (every frame is one in MJPG recordings), found in the
+    index, and FFmpeg seeks straight to it, so the time taken depends on the length kept, not on
+    the recording's. Returns the (start, end) actually kept; raises RuntimeError if FFmpeg fails.
+    """
+    entries = get_index(input_filename)
+    keyframe = keyframe_at(entries, start) if entries else None
+    if keyframe is not None:
+        start = keyframe.pts
+    args = ["-y", "-ss", f"{start:.6f}", "-i", input_filename]
+    if end is not None:
+        args += ["-t", f"{max(end - start, 0.0):.6f}"]
+    args += ["-map", "0", "-c", "copy", "-avoid_negative_ts", "make_zero", output_filename]
+    process = run_ffmpeg(args, on_progress)
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg could not trim {input_filename}:\n{process.stderr.decode(errors='ignore')}")
+    if os.path.splitext(output_filename)[1].lower() in MP4_EXTENSIONS:
+        build_index(output_filename)
+    return start, end
+
+
+def extract_thumbnail(video_filename, image_filename, seconds=0.0, width=None):
+    """
+    Saves the frame shown at seconds as an image, scaled to width pixels if given. MJPG frames are
+    read straight from their byte range in the index (one JPEG, no decoding unless scaled); other
+    codecs are decoded by FFmpeg from the nearest keyframe only.
+    """
+    entries = get_index(video_filename)
+    entry = frame_at(entries, seconds) if entries else None
+    if entry is not None and entry.offset is not None and entry.size:
+        with open(video_filename, "rb") as f:
+            f.seek(entry.offset)
+            data = f.read(entry.size)
+        if data.startswith(JPEG_SOI):
+            if width is None and os.path.splitext(image_filename)[1].lower() in (".jpg", ".jpeg"):
+                with open(image_filename, "wb") as f:
+                    f.write(data)
+                return image_filename
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                if width:
+                    height = max(1, round(image.shape[0] * width / image.shape[1]))
+                    image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+                if not cv2.imwrite(image_filename, image):
+                    raise RuntimeError(f"Could not write {image_filename}")
+                return image_filename
+    args = ["-y", "-ss", f"{seconds:.6f}", "-i", video_filename, "-frames:v", "1"]
+    if width:
+        args += ["-vf", f"scale={width}:-2"]
+    process = run_ffmpeg(args + [image_filename])
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg could not extract a frame:\n{process.stderr.decode(errors='ignore')}")
+    return image_filename
@@ -0,0 +1,499 @@
+import collections
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from capture_backends import PIXEL_CHANNELS
+from frame_clock import FrameScheduler
+from metrics import QUEUE_DEPTH_BUCKETS
+
+# Backpressure policies for when the encoders fall behind the capture thread
+BACKPRESSURE_DROP_OLDEST = "drop_oldest" # Replace the oldest queued frame by a repeat, capture never waits
+BACKPRESSURE_BLOCK = "block"             # Capture waits for a free slot, no frame is lost
+BACKPRESSURE_MODES = (BACKPRESSURE_DROP_OLDEST, BACKPRESSURE_BLOCK)
+
+# Conversion applied by the encoders to reach OpenCV's BGR, per capture pixel format
+_TO_BGR = {"RGB": cv2.COLOR_RGB2BGR, "BGRA": cv2.COLOR_BGRA2BGR, "BGR": None}
+
+# Interpolation of the optional downscale stage: "area" averages every source pixel (sharpest text,
+# no moire), "linear" samples 2x2 pixels and is cheaper at large reductions
+INTERPOLATIONS = {"area": cv2.INTER_AREA, "linear": cv2.INTER_LINEAR}
+
+
+def scaled_frame_size(frame_size, target_size=None, scale=None):
+    """
+    Output (width, height) for a capture of frame_size, given a target_size (width, height; either
+    may be None to keep the aspect ratio) or a scale factor. Rounded to even numbers, which
+    yuv420p encoders need; never larger than the capture. Returns frame_size when neither is set.
+    """
+    width, height = frame_size
+    if target_size:
+        target_width, target_height = target_size
+        if target_width and target_height:
+            factor_x, factor_y = target_width / width, target_height / height
+        else:
+            factor_x = factor_y = target_width / width if target_width else target_height / height
+    elif scale:
+        factor_x = factor_y = scale
+    else:
+        return frame_size
+    factor_x, factor_y = min(factor_x, 1.0), min(factor_y, 1.0) # Upscaling only adds bytes
+    if factor_x == 1.0 and factor_y == 1.0:
+        return frame_size
+    return max(2, int(round(width * factor_x / 2)) * 2), max(2, int(round(height * factor_y / 2)) * 2)
+
+
+class FrameRingBuffer:
+    """
+    Bounded ring of preallocated frames shared by the capture thread and the encoder threads.
+    The producer fills a free slot in place and commits it; consumers take committed slots in
+    capture order and hand them back with release() once they are done with the pixels.
+    Repeats of the previous frame are queued without a slot (see commit_duplicate()), and one
+    slot at a time can be pinned to keep its pixels after release (see pin()).
+    """
+    def __init__(self, depth, frame_shape, dtype=np.uint8, backpressure=BACKPRESSURE_DROP_OLDEST):
+        if depth < 2:
+            raise ValueError("Frame queue depth must be at least 2.")
+        if backpressure not in BACKPRESSURE_MODES:
+            raise ValueError(f"Unknown backpressure mode: {backpressure}")
+
+        self.frames = [np.empty(frame_shape, dtype=dtype) for _ in range(depth)] # Allocated once, reused for every frame
+        self.depth = depth
+        self.backpressure = backpressure
+        self.dropped_frames = 0 # Frames turned into repeats before an encoder could take them
+
+        self._free = collections.deque(range(depth))
+        self._ready = collections.deque() # (slot, meta) in capture order; slot is None for repeats
+        self._next_ticket = 0 # Write order handed out to consumers
+        self._pinned = None # Slot kept out of the free list after its release, see pin()
+        self._pinned_released = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Returns the index of a slot the producer may fill, or None once the ring is closed."""
+        with self._cond:
+            while not self._closed:
+                if self._free:
+                    return self._free.popleft()
+                if self.backpressure == BACKPRESSURE_DROP_OLDEST:
+                    for index, (slot, meta) in enumerate(self._ready):
+                        if slot is not None:
+                            # Reuse the oldest queued frame; its place in the output becomes a repeat
+                            self._ready[index] = (None, meta)
+                            self.dropped_frames += 1
+                            if slot == self._pinned:
+                                self._pinned = None # Its pixels are about to be overwritten
+                            return slot
+                self._cond.wait()
+            return None
+
+    def commit(self, slot, meta=None):
+        """Publishes a filled slot to the consumers."""
+        with self._cond:
+            self._ready.append((slot, meta))
+            self._cond.notify_all()
+
+    def commit_duplicate(self, meta=None):
+        """Queues a repeat of the previous frame; it takes a ticket but no slot."""
+        self.commit(None, meta)
+
+    def take(self):
+        """
+        Blocks until a frame is available and returns (slot, ticket, meta), slot being None for
+        a repeat of the previous frame. Tickets increase by one per taken frame so consumers can
+        restore capture order. Returns None once the ring is closed and fully drained.
+        """
+        with self._cond:
+            while not self._ready:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            slot, meta = self._ready.popleft()
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            return slot, ticket, meta
+
+    def release(self, slot):
+        """Returns a slot to the producer once its pixels are no longer needed."""
+        with self._cond:
+            if slot == self._pinned:
+                self._pinned_released = True # Freed by the next pin()/unpin()
+                return
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def pin(self, slot):
+        """
+        Keeps slot's pixels after the consumers release it, until the next pin() or unpin(), so
+        the producer can compare later frames against it without copying it. Call before commit().
+        """
+        with self._cond:
+            self._unpin()
+            self._pinned = slot
+            self._pinned_released = False
+
+    def unpin(self):
+        with self._cond:
+            self._unpin()
+
+    def _unpin(self):
+        if self._pinned is not None and self._pinned_released:
+            self._free.append(self._pinned)
+            self._cond.notify_all()
+        self._pinned = None
+
+    def queued(self):
+        """Number of frames captured but not yet taken by an encoder."""
+        with self._cond:
+            return len(self._ready)
+
+    def close(self):
+        """Stops the producer; consumers keep draining what is already queued."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FrameChangeDetector:
+    """
+    Decides whether a captured frame differs from the last frame that was actually encoded.
+    The comparison is a single vectorized max-abs-difference pass (cv2.norm with NORM_INF), which
+    costs far less than JPEG-compressing the frame, against a private copy of the last kept frame
+    (or, with copy_reference=False, against the kept frame itself, which the caller must leave
+    untouched until the next changed frame or reset(), e.g. a pinned FrameRingBuffer slot).
+    A frame also counts as changed when its overlay data (e.g. the cursor position) changed, and
+    every max_repeat unchanged frames one is encoded anyway so players can resync and seek.
+    """
+    def __init__(self, frame_shape, threshold=0, max_repeat=None, copy_reference=True):
+        self.threshold = threshold   # Largest per-channel difference still treated as "unchanged"
+        self.max_repeat = max_repeat # None: repeat indefinitely
+        self.copy_reference = copy_reference
+        self._previous = np.empty(frame_shape, dtype=np.uint8) if copy_reference else None
+        self._previous_meta = None
+        self._has_previous = False
+        self._repeats = 0
+
+    def is_changed(self, frame, meta=None):
+        """Returns True if frame must be encoded, and remembers it as the new reference."""
+        changed = (not self._has_previous
+                   or meta != self._previous_meta
+                   or (self.max_repeat is not None and self._repeats >= self.max_repeat)
+                   or cv2.norm(frame, self._previous, cv2.NORM_INF) > self.threshold)
+        if changed:
+            if self.copy_reference:
+                np.copyto(self._previous, frame)
+            else:
+                self._previous = frame
+            self._previous_meta = meta
+            self._has_previous = True
+            self._repeats = 0
+        else:
+            self._repeats += 1
+        return changed
+
+    def reset(self):
+        """Forces the next frame to be encoded (e.g. after a pause)."""
+        self._has_previous = False
+        if not self.copy_reference:
+            self._previous = None
+
+
+class FramePipeline:
+    """
+    Capture -> encode pipeline for the screen recorder.
+    run() executes the capture loop on the calling thread and grabs frames into a FrameRingBuffer,
+    while one or more encoder threads convert them to BGR, draw the overlay and hand them to the
+    writer in capture order. A slow write therefore no longer delays the next grab.
+    With a FrameChangeDetector, frames identical to the previous one are not queued or encoded at
+    all; the writer is asked for write_duplicate() instead, keeping the output's timing intact.
+    Capture is paced by a FrameScheduler: frame slots missed while capture was late, and frames
+    dropped by the ring, are written as repeats, so the output always holds one frame per
+    1 / fps of recording time and plays back at the speed it was recorded.
+    Pixels are never allocated per frame: frames are grabbed into the ring, converted into
+    per-thread buffers and compared against a pinned ring slot, and copied_bytes counts the few
+    whole-frame copies still made. With output_size, the encoder threads also downscale every
+    frame (see scaled_frame_size) before the overlay and the writer see it.
+    """
+    def __init__(self, grab_frame, writer, frame_size, fps, queue_depth=8,
+                 backpressure=BACKPRESSURE_DROP_OLDEST, encoder_threads=1,
+                 overlay=None, on_frame=None, pixel_format="RGB", skip_unchanged=False,
+                 max_repeat=None, clock=None, timestamp_log=None, metrics=None, output_size=None,
+                 interpolation=cv2.INTER_AREA):
+        """
+        grab_frame(dst) fills dst (laid out in pixel_format, see capture_backends) with the next
+        screenshot and may return
+        per-frame data for overlay(frame, meta), which draws on the BGR frame before it is written.
+        writer needs write(frame) and write_duplicate() (see video_writers); if it also has encode(frame) -> packet and write_packet(packet) (see
+        video_writers.MjpegAviWriter), compression runs in parallel on the encoder threads; a writer's
+        allocate_frame() -> BGR array, if present, supplies each encoder thread's conversion buffer,
+        and a writer's write_borrowed(frame) is used instead of write(frame) when present: every
+        encoder thread alternates between two buffers, so a frame passed to it stays unchanged
+        until a later frame has been written and the writer can keep it instead of a copy. A
+        writer's write_timed(frame, timestamp) (see raw_spool.RawSpoolWriter) is preferred over
+        both and also receives the frame's grab time in recording seconds.
+        on_frame(frame_count, elapsed) is called from the capture thread after every captured frame,
+        elapsed being the recording time without pauses. clock is the recording's SessionClock
+        (shared with the audio thread); every grab is stamped with it into timestamp_log if given.
+        With a metrics.MetricsRegistry, the time spent in every stage and the queue depth are
+        recorded as histograms.
+        frame_size is the size grab_frame() captures; output_size (width, height), when given and
+        different, is the size frames are resized to with interpolation (a cv2.INTER_* flag) and
+        the size the writer must expect. overlay() then receives the resized frame.
+        capture_interval may be raised while recording (see quality_governor) to capture only
+        every n-th frame slot; the slots in between repeat the previous frame, so the video keeps
+        its fps and duration at a fraction of the capture and encoding cost.
+        """
+        width, height = frame_size
+        self.output_size = tuple(output_size) if output_size and tuple(output_size) != tuple(frame_size) else None
+        self.interpolation = interpolation
+        self.grab_frame = grab_frame
+        self.writer = writer
+        self.fps = fps
+        self.overlay = overlay
+        self.on_frame = on_frame
+        self.encoder_threads = max(1, int(encoder_threads))
+        self.pixel_format = pixel_format
+        self.capture_interval = 1
+        frame_shape = (height, width, PIXEL_CHANNELS[pixel_format])
+        # The change detector keeps its reference frame pinned in the ring, so it gets a slot of its own
+        self.ring = FrameRingBuffer(queue_depth + 1 if skip_unchanged else queue_depth, frame_shape,
+                                    backpressure=backpressure)
+        self._grab_times = [0.0] * len(self.ring.frames) # Grab time of the frame in each ring slot
+        self.change_detector = FrameChangeDetector(frame_shape, max_repeat=max_repeat,
+                                                   copy_reference=False) if skip_unchanged else None
+        self.scheduler = FrameScheduler(fps, clock)
+        self.timestamp_log = timestamp_log
+        self.metrics = metrics
+        if metrics is not None:
+            self._grab_seconds = metrics.histogram("grab_seconds", "Time to grab one frame into the ring buffer.")
+            self._convert_seconds = metrics.histogram("convert_seconds", "Time to convert one frame to BGR.")
+            self._scale_seconds = metrics.histogram("scale_seconds", "Time to downscale one frame.")
+            self._encode_seconds = metrics.histogram("encode_seconds", "Time to compress one frame before writing.")
+            self._write_seconds = metrics.histogram("write_seconds", "Time to write one frame or repeat to the output.")
+            self._queue_depth = metrics.histogram("queue_depth", "Frames waiting for an encoder at each capture.",
+                                                  QUEUE_DEPTH_BUCKETS)
+
+        self.captured_frames = 0
+        self.written_frames = 0
+        self.unchanged_frames = 0 # Captured frames written as repeats because the screen did not change
+        self.late_frames = 0 # Captures that started after their frame slot had already passed
+        self.duplicated_frames = 0 # Repeats written for the frame slots those late captures missed
+        self.skipped_frames = 0 # Frame slots left to repeats by a capture_interval above 1
+        self.copied_bytes = 0 # Pixels copied as-is between frame buffers (conversions excluded)
+        self.error = None
+
+        self._running = threading.Event()
+        self._paused = threading.Event()
+        self._write_turn = 0
+        self._write_cond = threading.Condition()
+        self._encoders = []
+
+    def pause(self):
+        self.scheduler.pause()
+        self._paused.set()
+
+    def resume(self):
+        self._reset_change_detector()
+        self.scheduler.resume()
+        self._paused.clear()
+
+    def stop(self):
+        """Asks the capture loop to finish; queued frames are still written by run()."""
+        self._running.clear()
+
+    def stats(self):
+        """Snapshot of the pipeline counters."""
+        return {
+            "captured": self.captured_frames,
+            "written": self.written_frames,
+            "unchanged": self.unchanged_frames,
+            "duplicated": self.duplicated_frames,
+            "skipped": self.skipped_frames,
+            "dropped": self.ring.dropped_frames,
+            "late": self.late_frames,
+            "queued": self.ring.queued(),
+            "copied_bytes": self.copied_bytes,
+        }
+
+    def run(self):
+        """Runs the capture loop until stop() and waits for the encoders to drain the queue."""
+        self._running.set()
+        self._encoders = [threading.Thread(target=self._encode_loop, name=f"encoder-{i}", daemon=True)
+                          for i in range(self.encoder_threads)]
+        for encoder in self._encoders:
+            encoder.start()
+
+        try:
+            self._capture_loop()
+        finally:
+            self.ring.close()
+            for encoder in self._encoders:
+                encoder.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def _capture_loop(self):
+        scheduler = self.scheduler
+        scheduler.start()
+        if self._paused.is_set():
+            scheduler.pause() # Paused before the first frame
+
+        while self._running.is_set():
+            if self._paused.is_set():
+                time.sleep(0.1) # Small sleep to prevent busy-waiting when paused
+                continue
+
+            missed = scheduler.wait_for_next_frame()
+            if not self._running.is_set():
+                break
+            if missed:
+                # Fell behind: repeat the previous frame for every slot that went by
+                self.late_frames += 1
+                self.duplicated_frames += missed
+                for _ in range(missed):
+                    self.ring.commit_duplicate()
+            if (scheduler.frame_index - 1) % self.capture_interval:
+                self.ring.commit_duplicate() # Reduced frame rate: this slot repeats the last capture
+                self.skipped_frames += 1
+                continue
+
+            dropped_frames = self.ring.dropped_frames
+            slot = self.ring.acquire()
+            if slot is None:
+                break
+            if self.change_detector and self.ring.dropped_frames != dropped_frames:
+                self._reset_change_detector() # The reference frame may never reach the writer
+            grab_time = scheduler.elapsed()
+            self._grab_times[slot] = grab_time
+            grab_start = time.perf_counter()
+            try:
+                meta = self.grab_frame(self.ring.frames[slot])
+            except Exception:
+                self.ring.release(slot)
+                raise
+            if self.metrics is not None:
+                self._grab_seconds.observe(time.perf_counter() - grab_start)
+                self._queue_depth.observe(self.ring.queued())
+            if self.timestamp_log:
+                self.timestamp_log.video(scheduler.frame_index - 1, grab_time)
+            if self.change_detector and not self.change_detector.is_changed(self.ring.frames[slot], meta):
+                self.ring.release(slot)
+                self.ring.commit_duplicate(meta)
+                self.unchanged_frames += 1
+            else:
+                if self.change_detector:
+                    self.ring.pin(slot) # The new reference; pinned before an encoder can release it
+                self.ring.commit(slot, meta)
+
+            self.captured_frames += 1
+            elapsed_time = scheduler.elapsed()
+            if self.on_frame and elapsed_time > 0:
+                self.on_frame(self.captured_frames, elapsed_time)
+
+    def _encode_loop(self):
+        height, width, channels = self.ring.frames[0].shape
+        output_size = self.output_size
+        if output_size:
+            width, height = output_size
+        allocate_frame = getattr(self.writer, "allocate_frame", None) # e.g. shared memory (mjpeg_pool)
+        write_borrowed = getattr(self.writer, "write_borrowed", None)
+        write_timed = getattr(self.writer, "write_timed", None)
+        # Per-thread conversion buffers, reused for every frame; two, used in turn, for write_borrowed()
+        buffers = [allocate_frame() if allocate_frame else np.empty((height, width, 3), dtype=np.uint8)]
+        if write_borrowed:
+            buffers.append(np.empty((height, width, 3), dtype=np.uint8))
+        buffer_index = 0
+        conversion = _TO_BGR[self.pixel_format]
+        # Downscaling comes first, so the colour conversion only touches the smaller frame
+        resized = np.empty((height, width, channels), dtype=np.uint8) if output_size and conversion is not None else None
+        encode = getattr(self.writer, "encode", None)
+        # BGR captures can be compressed straight from the ring when nothing draws on them
+        encode_in_place = (conversion is None and encode is not None and allocate_frame is None
+                           and self.overlay is None and not output_size)
+        metrics = self.metrics
+
+        while True:
+            item = self.ring.take()
+            if item is None:
+                return
+            slot, ticket, meta = item
+            packet = None
+            copied = 0
+            if slot is not None:
+                grab_time = self._grab_times[slot] # Read before the slot is released and refilled
+                try:
+                    if self.error is None:
+                        if encode_in_place:
+                            bgr = self.ring.frames[slot]
+                        else:
+                            bgr = buffers[buffer_index]
+                            buffer_index = (buffer_index + 1) % len(buffers)
+                            source = self.ring.frames[slot]
+                            if output_size:
+                                start = time.perf_counter()
+                                scaled = bgr if conversion is None else resized
+                                cv2.resize(source, output_size, dst=scaled, interpolation=self.interpolation)
+                                source = scaled
+                                if metrics is not None:
+                                    self._scale_seconds.observe(time.perf_counter() - start)
+                            start = time.perf_counter()
+                            if conversion is not None:
+                                cv2.cvtColor(source, conversion, dst=bgr)
+                            elif source is not bgr:
+                                np.copyto(bgr, source)
+                                copied = bgr.nbytes
+                            if metrics is not None:
+                                self._convert_seconds.observe(time.perf_counter() - start)
+                        if self.overlay:
+                            self.overlay(bgr, meta)
+                        if encode:
+                            start = time.perf_counter()
+                            packet = encode(bgr) # Compress outside the write lock, in parallel
+                            if metrics is not None:
+                                self._encode_seconds.observe(time.perf_counter() - start)
+                except Exception as e:
+                    self._fail(e)
+                finally:
+                    self.ring.release(slot) # The ring slot can be refilled while we wait to write
+
+            with self._write_cond:
+                # The writer needs frames in capture order, so wait for this ticket's turn
+                while self._write_turn != ticket:
+                    self._write_cond.wait()
+                try:
+                    if self.error is None:
+                        start = time.perf_counter()
+                        if slot is None:
+                            self.writer.write_duplicate()
+                        elif packet is not None:
+                            self.writer.write_packet(packet)
+                        elif write_timed:
+                            write_timed(bgr, grab_time)
+                        elif write_borrowed:
+                            write_borrowed(bgr)
+                        else:
+                            self.writer.write(bgr)
+                        if metrics is not None:
+                            self._write_seconds.observe(time.perf_counter() - start)
+                        self.written_frames += 1
+                        self.copied_bytes += copied
+                except Exception as e:
+                    self._fail(e)
+                finally:
+                    self._write_turn += 1
+                    self._write_cond.notify_all()
+
+    def _reset_change_detector(self):
+        if self.change_detector:
+            self.change_detector.reset()
+            self.ring.unpin()
+
+    def _fail(self, error):
+        """Records the first encoder error and stops the capture loop."""
+        if self.error is None:
+            self.error = error
+        self._running.clear()
@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond grabs to a stalled 4K encode
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0)
+# Frames waiting in the ring buffer
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+
+class Counter:
+    """Monotonically increasing count. inc() is safe from any thread; set() is for collectors."""
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        """Mirrors a total kept elsewhere (e.g. FramePipeline.stats())."""
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Value that goes up and down, such as a rate or the current queue depth."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram: observe() is O(number of buckets) with no allocation,
+    so it can sit in the per-frame hot path.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets) # Observations <= each bound (not cumulative)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+
+    def snapshot(self):
+        with self._lock:
+            return {"count": self.count, "sum": round(self.sum, 6),
+                    "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+                    "max": round(self.max, 6), "buckets": dict(zip(map(str, self.buckets), self.bucket_counts))}
+
+
+class MetricsRegistry:
+    """
+    The metrics of one recording. Hot-path code gets its metric once (counter()/gauge()/histogram()
+    return the existing one when called again with the same name) and updates it directly;
+    collectors are callables run before every sample to copy in state kept elsewhere.
+    """
+    def __init__(self, prefix="screen_recorder"):
+        self.prefix = prefix
+        self.metrics = {} # name -> metric, in registration order
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def add_collector(self, collector):
+        """collector(registry) is called before every snapshot."""
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            collector(self)
+
+    def snapshot(self):
+        """{name: value} for counters and gauges, {name: {...}} for histograms."""
+        return {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+
+    def to_prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in list(self.metrics.items()):
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {metric.help}")
+            lines.append(f"# TYPE {full_name} {metric.kind}")
+            if metric.kind == "histogram":
+                snapshot = metric.snapshot()
+                cumulative = 0
+                for bound, count in snapshot["buckets"].items():
+                    cumulative += count
+                    lines.append(f'{full_name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{full_name}_bucket{{le="+Inf"}} {snapshot["count"]}')
+                lines.append(f"{full_name}_sum {snapshot['sum']}")
+                lines.append(f"{full_name}_count {snapshot['count']}")
+            else:
+                lines.append(f"{full_name} {metric.snapshot()}")
+        return "\n".join(lines) + "\n"
+
+    def _get(self, metric_class, name, *args):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, *args)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+
+class MetricsReporter:
+    """
+    Samples a MetricsRegistry every interval seconds on a background thread, so the recording
+    threads never report anything themselves. Each sample is passed to on_sample(snapshot) (e.g.
+    to update a status line), appended to jsonl_path as one JSON object per line, and written to
+    prometheus_path for node_exporter's textfile collector (replaced atomically, as it expects).
+    """
+    def __init__(self, registry, interval=1.0, on_sample=None, jsonl_path=None, prometheus_path=None):
+        self.registry = registry
+        self.interval = interval
+        self.on_sample = on_sample
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self._jsonl_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.jsonl_path:
+            self._jsonl_file = open(self.jsonl_path, "a")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops sampling and writes one last sample with the final values."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.sample()
+        if self._jsonl_file:
+            self._jsonl_file.close()
+            self._jsonl_file = None
+
+    def sample(self):
+        self.registry.collect()
+        snapshot = self.registry.snapshot()
+        if self._jsonl_file:
+            self._jsonl_file.write(json.dumps({"time": round(time.time(), 3), **snapshot}) + "\n")
+            self._jsonl_file.flush()
+        if self.prometheus_path:
+            temp_path = self.prometheus_path + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write(self.registry.to_prometheus())
+            os.replace(temp_path, self.prometheus_path)
+        if self.on_sample:
+            self.on_sample(snapshot)
+        return snapshot
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Metrics sample failed: {e}") # Debugging; metrics must never stop a recording
@@ -0,0 +1,205 @@
+import multiprocessing
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+def _attach_shared_memory(name):
+    """Opens an existing block without registering it for cleanup (the pool owns and unlinks it)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _encode_worker(shm_name, slot_count, frame_shape, tasks, results):
+    """Worker process: JPEG-compresses frames straight out of the shared slots."""
+    shm = _attach_shared_memory(shm_name)
+    frames = np.ndarray((slot_count,) + tuple(frame_shape), dtype=np.uint8, buffer=shm.buf)
+    results.put((None, None, None)) # Ready: imports done and shared memory attached
+    try:
+        while True:
+            job = tasks.get()
+            if job is None:
+                break
+            job_id, slot, quality = job
+            try:
+                ok, packet = cv2.imencode(".jpg", frames[slot], [cv2.IMWRITE_JPEG_QUALITY, quality])
+                results.put((job_id, packet.tobytes(), None) if ok else (job_id, None, "JPEG encoding failed."))
+            except Exception as e:
+                results.put((job_id, None, str(e)))
+    finally:
+        del frames
+        shm.close()
+
+
+class MjpegProcessPool:
+    """
+    Wraps an MjpegAviWriter so JPEG compression runs in worker processes instead of threads of
+    this process, scaling with cores for 4K or high-fps regions.
+
+    Frames live in a block of shared memory divided into slots. allocate_frame() hands each
+    FramePipeline encoder thread a slot as its conversion buffer, so the BGR frame is written
+    into shared memory by cvtColor and only the slot number travels to a worker; only the
+    (much smaller) JPEG comes back through a queue. encode(frame) blocks the calling encoder
+    thread until its packet is ready, so with as many encoder threads as workers every process
+    stays busy, and FramePipeline's write tickets put the packets back in capture order before
+    write_packet(). Everything else is passed through to the wrapped writer.
+    There are two slots per encoder thread (encoder_threads, default: workers): its own buffer
+    and a spare for a frame from elsewhere; should the spares run out, encode() waits for one.
+    """
+    def __init__(self, writer, frame_size, workers=None, quality=None, encoder_threads=None):
+        self.writer = writer
+        self.filename = writer.filename
+        self.workers = max(1, workers or multiprocessing.cpu_count())
+        width, height = frame_size
+        self.frame_shape = (height, width, 3)
+        self.quality = quality if quality is not None else writer.quality # Sent with every frame, so it may change
+
+        # One slot per encoder thread buffer, plus spares for frames encode() receives from elsewhere
+        self.slot_count = max(1, encoder_threads or self.workers) * 2
+        frame_bytes = width * height * 3
+        self._shm = shared_memory.SharedMemory(create=True, size=frame_bytes * self.slot_count)
+        self._frames = np.ndarray((self.slot_count,) + self.frame_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._free_slots = list(range(self.slot_count))
+        self._slot_by_address = {} # Data address of an allocated frame -> its slot
+        self._slot_lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._slot_lock)
+
+        context = multiprocessing.get_context("spawn") # Same behaviour on every platform; no forked threads
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._processes = [context.Process(target=_encode_worker, name=f"mjpeg-worker-{i}", daemon=True,
+                                           args=(self._shm.name, self.slot_count, self.frame_shape,
+                                                 self._tasks, self._results))
+                           for i in range(self.workers)]
+        self._collector = None
+        try:
+            for process in self._processes:
+                process.start()
+            self._wait_until_ready()
+        except Exception:
+            self._shutdown() # The caller still owns writer
+            raise
+
+        self._next_job = 0
+        self._done = {} # job id -> (packet, error) waiting to be picked up by encode()
+        self._done_cond = threading.Condition()
+        self._collector = threading.Thread(target=self._collect_results, name="mjpeg-results", daemon=True)
+        self._collector.start()
+
+    @property
+    def frames_written(self):
+        return self.writer.frames_written
+
+    @property
+    def duplicate_frames(self):
+        return self.writer.duplicate_frames
+
+    def isOpened(self):
+        return self.writer.isOpened()
+
+    def allocate_frame(self):
+        """Returns a BGR frame buffer in shared memory that encode() can send without copying."""
+        slot = self._take_slot(wait=False) # Never given back: waiting could only deadlock
+        frame = self._frames[slot]
+        with self._slot_lock:
+            self._slot_by_address[frame.__array_interface__["data"][0]] = slot
+        return frame
+
+    def encode(self, frame):
+        """Compresses a BGR frame in a worker process; safe to call from several threads at once."""
+        slot = self._slot_by_address.get(frame.__array_interface__["data"][0])
+        borrowed = slot is None
+        if borrowed:
+            slot = self._take_slot()
+            np.copyto(self._frames[slot], frame)
+        try:
+            with self._done_cond:
+                job_id = self._next_job
+                self._next_job += 1
+            self._tasks.put((job_id, slot, int(self.quality)))
+            with self._done_cond:
+                while job_id not in self._done:
+                    if not self._done_cond.wait(timeout=1.0) and not all(p.is_alive() for p in self._processes):
+                        raise RuntimeError("An MJPG encoder process exited unexpectedly.")
+                packet, error = self._done.pop(job_id)
+        finally:
+            if borrowed:
+                self._give_back_slot(slot)
+        if error is not None:
+            raise RuntimeError(error)
+        return packet
+
+    def write(self, frame):
+        self.writer.write_packet(self.encode(frame))
+
+    def write_packet(self, packet, keyframe=True):
+        self.writer.write_packet(packet, keyframe)
+
+    def write_duplicate(self):
+        self.writer.write_duplicate()
+
+    def release(self):
+        """Stops the workers, frees the shared memory and finishes the wrapped writer."""
+        self._shutdown()
+        self.writer.release()
+
+    def _shutdown(self):
+        if self._shm is None:
+            return
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            if process.pid is None:
+                continue # Never started
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if self._collector is not None:
+            self._results.put(None) # Stops the collector
+            self._collector.join()
+        self._frames = None
+        self._slot_by_address.clear()
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def _take_slot(self, wait=True):
+        with self._slot_freed:
+            while not self._free_slots:
+                if not wait:
+                    raise RuntimeError("No free shared-memory frame slots; pass encoder_threads to MjpegProcessPool.")
+                self._slot_freed.wait() # A spare is given back as soon as its frame is encoded
+            return self._free_slots.pop()
+
+    def _give_back_slot(self, slot):
+        with self._slot_freed:
+            self._free_slots.append(slot)
+            self._slot_freed.notify()
+
+    def _wait_until_ready(self, timeout=60.0):
+        """Waits for every worker to start, so the first frames are not held up by process startup."""
+        ready = 0
+        waited = 0.0
+        while ready < self.workers:
+            try:
+                self._results.get(timeout=1.0)
+                ready += 1
+            except queue.Empty:
+                waited += 1.0
+                if waited >= timeout or not all(p.is_alive() for p in self._processes):
+                    raise RuntimeError("MJPG encoder processes failed to start.")
+
+    def _collect_results(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            job_id, packet, error = item
+            with self._done_cond:
+                self._done[job_id] = (packet, error)
+                self._done_cond.notify_all()
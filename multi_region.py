@@ -0,0 +1,76 @@
+def union_region(regions):
+    """Bounding box (x, y, width, height) of several (x, y, width, height) regions."""
+    left = min(x for x, _, _, _ in regions)
+    top = min(y for _, y, _, _ in regions)
+    right = max(x + width for x, _, width, _ in regions)
+    bottom = max(y + height for _, y, _, height in regions)
+    return left, top, right - left, bottom - top
+
+
+class RegionSplitWriter:
+    """
+    Writes crops of every frame to several writers, one per region, so that a single grab of the
+    regions' bounding box feeds all of them and capture costs the same for one region or ten.
+
+    crops are (x, y, width, height) relative to the frame, one per writer. The crops are views
+    into the frame, never copies: MJPG writers compress straight from them (OpenCV follows the row
+    stride), and raw pipe writers copy each crop once into their own frame, which they need to do
+    anyway to send it contiguously. Packets from encode() are lists with one packet per writer.
+    """
+    def __init__(self, writers, crops):
+        self.writers = list(writers)
+        self.crops = [(slice(y, y + height), slice(x, x + width)) for x, y, width, height in crops]
+        self.filename = None
+        self.filenames = [writer.filename for writer in self.writers]
+        if all(hasattr(writer, "encode") for writer in self.writers):
+            self.encode = self._encode # Packets can be compressed on the encoder threads
+
+    @property
+    def frames_written(self):
+        return self.writers[0].frames_written
+
+    @property
+    def duplicate_frames(self):
+        return self.writers[0].duplicate_frames
+
+    @property
+    def copied_bytes(self):
+        return sum(getattr(writer, "copied_bytes", 0) for writer in self.writers)
+
+    @property
+    def quality(self):
+        return getattr(self.writers[0], "quality", None)
+
+    @quality.setter
+    def quality(self, quality):
+        for writer in self.writers:
+            writer.quality = quality
+
+    def isOpened(self):
+        return all(writer.isOpened() for writer in self.writers)
+
+    def write(self, frame):
+        for writer, (rows, columns) in zip(self.writers, self.crops):
+            writer.write(frame[rows, columns])
+
+    def write_packet(self, packets, keyframe=True):
+        for writer, packet in zip(self.writers, packets):
+            writer.write_packet(packet, keyframe)
+
+    def write_duplicate(self):
+        for writer in self.writers:
+            writer.write_duplicate()
+
+    def release(self):
+        """Closes every writer; if any of them fails, the first error is raised once all are closed."""
+        error = None
+        for writer in self.writers:
+            try:
+                writer.release()
+            except Exception as e:
+                error = error or e
+        if error:
+            raise error
+
+    def _encode(self, frame):
+        return [writer.encode(frame[rows, columns]) for writer, (rows, columns) in zip(self.writers, self.crops)]
@@ -0,0 +1,104 @@
+import time
+
+# Histograms of the encoder threads' work per frame (see frame_pipeline.FramePipeline)
+ENCODER_STAGES = ("convert_seconds", "scale_seconds", "encode_seconds", "write_seconds")
+
+
+class QualityGovernor:
+    """
+    Keeps a recording smooth on a busy machine by giving up detail, within bounds, instead of
+    letting frames arrive late.
+
+    update(snapshot) is fed every metrics sample (see metrics.MetricsReporter). A sample is
+    overloaded when frames were late or dropped since the previous one, more than half the queue
+    is waiting, or the capture thread or the encoder threads were busy for more than high_load of
+    the interval. Each overloaded sample moves one step down a ladder of settings: first the JPEG
+    quality of the writer, in quality_step steps down to min_quality (when the writer has one),
+    then the frame rate, by capturing only every 2nd, 3rd, ... frame slot of the pipeline down to
+    min_fps (the slots in between repeat the previous frame, so the file keeps its fps and length).
+    After recover_samples samples in a row whose load, scaled to the next step up, stays below
+    low_load, it moves one step back up. Every change is printed and kept in adjustments.
+    """
+    def __init__(self, pipeline, writer, fps, min_fps=None, min_quality=50, quality_step=10, queue_depth=8,
+                 encoder_threads=1, high_load=0.9, low_load=0.6, recover_samples=3):
+        self.pipeline = pipeline
+        self.writer = writer
+        self.fps = fps
+        self.queue_depth = queue_depth
+        self.encoder_threads = max(1, encoder_threads)
+        self.high_load = high_load
+        self.low_load = low_load
+        self.recover_samples = recover_samples
+        self.adjustments = [] # (time.time(), effective fps, quality, reason) for every change
+
+        # Ladder of (capture interval, quality), best first
+        best_quality = getattr(writer, "quality", None)
+        qualities = [best_quality]
+        if best_quality is not None:
+            while qualities[-1] - quality_step >= min_quality:
+                qualities.append(qualities[-1] - quality_step)
+            if qualities[-1] > min_quality:
+                qualities.append(min_quality)
+        min_fps = min_fps or fps / 4
+        intervals = [1]
+        while fps / (intervals[-1] + 1) >= min_fps:
+            intervals.append(intervals[-1] + 1)
+        self.levels = [(1, quality) for quality in qualities] + [(interval, qualities[-1]) for interval in intervals[1:]]
+        self.level = 0
+
+        self._last = None # (time, late, dropped, capture busy seconds, encoder busy seconds) at the previous sample
+        self._calm_samples = 0
+
+    @property
+    def effective_fps(self):
+        return self.fps / self.levels[self.level][0]
+
+    @property
+    def quality(self):
+        return self.levels[self.level][1]
+
+    def update(self, snapshot):
+        """Takes one metrics sample and adjusts the settings if needed."""
+        now = time.monotonic()
+        totals = (now, snapshot.get("frames_late_total", 0), snapshot.get("frames_dropped_total", 0),
+                  snapshot.get("grab_seconds", {}).get("sum", 0.0),
+                  sum(snapshot.get(stage, {}).get("sum", 0.0) for stage in ENCODER_STAGES))
+        last, self._last = self._last, totals
+        if last is None or now <= last[0]:
+            return
+        interval = now - last[0]
+        late, dropped = totals[1] - last[1], totals[2] - last[2]
+        capture_load = (totals[3] - last[3]) / interval
+        encoder_load = (totals[4] - last[4]) / (interval * self.encoder_threads)
+        load = max(capture_load, encoder_load)
+        queued = snapshot.get("queued_frames", 0)
+
+        if late or dropped or queued > self.queue_depth / 2 or load > self.high_load:
+            self._calm_samples = 0
+            if self.level + 1 < len(self.levels):
+                reason = (f"{late} late, {dropped} dropped, {queued} queued, "
+                          f"capture {capture_load:.0%} / encoders {encoder_load:.0%} busy")
+                self._apply(self.level + 1, reason)
+            return
+
+        if self.level == 0:
+            return
+        # Capturing more often costs proportionally more; a quality step costs about the same
+        better_interval = self.levels[self.level - 1][0]
+        if load * self.levels[self.level][0] / better_interval < self.low_load:
+            self._calm_samples += 1
+            if self._calm_samples >= self.recover_samples:
+                self._calm_samples = 0
+                self._apply(self.level - 1, f"headroom, load {load:.0%}")
+        else:
+            self._calm_samples = 0
+
+    def _apply(self, level, reason):
+        self.level = level
+        interval, quality = self.levels[level]
+        self.pipeline.capture_interval = interval
+        if quality is not None:
+            self.writer.quality = quality
+        self.adjustments.append((time.time(), self.effective_fps, quality, reason))
+        quality_text = f", quality {quality}" if quality is not None else ""
+        print(f"Quality governor: {self.effective_fps:.1f} fps{quality_text} ({reason})") # Debugging
@@ -0,0 +1,257 @@
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+
+import numpy as np
+
+# Raw frame spool: a header page, then fixed-size records of one BGR frame each, so a frame is one
+# memcpy into a memory-mapped file and record i always starts at HEADER_SIZE + i * record_size.
+#   header: magic, version, width, height, channels, fps, record size, capacity, records used
+#   record: capture time (session seconds), repeats (copies of this frame that follow it), pixels
+SPOOL_MAGIC = b"BGRSPOOL"
+SPOOL_VERSION = 1
+HEADER = struct.Struct("<8sIIIIdQQQ")
+HEADER_SIZE = 4096
+RECORD_HEADER = struct.Struct("<dI4x")
+RECORD_ALIGNMENT = 4096 # Records start on page boundaries
+RECORDS_OFFSET = HEADER.size - 8 # Offset of the "records used" field, rewritten after every frame
+SPOOL_FILE_NAME = "frames.bgrspool"
+
+# Past these fractions of the budget, only every Nth frame is stored; the others repeat it
+DEFAULT_THINNING = ((0.5, 2), (0.75, 4), (0.9, 8))
+
+
+def record_size(frame_size):
+    width, height = frame_size
+    size = RECORD_HEADER.size + width * height * 3
+    return -(-size // RECORD_ALIGNMENT) * RECORD_ALIGNMENT
+
+
+class RawSpoolWriter:
+    """
+    Writer (same surface as MjpegAviWriter) that stores frames uncompressed in a preallocated,
+    memory-mapped spool file of at most max_bytes, for bursts no real-time encoder keeps up with:
+    writing a frame is a copy into the map, and the file is encoded afterwards (encode_spool).
+    Frames from write_timed() keep their capture time; repeated frames only count up the repeats
+    of the previous record. The records-used field in the header is updated after every frame,
+    so a spool left behind by a crash can still be encoded.
+
+    When the budget fills up, the recording degrades instead of failing: past each threshold of
+    thinning only every Nth frame is stored (the rest repeat it, keeping the timeline), and once
+    it is full every frame repeats the last one and full is set, so the recorder can stop.
+    """
+    def __init__(self, filename, fps, frame_size, max_bytes, thinning=DEFAULT_THINNING):
+        self.filename = filename
+        self.fps = fps
+        self.width, self.height = frame_size
+        self.thinning = thinning
+        self.record_size = record_size(frame_size)
+        self.frames_written = 0   # All frames, including repeats
+        self.duplicate_frames = 0 # Frames stored as repeats, thinned ones included
+        self.thinned_frames = 0   # Frames turned into repeats to stretch the budget
+        self.copied_bytes = 0
+        self.full = False
+
+        capacity = (max_bytes - HEADER_SIZE) // self.record_size
+        # Never plan for more than the disk can hold: a memory-mapped write past it would crash
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(filename))).free
+        fits = (free - HEADER_SIZE - 64 * 1024 * 1024) // self.record_size
+        if fits < capacity:
+            print(f"Raw spool reduced to {max(fits, 0)} frames by the free disk space") # Debugging
+            capacity = fits
+        if capacity < 1:
+            raise RuntimeError("The raw spool budget cannot hold a single frame.")
+        self.capacity = capacity
+        self._records = 0
+        self._since_stored = 0
+        self._leading_repeats = 0 # Duplicates that arrived before the first frame
+        self._lock = threading.Lock()
+
+        size = HEADER_SIZE + capacity * self.record_size
+        self._file = open(filename, "w+b")
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(self._file.fileno(), 0, size) # Reserve the blocks now, not on first touch
+            else:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        except Exception:
+            self._file.close()
+            raise
+        HEADER.pack_into(self._map, 0, SPOOL_MAGIC, SPOOL_VERSION, self.width, self.height, 3, float(fps),
+                         self.record_size, capacity, 0)
+
+    @property
+    def fill(self):
+        """Fraction of the budget in use."""
+        return self._records / self.capacity
+
+    @property
+    def bytes_used(self):
+        """Bytes of the file holding frames so far (the rest is reserved)."""
+        return HEADER_SIZE + self._records * self.record_size
+
+    def isOpened(self):
+        return self._map is not None
+
+    def write(self, frame):
+        self.write_timed(frame, math.nan)
+
+    def write_timed(self, frame, timestamp):
+        """Stores a BGR frame captured at session time timestamp (see FramePipeline)."""
+        with self._lock:
+            if self._map is None:
+                raise ValueError("Writer has been released.")
+            self.frames_written += 1
+            if self._records >= self.capacity:
+                self.full = True
+                self._repeat_previous()
+                return
+            keep_every = max([every for fill, every in self.thinning if self.fill >= fill], default=1)
+            if self._records and self._since_stored + 1 < keep_every:
+                self._since_stored += 1
+                self.thinned_frames += 1
+                self._repeat_previous()
+                return
+            self._since_stored = 0
+            start = HEADER_SIZE + self._records * self.record_size
+            # The first record also covers the slots before it, so the timeline keeps its length
+            RECORD_HEADER.pack_into(self._map, start, timestamp, 0 if self._records else self._leading_repeats)
+            pixels = np.ndarray((self.height, self.width, 3), dtype=np.uint8, buffer=self._map,
+                                offset=start + RECORD_HEADER.size)
+            np.copyto(pixels, frame)
+            del pixels # No view may outlive the map
+            self.copied_bytes += frame.nbytes
+            self._records += 1
+            struct.pack_into("<Q", self._map, RECORDS_OFFSET, self._records)
+
+    def write_duplicate(self):
+        with self._lock:
+            if self._map is None:
+                raise ValueError("Writer has been released.")
+            self.frames_written += 1
+            self._repeat_previous()
+
+    def release(self):
+        with self._lock:
+            if self._map is None:
+                return
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.close()
+
+    def _repeat_previous(self):
+        self.duplicate_frames += 1
+        if not self._records:
+            self._leading_repeats += 1 # Added to the first record's repeats
+            return
+        start = HEADER_SIZE + (self._records - 1) * self.record_size
+        timestamp, repeats = RECORD_HEADER.unpack_from(self._map, start)
+        RECORD_HEADER.pack_into(self._map, start, timestamp, repeats + 1)
+
+
+class RawSpool:
+    """Read-only view of a spool file written by RawSpoolWriter."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        magic, version, self.width, self.height, channels, self.fps, self.record_size, self.capacity, records = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != SPOOL_MAGIC or version != SPOOL_VERSION or channels != 3:
+            self.close()
+            raise ValueError(f"{filename} is not a raw frame spool.")
+        self.records = min(records, (len(self._map) - HEADER_SIZE) // self.record_size)
+
+    @property
+    def frame_size(self):
+        return self.width, self.height
+
+    def record(self, index):
+        """(timestamp, repeats, frame) of record index; frame is a read-only view into the file."""
+        start = HEADER_SIZE + index * self.record_size
+        timestamp, repeats = RECORD_HEADER.unpack_from(self._map, start)
+        frame = np.ndarray((self.height, self.width, 3), dtype=np.uint8, buffer=self._map,
+                           offset=start + RECORD_HEADER.size)
+        return timestamp, repeats, frame
+
+    def frame_count(self, first=0, last=None):
+        """Frames on the timeline (records plus their repeats) of records first..last-1."""
+        last = self.records if last is None else last
+        return sum(1 + RECORD_HEADER.unpack_from(self._map, HEADER_SIZE + i * self.record_size)[1]
+                   for i in range(first, last))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._file.close()
+
+
+def encode_spool(filename, chunk_dir, create_writer, extension, workers=None, on_progress=None):
+    """
+    Encodes a raw spool in parallel: its records are split into workers contiguous chunks (default:
+    one per CPU), each encoded on its own thread by create_writer(chunk filename, fps, frame size)
+    (an MjpegAviWriter, or an FFmpegPipeWriter whose FFmpeg process does the work). Repeats are
+    written as duplicates. Returns the chunk files in order, to be joined with FFmpeg's concat
+    demuxer; on_progress(fraction) reports the frames done so far.
+    """
+    spool = RawSpool(filename)
+    try:
+        if not spool.records:
+            raise RuntimeError("The raw spool holds no frames.")
+        workers = max(1, min(workers or os.cpu_count() or 1, spool.records))
+        bounds = [spool.records * i // workers for i in range(workers + 1)]
+        chunk_files = [os.path.join(chunk_dir, f"chunk_{i:03d}{extension}") for i in range(workers)]
+        total = spool.frame_count()
+        done = [0]
+        lock = threading.Lock()
+        errors = []
+
+        def encode_chunk(index):
+            writer = None
+            try:
+                writer = create_writer(chunk_files[index], spool.fps, spool.frame_size)
+                write_borrowed = getattr(writer, "write_borrowed", None) # The spool stays unchanged: no copy
+                for record in range(bounds[index], bounds[index + 1]):
+                    _, repeats, frame = spool.record(record)
+                    (write_borrowed or writer.write)(frame)
+                    for _ in range(repeats):
+                        writer.write_duplicate()
+                    del frame
+                    with lock:
+                        done[0] += 1 + repeats
+                        if on_progress:
+                            on_progress(done[0] / total)
+                writer.release()
+                writer = None
+            except Exception as e:
+                print(f"Encoding spool chunk {index} failed: {e}") # Debugging
+                # Without its traceback: its frames still hold views of the spool, and
+                # spool.close() would fail with BufferError instead of raising this error
+                errors.append(e.with_traceback(None))
+            finally:
+                if writer is not None:
+                    try:
+                        writer.release()
+                    except Exception:
+                        pass
+
+        threads = [threading.Thread(target=encode_chunk, args=(i,), name=f"spool-encoder-{i}") for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return chunk_files
+    finally:
+        spool.close()
@@ -0,0 +1,377 @@
+import argparse
+import datetime
+import os
+import sys
+import time
+
+from recorder_engine import RecorderEngine, RecorderError, encode_raw_spool, list_audio_devices, recover_recording
+from audio_capture import AUDIO_SAMPLE_FORMATS
+from capture_backends import CAPTURE_BACKENDS, list_monitors
+from finalizer import format_eta
+from frame_pipeline import INTERPOLATIONS
+from encoder_calibration import calibrate, describe_result, select_encoder
+from frame_index import build_index, extract_thumbnail, index_filename, trim_video
+
+# Command line front end for RecorderEngine: records without tkinter, e.g.
+#   python recorder_cli.py record --region 0,0,1280,720 --fps 30 --duration 10 --output demo.mp4
+#   python recorder_cli.py record --monitors --output demo.mp4   (demo_1.mp4, demo_2.mp4, ... from one grab)
+#   python recorder_cli.py devices
+#   python recorder_cli.py recover demo_segments   (after a crash of a --segment-seconds 60 recording)
+#   python recorder_cli.py record --region 0,0,3840,2160 --fps 60 --raw-spool-gb 20 --duration 10 --output burst.mp4
+#   python recorder_cli.py encode-spool burst_raw   (a raw spool kept by a failed or deferred encode)
+#   python recorder_cli.py calibrate --size 1920x1080 --fps 30   (measures the encoders for --encoder auto)
+#   python recorder_cli.py replay --region 0,0,1280,720 --seconds 30   (Enter saves the last 30 s)
+
+
+def parse_region(text):
+    """Parses "x,y,width,height" into a tuple of ints."""
+    try:
+        x, y, width, height = (int(v) for v in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected x,y,width,height, got {text!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError("width and height must be positive")
+    return x, y, width, height
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless screen recorder.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record = subparsers.add_parser("record", help="Record a screen region to a video file.")
+    add_capture_arguments(record, multiple_regions=True)
+    record.add_argument("--output", help="Output file (default: screen_recording_<timestamp>.mp4)")
+    record.add_argument("--duration", type=float, help="Seconds to record (default: until Ctrl+C)")
+    record.add_argument("--audio-compression", choices=["flac"], help="Compress the temporary audio file")
+    record.add_argument("--encoder", default="mjpg", choices=["auto", "mjpg", "x264", "xvid", "ffv1"],
+                        help="auto: the best measured encoder for this size and fps (see 'calibrate')")
+    record.add_argument("--preset", default="veryfast", help="libx264 preset for --encoder x264")
+    record.add_argument("--crf", type=int, default=23, help="libx264 quality for --encoder x264")
+    record.add_argument("--metrics-jsonl", help="Append a metrics sample per --status-interval to this JSON lines file")
+    record.add_argument("--metrics-prom", help="Keep a Prometheus textfile with the current metrics at this path")
+    record.add_argument("--segment-seconds", type=float, default=0,
+                        help="Write the video as crash-safe segments of this length (default 0: one file)")
+    record.add_argument("--spool-dir", help="Directory for the segments or raw spool (default: next to the output)")
+    record.add_argument("--raw-spool-gb", type=float,
+                        help="Capture uncompressed frames into a spool of at most this many GB and encode when stopped")
+    record.add_argument("--encode-workers", type=int, help="Parallel encoders for the raw spool (default: one per CPU)")
+    record.add_argument("--no-index", dest="write_index", action="store_false",
+                        help="Do not write the frame index sidecar used by 'trim' and 'thumbnail'")
+
+    replay = subparsers.add_parser("replay", help="Keep the last seconds in memory; press Enter to save them.")
+    add_capture_arguments(replay)
+    replay.add_argument("--seconds", type=float, default=30, help="Length of the replay window")
+    replay.add_argument("--max-mb", type=float, default=256, help="Memory cap of the replay buffer")
+    replay.add_argument("--output-dir", default=".", help="Directory for the saved replays")
+
+    subparsers.add_parser("devices", help="List microphone devices usable with --audio-device.")
+
+    recover = subparsers.add_parser("recover", help="Rebuild a video from the segments left by an interrupted recording.")
+    recover.add_argument("spool_dir", help="The recording's segment directory")
+    recover.add_argument("--output", help="Output file (default: the file the recording was meant to produce)")
+
+    encode_spool = subparsers.add_parser("encode-spool", help="Encode a raw frame spool left by 'record --raw-spool-gb'.")
+    encode_spool.add_argument("spool_dir", help="The recording's raw spool directory")
+    encode_spool.add_argument("--output", help="Output file (default: the file the recording was meant to produce)")
+    encode_spool.add_argument("--encoder", choices=["mjpg", "x264", "xvid", "ffv1"],
+                              help="Encoder (default: the one chosen for the recording)")
+    encode_spool.add_argument("--workers", type=int, help="Parallel encoders (default: one per CPU)")
+
+    calibration = subparsers.add_parser("calibrate", help="Measure the encoders on this machine for --encoder auto.")
+    calibration.add_argument("--size", type=parse_size, default=(1920, 1080), help="Frame size WIDTHxHEIGHT to measure")
+    calibration.add_argument("--fps", type=float, default=20, help="Frame rate the choice must sustain")
+    calibration.add_argument("--container", default=".mp4", help="Output file extension the choice must fit")
+    calibration.add_argument("--frames", type=int, default=60, help="Frames encoded per encoder")
+    calibration.add_argument("--max-seconds", type=float, default=3.0, help="Time limit per encoder")
+
+    index = subparsers.add_parser("index", help="Write the frame index sidecar of an MP4/MOV recording.")
+    index.add_argument("input", help="The recording")
+
+    trim = subparsers.add_parser("trim", help="Cut a recording without re-encoding, from the keyframe before --start.")
+    trim.add_argument("input", help="The recording")
+    trim.add_argument("--start", type=float, default=0.0, help="Seconds to cut from the start")
+    trim.add_argument("--end", type=float, help="Second to end at (default: the end of the recording)")
+    trim.add_argument("--output", required=True, help="Output file")
+
+    thumbnail = subparsers.add_parser("thumbnail", help="Save one frame of a recording as an image.")
+    thumbnail.add_argument("input", help="The recording")
+    thumbnail.add_argument("--time", type=float, default=0.0, help="Second of the frame")
+    thumbnail.add_argument("--width", type=int, help="Scale the image to this width")
+    thumbnail.add_argument("--output", required=True, help="Image file (.jpg, .png, ...)")
+    return parser
+
+
+def parse_size(text):
+    """Parses "WIDTHxHEIGHT", where either side may be left empty to keep the aspect ratio (e.g. "x1080")."""
+    try:
+        width, height = (int(v) if v else None for v in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if not (width or height) or (width or 1) <= 0 or (height or 1) <= 0:
+        raise argparse.ArgumentTypeError("width and height must be positive")
+    return width, height
+
+
+def add_capture_arguments(parser, multiple_regions=False):
+    """Options shared by every command that captures the screen."""
+    if multiple_regions:
+        regions = parser.add_mutually_exclusive_group(required=True)
+        regions.add_argument("--region", type=parse_region, action="append",
+                             help="x,y,width,height in screen pixels; repeat to record several regions, each to its own file")
+        regions.add_argument("--monitors", action="store_true", help="Record every monitor to its own file")
+    else:
+        parser.add_argument("--region", type=parse_region, required=True, help="x,y,width,height in screen pixels")
+    parser.add_argument("--fps", type=int, default=20)
+    parser.add_argument("--backend", default="auto", choices=["auto"] + sorted(CAPTURE_BACKENDS))
+    parser.add_argument("--audio-device", type=int, help="Microphone device index (see 'devices'); default: no audio")
+    parser.add_argument("--audio-rate", type=int, default=RecorderEngine.AUDIO_RATE, help="Audio sample rate")
+    parser.add_argument("--audio-format", default="int16", choices=sorted(AUDIO_SAMPLE_FORMATS), help="Audio sample format")
+    parser.add_argument("--audio-chunk", type=int, default=RecorderEngine.AUDIO_CHUNK,
+                        help="Frames per PortAudio buffer (smaller: lower latency, more callbacks)")
+    parser.add_argument("--audio-buffer-seconds", type=float, default=2.0,
+                        help="Audio the ring buffer holds while the writer is busy")
+    parser.add_argument("--encode-processes", type=int, default=0,
+                        help="Compress MJPG frames in this many worker processes (0: encoder threads)")
+    parser.add_argument("--highlight-mouse", action="store_true", help="Draw a circle around the mouse cursor")
+    parser.add_argument("--cursor-rate", type=int, default=120, help="Cursor samples per second with --highlight-mouse")
+    parser.add_argument("--cursor-trail", type=float, default=0.0, metavar="SECONDS",
+                        help="Draw the cursor's path over the last SECONDS (0: no trail)")
+    parser.add_argument("--no-click-ripples", dest="click_ripples", action="store_false",
+                        help="Do not draw a ripple at mouse clicks (they need pynput)")
+    scaling = parser.add_mutually_exclusive_group()
+    scaling.add_argument("--output-size", type=parse_size, help="Downscale the video to WIDTHxHEIGHT (e.g. 1920x1080, or x1080)")
+    scaling.add_argument("--scale", type=float, help="Downscale the video by this factor (e.g. 0.5)")
+    parser.add_argument("--interpolation", default="area", choices=sorted(INTERPOLATIONS),
+                        help="Downscaling filter: area (sharpest) or linear (cheaper)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Lower JPEG quality, then the captured fps, while the machine cannot keep up")
+    parser.add_argument("--min-fps", type=float, help="Lowest captured fps for --adaptive (default: fps / 4)")
+    parser.add_argument("--min-quality", type=int, default=50, help="Lowest JPEG quality for --adaptive")
+    parser.add_argument("--status-interval", type=float, default=1.0, help="Seconds between status/metrics samples")
+
+
+def capture_options(args):
+    """RecorderEngine keyword arguments for the audio, cursor and adaptive options of add_capture_arguments."""
+    return dict(audio_rate=args.audio_rate, audio_sample_format=args.audio_format, audio_chunk=args.audio_chunk,
+                audio_buffer_seconds=args.audio_buffer_seconds, adaptive_quality=args.adaptive,
+                adaptive_min_fps=args.min_fps, adaptive_min_quality=args.min_quality,
+                cursor_sample_rate=args.cursor_rate, cursor_trail_seconds=args.cursor_trail,
+                click_ripples=args.click_ripples)
+
+
+def print_error(title, message):
+    print(f"{title}: {message}", file=sys.stderr)
+
+
+def progress_printer(label):
+    """Returns an on_progress(fraction) callback printing the percent done and an ETA."""
+    started = [] # Set by the first report, when the work actually begins
+    def print_progress(fraction):
+        if fraction is None:
+            return
+        if not started:
+            started.append(time.monotonic())
+        elapsed = time.monotonic() - started[0]
+        eta = f" (ETA {format_eta(elapsed * (1 - fraction) / fraction)})" if fraction > 0 else ""
+        print(f"{label}: {fraction * 100:.0f}%{eta}")
+    return print_progress
+
+
+def cmd_record(args):
+    try:
+        regions = list_monitors() if args.monitors else args.region
+    except RuntimeError as e:
+        print_error("Monitor Error", e)
+        return 1
+    try:
+        engine = RecorderEngine(regions[0], fps=args.fps, output_filename=args.output, backend=args.backend,
+                                audio_device=args.audio_device, highlight_mouse=args.highlight_mouse,
+                                encoder=args.encoder, x264_preset=args.preset, x264_crf=args.crf,
+                                encode_processes=args.encode_processes,
+                                audio_compression=args.audio_compression, on_error=print_error,
+                                on_status=print, status_interval=args.status_interval,
+                                metrics_jsonl=args.metrics_jsonl, metrics_prometheus=args.metrics_prom,
+                                segment_seconds=args.segment_seconds or None, spool_dir=args.spool_dir,
+                                raw_spool_bytes=int(args.raw_spool_gb * 1024 ** 3) if args.raw_spool_gb else None,
+                                encode_workers=args.encode_workers, write_index=args.write_index,
+                                output_size=args.output_size, output_scale=args.scale,
+                                scale_interpolation=args.interpolation,
+                                regions=regions if len(regions) > 1 else None, **capture_options(args))
+    except ValueError as e: # Options that cannot be combined
+        print_error("Option Error", e)
+        return 1
+    print(f"Recording to {', '.join(engine.output_filenames or [engine.final_output_filename])} (Ctrl+C to stop)...")
+    try:
+        saved = engine.record(args.duration, on_progress=progress_printer("Finalizing"))
+    except RecorderError as e:
+        print_error("Recording Error", e)
+        return 1
+    print(f"Stats: {engine.stats()}")
+    if not saved:
+        return 1
+    print(f"Screen recording saved successfully to: {', '.join(engine.output_filenames or [engine.final_output_filename])}")
+    return 0
+
+
+def cmd_replay(args):
+    try:
+        engine = RecorderEngine(args.region, fps=args.fps, backend=args.backend, audio_device=args.audio_device,
+                                highlight_mouse=args.highlight_mouse, encode_processes=args.encode_processes,
+                                on_error=print_error, on_status=print, status_interval=args.status_interval,
+                                replay_seconds=args.seconds, replay_max_bytes=int(args.max_mb * 1024 * 1024),
+                                output_size=args.output_size, output_scale=args.scale,
+                                scale_interpolation=args.interpolation, **capture_options(args))
+    except ValueError as e: # Options that cannot be combined
+        print_error("Option Error", e)
+        return 1
+    try:
+        engine.start()
+    except RecorderError as e:
+        print_error("Recording Error", e)
+        return 1
+    print(f"Keeping the last {args.seconds:g}s. Press Enter to save a replay, q + Enter (or Ctrl+C) to quit.")
+    os.makedirs(args.output_dir, exist_ok=True)
+    try:
+        for line in sys.stdin: # Capture keeps running on its own threads while we wait for input
+            if line.strip().lower() == "q" or engine.failed:
+                break
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = os.path.join(args.output_dir, f"replay_{timestamp}.mp4")
+            try:
+                engine.save_replay(filename, on_done=lambda saved, filename=filename:
+                                   print(f"Replay saved to: {filename}" if saved else "Replay failed."))
+            except RecorderError as e:
+                print_error("Replay Error", e)
+    except KeyboardInterrupt:
+        pass
+    engine.stop() # Waits for replays still being written
+    return 1 if engine.failed else 0
+
+
+def cmd_devices(args):
+    try:
+        import pyaudio
+        p = pyaudio.PyAudio()
+    except Exception as e:
+        print_error("PyAudio Error", f"Could not initialize PyAudio: {e}")
+        return 1
+    try:
+        for name, index in list_audio_devices(p):
+            print(f"{index}: {name}")
+    finally:
+        p.terminate()
+    return 0
+
+
+def cmd_recover(args):
+    try:
+        output_filename = recover_recording(args.spool_dir, args.output)
+    except RecorderError as e:
+        print_error("Recovery Error", e)
+        return 1
+    print(f"Recording recovered to: {output_filename}")
+    return 0
+
+
+def cmd_encode_spool(args):
+    try:
+        output_filename = encode_raw_spool(args.spool_dir, args.output, encoder=args.encoder, workers=args.workers,
+                                           on_progress=progress_printer("Encoding"))
+    except RecorderError as e:
+        print_error("Encoding Error", e)
+        return 1
+    print(f"Recording encoded to: {output_filename}")
+    return 0
+
+
+def cmd_calibrate(args):
+    width, height = args.size
+    if not (width and height):
+        print_error("Calibration Error", "--size needs both a width and a height")
+        return 1
+    entry = calibrate((width, height), frames=args.frames, max_seconds=args.max_seconds)
+    for result in entry["results"]:
+        print(describe_result(result))
+    result, reason = select_encoder(entry["results"], args.fps, container=args.container.lower())
+    if result is None:
+        print_error("Calibration Error", reason)
+        return 1
+    print(f"--encoder auto at {width}x{height}, {args.fps:g} fps: {result['name']} ({reason})")
+    return 0
+
+
+def cmd_index(args):
+    try:
+        entries = build_index(args.input)
+    except (OSError, ValueError) as e:
+        print_error("Index Error", e)
+        return 1
+    keyframes = sum(entry.keyframe for entry in entries)
+    print(f"Indexed {len(entries)} frames ({keyframes} keyframes) to: {index_filename(args.input)}")
+    return 0
+
+
+def cmd_trim(args):
+    on_progress = None
+    if args.end is not None and args.end > args.start:
+        # FFmpeg reports output seconds; the kept length turns them into a fraction
+        print_progress = progress_printer("Trimming")
+        on_progress = lambda seconds: print_progress(min(seconds / (args.end - args.start), 1.0))
+    try:
+        start, _ = trim_video(args.input, args.output, args.start, args.end, on_progress)
+    except (OSError, RuntimeError) as e:
+        print_error("Trim Error", e)
+        return 1
+    if start < args.start:
+        print(f"Started at the keyframe at {start:.3f}s")
+    print(f"Trimmed recording saved to: {args.output}")
+    return 0
+
+
+def cmd_thumbnail(args):
+    try:
+        extract_thumbnail(args.input, args.output, args.time, args.width)
+    except (OSError, RuntimeError) as e:
+        print_error("Thumbnail Error", e)
+        return 1
+    print(f"Frame at {args.time:g}s saved to: {args.output}")
+    return 0
+
+
+def check_record_options(parser, args):
+    """
+    Rejects record options RecorderEngine cannot combine, before anything is captured. --monitors
+    is checked by cmd_record() instead: a single monitor records like one --region.
+    """
+    if args.region and len(args.region) > 1:
+        if args.scale or args.output_size:
+            parser.error("several --region cannot be combined with --scale or --output-size")
+        if args.raw_spool_gb:
+            parser.error("several --region cannot be combined with --raw-spool-gb")
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        check_record_options(parser, args)
+        return cmd_record(args)
+    if args.command == "recover":
+        return cmd_recover(args)
+    if args.command == "replay":
+        return cmd_replay(args)
+    if args.command == "encode-spool":
+        return cmd_encode_spool(args)
+    if args.command == "calibrate":
+        return cmd_calibrate(args)
+    if args.command == "index":
+        return cmd_index(args)
+    if args.command == "trim":
+        return cmd_trim(args)
+    if args.command == "thumbnail":
+        return cmd_thumbnail(args)
+    return cmd_devices(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1120 @@
+import datetime
+import os
+import shutil
+import threading
+import time
+
+from frame_pipeline import FramePipeline, BACKPRESSURE_DROP_OLDEST, INTERPOLATIONS, \
+    scaled_frame_size # Capture -> encode pipeline
+from capture_backends import create_capture_backend # Persistent screen grabbers
+from video_writers import MjpegAviWriter, FFmpegPipeWriter, PIPE_ENCODERS, PIPE_CONTAINERS # MJPG AVI writer / direct encoding
+from encoder_calibration import choose_encoder, describe_result # Picks an encoder from measured throughput
+from mjpeg_pool import MjpegProcessPool # MJPG compression in worker processes
+from audio_sink import StreamingAudioSink # Writes audio to disk while recording
+from audio_capture import AUDIO_SAMPLE_FORMATS, CallbackAudioInput # Callback-mode microphone input
+from frame_clock import SessionClock, TimestampLog, estimate_audio_sync, align_audio_chunk # A/V sync
+from ffmpeg_tools import audio_sync_filter, run_ffmpeg
+from metrics import MetricsRegistry, MetricsReporter # Per-stage timings and counters, sampled off the hot path
+from segments import SegmentedWriter, CONCAT_LIST_NAME, concat_input_args, list_segments, load_manifest, \
+    write_concat_list, write_manifest # Crash-safe segment files joined when recording stops
+from replay_buffer import ReplayBuffer, ReplayWriter, write_replay_files # Instant replay of the last seconds
+from multi_region import RegionSplitWriter, union_region # Several regions from one grab
+from quality_governor import QualityGovernor # Lowers quality / fps under load, within bounds
+from cursor_overlay import CursorSampler, CursorOverlay # Cursor sampled off the capture path, drawn from sprites
+from raw_spool import RawSpool, RawSpoolWriter, SPOOL_FILE_NAME, encode_spool # Capture now, encode later
+from frame_index import MP4_EXTENSIONS, build_index, index_filename # Seek/trim/thumbnail index sidecar
+
+# PyAudio and pyautogui are imported only when a recording needs them, so headless recordings
+# (no microphone, no cursor highlight) work on hosts without audio devices or a mouse.
+
+
+class RecorderError(Exception):
+    """Raised when a recording cannot be started or recovered."""
+
+
+def list_audio_devices(pyaudio_instance):
+    """Returns [(name, index)] for every input-capable device of the default host API."""
+    info = pyaudio_instance.get_host_api_info_by_index(0)
+    mic_devices = []
+    for i in range(0, info.get('deviceCount')):
+        device_info = pyaudio_instance.get_device_info_by_host_api_device_index(0, i)
+        if device_info.get('maxInputChannels') > 0:
+            mic_devices.append((device_info.get('name'), i)) # Store (name, index)
+    return mic_devices
+
+
+class RecorderEngine:
+    """
+    Records a screen region, and optionally a microphone, to a video file without any GUI.
+
+    start() begins capturing on background threads and returns; pause()/resume() may be called at
+    any time and stop() finishes the file. All settings are fixed when the engine is created, so the
+    capture loop never has to consult the caller. Problems found on the worker threads or while
+    finishing are reported through on_error(title, message); on_status(text) receives progress
+    text, and on_failure() is called when capture stops by itself because of an error (the caller
+    should then call stop()). Used by the tkinter GUI (test_screen.py) and the CLI (recorder_cli.py).
+    """
+    AUDIO_CHANNELS = 1
+    AUDIO_RATE = 44100 # Standard sample rate
+    AUDIO_CHUNK = 1024 # Audio buffer size
+
+    def __init__(self, region, fps=20, output_filename=None, backend="auto", audio_device=None,
+                 highlight_mouse=False, encoder="mjpg", x264_preset="veryfast", x264_crf=23,
+                 audio_compression=None, queue_depth=8, backpressure=BACKPRESSURE_DROP_OLDEST,
+                 encoder_threads=1, encode_processes=0, skip_unchanged=True, max_repeat=None, temp_dir=None,
+                 pyaudio_instance=None, on_status=None, on_error=None, on_failure=None,
+                 status_interval=0.5, metrics_jsonl=None, metrics_prometheus=None,
+                 segment_seconds=None, spool_dir=None, replay_seconds=None, replay_max_bytes=256 * 1024 * 1024,
+                 output_size=None, output_scale=None, scale_interpolation="area", regions=None,
+                 output_filenames=None, audio_rate=AUDIO_RATE, audio_channels=AUDIO_CHANNELS,
+                 audio_sample_format="int16", audio_chunk=AUDIO_CHUNK, audio_buffer_seconds=2.0,
+                 adaptive_quality=False, adaptive_min_fps=None, adaptive_min_quality=50,
+                 cursor_sample_rate=120, cursor_trail_seconds=0.0, click_ripples=True,
+                 raw_spool_bytes=None, encode_workers=None, write_index=True):
+        """
+        region is (x, y, width, height); audio_device is a PyAudio input device index, or None to
+        record without audio. encoder "mjpg" writes an MJPG AVI that is merged/renamed into the
+        output when recording stops, "x264" encodes straight into the output through FFmpeg, and
+        so do "xvid" (MPEG-4 Part 2) and "ffv1" (lossless; .mkv or .avi outputs only). "auto" picks
+        one of them when recording starts from a cached calibration of this host (see
+        encoder_calibration.py; the first recording at a new size calibrates), kept in encoder_choice.
+        encode_processes > 0 compresses MJPG frames in that many worker processes (mjpeg_pool)
+        instead of on the encoder threads. audio_compression "flac" compresses the temporary audio
+        file. Temporary files go to temp_dir (default: the directory of this module).
+        Segments are opt-in: with segment_seconds, video is written as segments of that length (see
+        segments.py) into a directory of spool_dir (default: a "_segments" directory next to the
+        output), together with the audio; they are joined with FFmpeg when recording stops, or by
+        recover_recording() after a crash. Without it (the default), x264/xvid/ffv1 encode straight
+        into the output in one pass and a silent MJPG recording is only renamed.
+        With replay_seconds, nothing is written to disk while recording: the last replay_seconds of
+        MJPG frames and audio are kept in memory (at most replay_max_bytes, see replay_buffer.py)
+        and save_replay() writes them out on demand. stop() then only ends the capture.
+        output_size (width, height; one of them may be None to keep the aspect ratio) or
+        output_scale (e.g. 0.5) downscales the video on the encoder threads, with
+        scale_interpolation "area" or "linear"; the capture itself stays at full resolution.
+        With regions (a list of (x, y, width, height); region is then ignored), every region is
+        recorded to its own file of output_filenames (default: output_filename, or the default
+        name, with _1, _2, ... appended) from one grab of their bounding box per frame; see
+        multi_region.py. Segments, instant replay, output scaling and encode_processes are not
+        used then.
+        The microphone is read in PyAudio's callback mode (see audio_capture.py) with audio_rate,
+        audio_channels, audio_sample_format ("int16", "int24" or "int32") and PortAudio buffers of
+        audio_chunk frames, through a ring buffer holding audio_buffer_seconds.
+        With adaptive_quality, a QualityGovernor (see quality_governor.py) lowers the JPEG quality
+        (down to adaptive_min_quality) and then the captured frame rate (down to adaptive_min_fps,
+        default fps / 4) while the machine cannot keep up, and restores them when it can.
+        With highlight_mouse, the cursor is sampled cursor_sample_rate times a second on its own
+        thread (see cursor_overlay.py) and every frame shows it as of its grab time, with a trail
+        of its last cursor_trail_seconds and, if click_ripples and pynput is installed, a ripple
+        at every click.
+        With raw_spool_bytes, frames are not compressed while recording but copied uncompressed
+        into a memory-mapped spool file of at most that many bytes (see raw_spool.py) in a
+        directory next to the output (or in spool_dir); finalize() encodes it with the selected
+        encoder on encode_workers threads (default: one per CPU), or encode_raw_spool() does later.
+        When the budget runs low, fewer frames are stored; when it is full, capture stops and
+        on_failure() is called. Not combined with segments, instant replay or regions.
+        With write_index, every saved output gets a frame index sidecar (see frame_index.py) for
+        trim_video() and extract_thumbnail(): MJPG writers log it while recording, and MP4 outputs
+        are indexed from their sample tables once written. Other containers get none.
+        Metrics (see metrics.py) are sampled every status_interval seconds into on_status, and
+        optionally appended to metrics_jsonl and/or written to the Prometheus textfile
+        metrics_prometheus.
+        """
+        now = datetime.datetime.now()
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
+        temp_id = now.strftime("%Y%m%d_%H%M%S_%f") # Unique even if the previous recording is still being finalized
+        self.regions = None # Regions recorded to separate files, in multi-region mode
+        self.output_filenames = None # Their output files (final_output_filename is the first)
+        if raw_spool_bytes and (replay_seconds or regions):
+            raise ValueError("The raw spool records a single region to a file, not instant replays.")
+        if regions:
+            if replay_seconds or output_size or output_scale:
+                raise ValueError("Instant replay and output scaling need a single region.")
+            self.regions = [tuple(int(v) for v in r) for r in regions]
+            region = union_region(self.regions) # Grabbed once per frame, then cropped
+        self.region = tuple(int(v) for v in region)
+        if scale_interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation: {scale_interpolation}. Choose from: {', '.join(INTERPOLATIONS)}")
+        self.scale_interpolation = scale_interpolation
+        self.output_size = scaled_frame_size(self.region[2:], output_size, output_scale) # Size of the video frames
+        self.fps = fps
+        self.final_output_filename = output_filename or f"screen_recording_{timestamp}.mp4"
+        self.backend_name = backend
+        self.audio_device = audio_device
+        if audio_sample_format not in AUDIO_SAMPLE_FORMATS:
+            raise ValueError(f"Unknown audio sample format: {audio_sample_format}. "
+                             f"Choose from: {', '.join(AUDIO_SAMPLE_FORMATS)}")
+        self.audio_rate = audio_rate
+        self.audio_channels = audio_channels
+        self.audio_sample_format = audio_sample_format
+        self.audio_chunk = audio_chunk
+        self.audio_buffer_seconds = audio_buffer_seconds
+        self.highlight_mouse = highlight_mouse
+        self.cursor_sample_rate = cursor_sample_rate
+        self.cursor_trail_seconds = cursor_trail_seconds
+        self.click_ripples = click_ripples
+        self.encoder = encoder
+        self.encoder_choice = None # EncoderChoice behind encoder "auto"
+        self.x264_preset = x264_preset
+        self.x264_crf = x264_crf
+        self.audio_compression = audio_compression
+        self.queue_depth = queue_depth
+        self.backpressure = backpressure
+        self.encoder_threads = encoder_threads
+        self.encode_processes = encode_processes
+        self.skip_unchanged = skip_unchanged
+        self.max_repeat = max_repeat
+        self.on_status = on_status
+        self.on_error = on_error
+        self.on_failure = on_failure
+        self.status_interval = status_interval
+        self.metrics_jsonl = metrics_jsonl
+        self.metrics_prometheus = metrics_prometheus
+        self.adaptive_quality = adaptive_quality
+        self.adaptive_min_fps = adaptive_min_fps
+        self.adaptive_min_quality = adaptive_min_quality
+        self.governor = None # QualityGovernor of the current recording, with adaptive_quality
+
+        # Paths for raw video and temporary audio
+        temp_dir = temp_dir or os.path.dirname(os.path.abspath(__file__))
+        self.temp_dir = temp_dir
+        self.video_filename_raw = os.path.join(temp_dir, f"temp_video_{temp_id}.avi")
+        audio_extension = "flac" if audio_compression == "flac" else "wav"
+        self.audio_filename_temp = os.path.join(temp_dir, f"temp_audio_{temp_id}.{audio_extension}")
+        if self.regions:
+            if not output_filenames:
+                base, extension = os.path.splitext(self.final_output_filename)
+                output_filenames = [f"{base}_{i + 1}{extension}" for i in range(len(self.regions))]
+            elif len(output_filenames) != len(self.regions):
+                raise ValueError("output_filenames needs one file per region.")
+            self.output_filenames = list(output_filenames)
+            self.final_output_filename = self.output_filenames[0]
+            self.region_filenames_raw = [os.path.join(temp_dir, f"temp_video_{temp_id}_{i + 1}.avi")
+                                         for i in range(len(self.regions))]
+        self.timestamps_filename = os.path.splitext(self.final_output_filename)[0] + ".timestamps.csv"
+
+        self.raw_spool_bytes = raw_spool_bytes
+        self.encode_workers = encode_workers
+        self.write_index = write_index
+        self.raw_spool_dir = None # Directory holding this recording's raw frame spool and audio
+        self.raw_spool_full = False # Set when capture stopped because the spool budget ran out
+        if raw_spool_bytes:
+            if spool_dir:
+                self.raw_spool_dir = os.path.join(spool_dir, f"recording_{timestamp}_raw")
+            else:
+                self.raw_spool_dir = os.path.splitext(os.path.abspath(self.final_output_filename))[0] + "_raw"
+            self.audio_filename_temp = os.path.join(self.raw_spool_dir, os.path.basename(self.audio_filename_temp))
+
+        self.segment_seconds = segment_seconds
+        self.spool_dir = None # Directory holding this recording's segments, when segmented
+        if segment_seconds and not replay_seconds and not self.regions and not raw_spool_bytes:
+            if spool_dir:
+                self.spool_dir = os.path.join(spool_dir, f"recording_{timestamp}")
+            else:
+                # Beside the output, so joining the segments never copies across filesystems
+                self.spool_dir = os.path.splitext(os.path.abspath(self.final_output_filename))[0] + "_segments"
+            self.audio_filename_temp = os.path.join(self.spool_dir, os.path.basename(self.audio_filename_temp))
+
+        self.replay_seconds = replay_seconds
+        self.replay_max_bytes = replay_max_bytes
+        self.replay_buffer = None # ReplayBuffer of the current recording, in replay mode
+        self._replay_threads = [] # save_replay() jobs still writing
+
+        self.is_recording = False
+        self.is_paused = False
+        self.failed = False # Set when capture stopped by itself because of an error
+        self._finalize_pending = False # stop_capture() ran, finalize() has not
+        self.video_is_final = False # True when self.out writes the final file directly (no merge step)
+        self.recording_thread = None
+        self.audio_thread = None
+        self.out = None # Video writer
+        self.pipeline = None # FramePipeline feeding self.out while recording
+        self.capture_backend = None # CaptureBackend grabbing frames for the pipeline
+        self.session_clock = None # SessionClock shared by the video and audio threads
+        self.timestamp_log = None # TimestampLog sidecar with the capture time of every frame and audio chunk
+        self.p = pyaudio_instance
+        self._owns_pyaudio = False
+        self._audio_format = None
+        self._audio_sample_width = None
+        self.audio_input = None # CallbackAudioInput of the current recording
+        self.audio_sink = None # StreamingAudioSink writing the temporary audio file
+        self._pyautogui = None
+        self.cursor_sampler = None # CursorSampler of the current recording, with highlight_mouse
+        self.cursor_overlay = None
+        self.metrics = None # MetricsRegistry of the current recording
+        self.metrics_reporter = None
+        self._last_sample = None # (time, frames captured, bytes on disk) at the previous metrics sample
+
+    # --- Public API ---
+
+    def start(self):
+        """Opens the encoder and starts the capture (and audio) threads."""
+        if self.is_recording:
+            raise RecorderError("Recording is already in progress.")
+        if self.audio_device is not None:
+            self._initialize_audio()
+        if self.encoder == "auto":
+            self._choose_encoder()
+        if self.highlight_mouse and not self._pyautogui:
+            import pyautogui # For getting mouse position
+            self._pyautogui = pyautogui
+            self.cursor_overlay = CursorOverlay(trail_seconds=self.cursor_trail_seconds,
+                                                ripple_seconds=0.4 if self.click_ripples else 0.0)
+
+        # Create the video writer before the capture and audio threads need it
+        try:
+            if self.replay_seconds:
+                self.replay_buffer = ReplayBuffer(self.replay_seconds, self.replay_max_bytes)
+            self._create_video_writer()
+            if not self.replay_buffer: # Replays are aligned from the buffer's own timestamps
+                self.timestamp_log = TimestampLog(self.timestamps_filename)
+        except Exception as e:
+            if self.out:
+                self.out.release()
+                self.out = None
+            raise RecorderError(f"Could not start the video encoder: {e}") from e
+
+        self.is_recording = True
+        self.is_paused = False
+        self.failed = False
+
+        # One clock for both threads: frames and audio chunks are stamped against it
+        self.session_clock = SessionClock()
+        self.session_clock.start()
+        if self._pyautogui:
+            self.cursor_sampler = CursorSampler(self._pyautogui.position, self.session_clock,
+                                                rate=self.cursor_sample_rate,
+                                                history_seconds=max(1.0, self.cursor_trail_seconds),
+                                                listen_clicks=self.click_ripples).start()
+
+        self.metrics = MetricsRegistry()
+        self.metrics.add_collector(self._collect_metrics)
+        self._last_sample = None
+        self.metrics_reporter = MetricsReporter(self.metrics, self.status_interval, on_sample=self._on_metrics_sample,
+                                                jsonl_path=self.metrics_jsonl,
+                                                prometheus_path=self.metrics_prometheus).start()
+
+        # Start video recording thread
+        self.recording_thread = threading.Thread(target=self._record_screen, name="capture")
+        self.recording_thread.start()
+
+        # Start audio recording thread if selected
+        if self.audio_device is not None:
+            self.audio_sink = None # Created by the audio thread
+            self.audio_input = None
+            self.audio_thread = threading.Thread(target=self._record_audio, name="audio")
+            self.audio_thread.start()
+
+    def pause(self):
+        if not self.is_recording or self.is_paused:
+            return
+        self.is_paused = True
+        self.session_clock.pause()
+        if self.pipeline:
+            self.pipeline.pause()
+        if self.audio_input:
+            self.audio_input.paused = True # The stream keeps running; its buffers are discarded
+
+    def resume(self):
+        if not self.is_recording or not self.is_paused:
+            return
+        self.is_paused = False
+        self.session_clock.resume()
+        if self.pipeline:
+            self.pipeline.resume()
+        if self.audio_input:
+            self.audio_input.paused = False
+
+    def stats(self):
+        """Counters of the running (or last) pipeline."""
+        return self.pipeline.stats() if self.pipeline else {}
+
+    def save_replay(self, filename, on_done=None):
+        """
+        Writes the replay buffer (the last replay_seconds) to filename while capture carries on.
+        The buffer is snapshotted right away and written on a background thread; on_done(saved)
+        is called from that thread with True once filename is complete. Returns the thread.
+        """
+        if not self.replay_buffer:
+            raise RecorderError("Instant replay is not enabled for this recording.")
+        video, audio = self.replay_buffer.snapshot()
+        if not video:
+            raise RecorderError("Nothing has been recorded yet.")
+        thread = threading.Thread(target=self._write_replay, args=(video, audio, filename, on_done),
+                                  name="replay-save")
+        self._replay_threads = [t for t in self._replay_threads if t.is_alive()] + [thread]
+        thread.start()
+        return thread
+
+    def stop(self, on_progress=None):
+        """
+        Stops recording and finalizes the output file: stop_capture() followed by finalize().
+        Returns True if the recording was saved to final_output_filename; on failure the reason has
+        been reported through on_error and final_output_filename points at whatever was kept.
+        """
+        if not self.is_recording:
+            return False
+        self.stop_capture()
+        return self.finalize(on_progress)
+
+    def stop_capture(self):
+        """
+        Ends capture: stops the pipeline and the audio stream and waits for their threads, which
+        takes no longer than writing the frames still queued. The output is finished by
+        finalize(), which may run later on another thread (e.g. a finalizer.FinalizationQueue)
+        while a new engine records.
+        """
+        if not self.is_recording:
+            return
+        self.is_recording = False
+        self.is_paused = False # Reset pause state
+        self._finalize_pending = True
+        self._status("Stopping recording...")
+        if self.pipeline:
+            self.pipeline.stop() # Capture stops, queued frames are still written
+
+        # Wait for both video and audio threads to finish
+        for thread in (self.recording_thread, self.audio_thread):
+            if thread and thread.is_alive() and thread is not threading.current_thread():
+                thread.join()
+
+        if self.cursor_sampler:
+            self.cursor_sampler.stop()
+            self.cursor_sampler = None
+        if self.timestamp_log:
+            self.timestamp_log.close()
+            self.timestamp_log = None
+        if self.metrics_reporter:
+            self.metrics_reporter.stop() # Final sample with the complete counts
+            self.metrics_reporter = None
+        if self._owns_pyaudio:
+            self.p.terminate()
+            self.p = None
+            self._owns_pyaudio = False
+
+    def finalize(self, on_progress=None):
+        """
+        Finishes the output after stop_capture(): closes the audio and video files and merges or
+        joins them with FFmpeg. on_progress(fraction) is called with 0..1 while FFmpeg runs.
+        Returns True if the recording was saved to final_output_filename (see stop()).
+        """
+        if not self._finalize_pending:
+            return False
+        self._finalize_pending = False
+
+        # Finalize the audio file (or FFmpeg audio pipe), which was written while recording
+        if self.audio_sink:
+            try:
+                self.audio_sink.close()
+                if not self.audio_sink.bytes_written and os.path.exists(self.audio_filename_temp):
+                    os.remove(self.audio_filename_temp) # Nothing was recorded, skip merging
+            except Exception as e:
+                self._error("Audio Save Error", f"Could not save audio file: {e}")
+                self.audio_filename_temp = "" # Invalidate temp audio file path
+            self.audio_sink = None
+
+        if self.replay_buffer:
+            # Nothing to finalize: only replays already requested are finished
+            if self.out:
+                self.out.release()
+                self.out = None
+            for thread in self._replay_threads:
+                thread.join()
+            self._replay_threads = []
+            self.replay_buffer = None
+            self._status("Instant replay stopped.")
+            return False
+
+        self._status("Processing video and audio...")
+
+        # Release the video writer
+        video_error = None
+        if self.out:
+            try:
+                self.out.release()
+            except Exception as e:
+                video_error = e
+            self.out = None
+
+        # FFmpeg reports its progress as output time; the recording's length turns it into a fraction
+        duration = self.pipeline.stats()["written"] / self.fps if self.pipeline else 0
+        report_progress = None
+        if on_progress:
+            report_progress = lambda seconds: on_progress(min(seconds / duration, 1.0) if duration else None)
+
+        saved = False
+        if video_error:
+            self._error("Video Save Error", f"Could not finish the video file: {video_error}")
+        elif self.video_is_final:
+            # The encoder wrote the final file(s) (with audio) while recording, nothing left to do
+            saved = True
+            for output_filename in self.output_filenames or [self.final_output_filename]:
+                self._index_output(output_filename)
+        elif self.raw_spool_dir:
+            try:
+                self._status("Encoding the raw spool...")
+                self.final_output_filename = encode_raw_spool(self.raw_spool_dir, self.final_output_filename,
+                                                              workers=self.encode_workers, on_progress=on_progress)
+                saved = True
+                self._index_output(self.final_output_filename)
+            except RecorderError as e:
+                self.final_output_filename = self.raw_spool_dir
+                self._error("Recording Kept", f"{e}\n\nThe raw frames are kept in:\n{self.raw_spool_dir}\n"
+                                              f"Encode them with: python recorder_cli.py encode-spool \"{self.raw_spool_dir}\"")
+            return saved
+        elif self.spool_dir:
+            # Join the segments (stream copy) and merge in the audio in one FFmpeg run
+            audio = self.audio_filename_temp if os.path.exists(self.audio_filename_temp) else None
+            saved = self._merge_video_audio(concat_input_args(os.path.join(self.spool_dir, CONCAT_LIST_NAME)),
+                                            audio, self.final_output_filename, self.spool_dir, report_progress)
+            if saved:
+                shutil.rmtree(self.spool_dir, ignore_errors=True)
+                self._index_output(self.final_output_filename)
+            else:
+                self.final_output_filename = self.spool_dir
+                self._error("Recording Kept", f"The recorded segments are kept in:\n{self.spool_dir}\n"
+                                              f"Rebuild the video with: python recorder_cli.py recover \"{self.spool_dir}\"")
+            return saved
+        elif self.regions:
+            # Every region's file gets the same audio; progress runs over all of them
+            saved = True
+            count = len(self.regions)
+            for index, raw_filename in enumerate(self.region_filenames_raw):
+                region_progress = None
+                if report_progress:
+                    region_progress = lambda seconds, index=index: on_progress(
+                        (index + (min(seconds / duration, 1.0) if duration else 0.0)) / count)
+                region_saved, self.output_filenames[index] = self._finish_video_file(
+                    raw_filename, self.output_filenames[index], region_progress)
+                if region_saved:
+                    self._index_output(self.output_filenames[index], raw_filename)
+                saved = saved and region_saved
+            self.final_output_filename = self.output_filenames[0]
+        else:
+            saved, self.final_output_filename = self._finish_video_file(self.video_filename_raw,
+                                                                        self.final_output_filename, report_progress)
+            if saved:
+                self._index_output(self.final_output_filename, self.video_filename_raw)
+
+        # Cleanup temporary files (raw videos are kept when they could not be turned into the output)
+        kept = self.output_filenames or [self.final_output_filename]
+        for raw_filename in (self.region_filenames_raw if self.regions else [self.video_filename_raw]):
+            if os.path.exists(raw_filename) and raw_filename not in kept:
+                os.remove(raw_filename)
+                if os.path.exists(index_filename(raw_filename)):
+                    os.remove(index_filename(raw_filename))
+        if os.path.exists(self.audio_filename_temp) and not self.spool_dir: # Spooled audio is kept for recovery
+            os.remove(self.audio_filename_temp)
+        return saved
+
+    def record(self, duration=None, on_progress=None):
+        """Records for duration seconds of recording time (or until stop()/Ctrl+C) and finalizes."""
+        self.start()
+        try:
+            while self.is_recording and not self.failed and not self._capture_ended():
+                if duration is not None and self.session_clock.now() >= duration:
+                    break
+                time.sleep(0.05)
+        except KeyboardInterrupt:
+            pass
+        return self.stop(on_progress)
+
+    def _capture_ended(self):
+        """True once the capture thread has finished on its own (e.g. the raw spool is full)."""
+        return self.recording_thread is not None and not self.recording_thread.is_alive()
+
+    # --- Setup ---
+
+    def _initialize_audio(self):
+        if self.p is None:
+            try:
+                import pyaudio # For audio recording
+            except ImportError as e:
+                raise RecorderError(f"Audio recording needs PyAudio: {e}") from e
+            self.p = pyaudio.PyAudio()
+            self._owns_pyaudio = True
+        import pyaudio
+        self._audio_format = getattr(pyaudio, AUDIO_SAMPLE_FORMATS[self.audio_sample_format])
+
+    def _create_video_writer(self):
+        """Creates self.out for the selected encoder."""
+        width, height = self.output_size
+        record_audio = self.audio_device is not None
+        self.video_is_final = False
+        if self.encoder in PIPE_ENCODERS and not self.replay_buffer:
+            codec = PIPE_ENCODERS[self.encoder]
+            for filename in self.output_filenames or [self.final_output_filename]:
+                if os.path.splitext(filename)[1].lower() not in PIPE_CONTAINERS[codec]:
+                    raise ValueError(f"The {self.encoder} encoder needs one of these outputs: "
+                                     f"{', '.join(PIPE_CONTAINERS[codec])}")
+            raw_extension = PIPE_CONTAINERS[codec][0] # Raw video merged with the audio afterwards
+
+        if self.replay_buffer:
+            # Always MJPG: every frame is a keyframe, so a replay can start at any frame in the buffer
+            self.out = ReplayWriter(self.replay_buffer, self.fps)
+        elif self.regions:
+            # One writer per region, each fed crops of the bounding box frame
+            writers = []
+            left, top, _, _ = self.region
+            try:
+                for index, (_, _, region_width, region_height) in enumerate(self.regions):
+                    if self.encoder in PIPE_ENCODERS:
+                        # Audio is recorded once to a file and muxed into every output afterwards
+                        if record_audio:
+                            self.region_filenames_raw[index] = os.path.splitext(self.region_filenames_raw[index])[0] + raw_extension
+                            target = self.region_filenames_raw[index]
+                        else:
+                            target = self.output_filenames[index]
+                        writers.append(self._pipe_writer(target, (region_width, region_height)))
+                    elif self.encoder == "mjpg":
+                        writers.append(MjpegAviWriter(self.region_filenames_raw[index], self.fps,
+                                                      (region_width, region_height),
+                                                      index_filename=self._raw_index(self.region_filenames_raw[index])))
+                    else:
+                        raise ValueError(f"Unknown encoder: {self.encoder}")
+            except Exception:
+                for writer in writers:
+                    writer.release()
+                raise
+            self.video_is_final = self.encoder in PIPE_ENCODERS and not record_audio
+            self.out = RegionSplitWriter(writers, [(x - left, y - top, w, h) for x, y, w, h in self.regions])
+        elif self.raw_spool_dir:
+            # Frames are only copied while recording; the encoder runs when the recording is finalized
+            os.makedirs(self.raw_spool_dir, exist_ok=True)
+            self.out = RawSpoolWriter(os.path.join(self.raw_spool_dir, SPOOL_FILE_NAME), self.fps, (width, height),
+                                      self.raw_spool_bytes)
+            # Everything encode_raw_spool() needs if the spool is encoded later
+            write_manifest(self.raw_spool_dir, output=os.path.abspath(self.final_output_filename), fps=self.fps,
+                           audio=self.audio_filename_temp if record_audio else None, audio_rate=self.audio_rate,
+                           timestamps=os.path.abspath(self.timestamps_filename), encoder=self.encoder,
+                           x264_preset=self.x264_preset, x264_crf=self.x264_crf)
+        elif self.spool_dir:
+            if self.encoder in PIPE_ENCODERS:
+                # Matroska needs no trailer, so a segment cut off by a crash stays playable up to its last packet
+                create_writer = lambda filename: self._pipe_writer(filename, (width, height))
+                extension = ".mkv"
+            elif self.encoder == "mjpg":
+                create_writer = lambda filename: MjpegAviWriter(filename, self.fps, (width, height))
+                extension = ".avi"
+            else:
+                raise ValueError(f"Unknown encoder: {self.encoder}")
+            self.out = SegmentedWriter(self.spool_dir, self.fps, (width, height), self.segment_seconds,
+                                       create_writer, extension)
+            # Everything recover_recording() needs if this process never gets to stop()
+            write_manifest(self.spool_dir, output=os.path.abspath(self.final_output_filename), fps=self.fps,
+                           audio=self.audio_filename_temp if record_audio else None, audio_rate=self.audio_rate,
+                           timestamps=os.path.abspath(self.timestamps_filename))
+        elif self.encoder in PIPE_ENCODERS:
+            # Encode to the output while recording; audio joins the same FFmpeg process where the platform allows it
+            pipe_audio = record_audio and FFmpegPipeWriter.SUPPORTS_AUDIO_PIPE
+            if pipe_audio or not record_audio:
+                target = self.final_output_filename
+                self.video_is_final = True
+            else:
+                # Audio is recorded to a file and muxed in afterwards (video is stream-copied)
+                self.video_filename_raw = os.path.splitext(self.video_filename_raw)[0] + raw_extension
+                target = self.video_filename_raw
+            audio_format = (self.audio_channels, self.p.get_sample_size(self._audio_format), self.audio_rate) if pipe_audio else None
+            self.out = self._pipe_writer(target, (width, height), audio_format=audio_format)
+        elif self.encoder == "mjpg":
+            # MJPG in AVI for broad compatibility, merged/renamed to the final file when recording stops
+            self.out = MjpegAviWriter(self.video_filename_raw, self.fps, (width, height),
+                                      index_filename=self._raw_index(self.video_filename_raw))
+        else:
+            raise ValueError(f"Unknown encoder: {self.encoder}")
+
+        if ((self.encoder == "mjpg" or self.replay_buffer) and self.encode_processes and not self.regions
+                and not self.raw_spool_dir):
+            try:
+                self.out = MjpegProcessPool(self.out, (width, height), workers=self.encode_processes,
+                                            encoder_threads=max(self.encoder_threads, self.encode_processes))
+            except Exception:
+                self.out.release()
+                raise
+
+    def _raw_index(self, raw_filename):
+        """Index sidecar the MJPG writer of raw_filename logs to, or None."""
+        return index_filename(raw_filename) if self.write_index else None
+
+    def _pipe_writer(self, filename, frame_size, audio_format=None):
+        """FFmpegPipeWriter for the selected FFmpeg encoder (see video_writers.PIPE_ENCODERS)."""
+        return FFmpegPipeWriter(filename, self.fps, frame_size, codec=PIPE_ENCODERS[self.encoder],
+                                preset=self.x264_preset, crf=self.x264_crf, audio_format=audio_format)
+
+    def _choose_encoder(self):
+        """Resolves encoder "auto" from the measured throughput of the encoders on this host."""
+        if self.replay_buffer is not None or self.replay_seconds:
+            self.encoder = "mjpg" # Instant replay always keeps MJPG frames
+            return
+        self._status("Choosing an encoder...")
+        container = os.path.splitext(self.final_output_filename)[1].lower()
+        self.encoder_choice = choose_encoder(self.output_size, self.fps, container=container)
+        self.encoder = self.encoder_choice.encoder
+        if self.encoder_choice.preset:
+            self.x264_preset = self.encoder_choice.preset
+        result = self.encoder_choice.result
+        numbers = f" ({describe_result(result)})" if result else ""
+        print(f"Encoder: {self.encoder_choice.reason}{numbers}") # Debugging
+        self._status(f"Encoder: {result['name'] if result else self.encoder}"
+                     + (f", {result['fps']:g} fps measured" if result else ""))
+
+    # --- Worker threads ---
+
+    def _record_screen(self):
+        """
+        Captures screen frames from the selected area and writes them to a video file.
+        This method runs in a separate thread and acts as the capture stage of a FramePipeline;
+        conversion, cursor highlighting and writing happen on the pipeline's encoder threads.
+        """
+        x, y, width, height = self.region
+        print(f"Recording area: x={x}, y={y}, w={width}, h={height}") # Debugging
+        if self.output_size != (width, height):
+            print(f"Output size: {self.output_size[0]}x{self.output_size[1]} ({self.scale_interpolation})") # Debugging
+
+        try:
+            # Open the grabber on this thread: it keeps its display connection for the whole recording
+            self.capture_backend = create_capture_backend(self.backend_name, self.region)
+            self.capture_backend.open()
+            print(f"Capture backend: {self.capture_backend.name}") # Debugging
+
+            self.pipeline = FramePipeline(self._grab_frame, self.out, (width, height), self.fps,
+                                          queue_depth=self.queue_depth,
+                                          backpressure=self.backpressure,
+                                          # One encoder thread per worker process keeps every process busy
+                                          encoder_threads=max(self.encoder_threads, self.encode_processes)
+                                          if isinstance(self.out, MjpegProcessPool) else self.encoder_threads,
+                                          overlay=self._draw_cursor if self.cursor_sampler else None,
+                                          pixel_format=self.capture_backend.pixel_format,
+                                          skip_unchanged=self.skip_unchanged,
+                                          max_repeat=self.max_repeat,
+                                          clock=self.session_clock,
+                                          timestamp_log=self.timestamp_log,
+                                          metrics=self.metrics,
+                                          output_size=self.output_size,
+                                          interpolation=INTERPOLATIONS[self.scale_interpolation])
+            if self.adaptive_quality:
+                self.governor = QualityGovernor(self.pipeline, self.out, self.fps, min_fps=self.adaptive_min_fps,
+                                                min_quality=self.adaptive_min_quality, queue_depth=self.queue_depth,
+                                                encoder_threads=self.pipeline.encoder_threads)
+            if self.is_paused:
+                self.pipeline.pause()
+            if self.is_recording: # Stop may have been pressed while the backend was being opened
+                self.pipeline.run()
+            print(f"Pipeline stats: {self.pipeline.stats()}") # Debugging
+
+        except Exception as e:
+            self._error("Recording Error", f"An error occurred during video recording: {e}")
+            self.failed = True
+            if self.on_failure:
+                self.on_failure() # Let the caller run stop() to clean up
+        finally:
+            if self.capture_backend:
+                self.capture_backend.close() # The object stays, for its copied_bytes in the final metrics
+
+    def _grab_frame(self, dst):
+        """
+        Capture stage: grabs the recording area into the preallocated ring frame dst.
+        Returns the cursor state at grab time, looked up from the cursor sampler's buffer (no call
+        into the windowing system here), so the encoder can draw it later.
+        """
+        # Capture screenshot of the defined area
+        self.capture_backend.grab_into(dst)
+
+        if self.cursor_sampler:
+            return self.cursor_overlay.state_at(self.cursor_sampler, self.session_clock.now())
+        return None
+
+    def _draw_cursor(self, frame, cursor_state):
+        """Encoder stage: draws the cursor state captured with the frame, if any."""
+        x, y, width, height = self.region
+        output_width, output_height = self.output_size
+        # Frames may have been downscaled; the state is in screen coordinates
+        self.cursor_overlay.draw(frame, cursor_state, origin=(x, y), scale=(output_width / width, output_height / height))
+
+    def _collect_metrics(self, metrics):
+        """Metrics collector: copies the pipeline counters and measures the disk write rate."""
+        now = time.monotonic()
+        stats = self.pipeline.stats() if self.pipeline else {}
+        for key in ("captured", "written", "unchanged", "duplicated", "skipped", "dropped", "late"):
+            metrics.counter(f"frames_{key}_total", f"Frames {key} by the pipeline.").set(stats.get(key, 0))
+        metrics.gauge("queued_frames", "Frames waiting for an encoder.").set(stats.get("queued", 0))
+        copied_bytes = stats.get("copied_bytes", 0) + getattr(self.out, "copied_bytes", 0)
+        if self.capture_backend:
+            copied_bytes += self.capture_backend.copied_bytes
+        metrics.counter("frame_copied_bytes_total", "Pixels copied between frame buffers.").set(copied_bytes)
+
+        # Output files as they grow on disk (the video or its segments, and the temporary audio file if any)
+        if self.spool_dir:
+            video_files = list_segments(self.spool_dir)
+        else:
+            video_files = getattr(self.out, "filenames", None) or [getattr(self.out, "filename", None)]
+        disk_bytes = 0
+        if hasattr(self.out, "bytes_used"): # Preallocated raw spool: only the part holding frames
+            disk_bytes, video_files = self.out.bytes_used, []
+        for filename in video_files + [self.audio_filename_temp]:
+            if filename and os.path.exists(filename):
+                disk_bytes += os.path.getsize(filename)
+        metrics.counter("disk_bytes_total", "Bytes written to the output files.").set(disk_bytes)
+        if self.governor:
+            metrics.gauge("effective_fps", "Frames captured per second of video, set by the quality governor.").set(
+                round(self.governor.effective_fps, 2))
+            if self.governor.quality is not None:
+                metrics.gauge("jpeg_quality", "JPEG quality, set by the quality governor.").set(self.governor.quality)
+            metrics.counter("governor_adjustments_total", "Changes made by the quality governor.").set(
+                len(self.governor.adjustments))
+        if self.audio_input:
+            audio_input = self.audio_input
+            metrics.counter("audio_overflows_total", "Audio buffers PortAudio reported as overflowed.").set(
+                audio_input.overflows)
+            metrics.counter("audio_ring_overruns_total", "Audio chunks dropped because the ring buffer was full.").set(
+                audio_input.ring.overruns)
+            metrics.counter("audio_silence_seconds_total", "Silence inserted in place of lost audio.").set(
+                round(audio_input.silence_frames / self.audio_rate, 3))
+            metrics.gauge("audio_buffered_seconds", "Audio waiting in the ring buffer.").set(
+                round(len(audio_input.ring) * self.audio_chunk / self.audio_rate, 3))
+        if isinstance(self.out, RawSpoolWriter):
+            metrics.gauge("raw_spool_fill", "Fraction of the raw spool budget in use.").set(round(self.out.fill, 4))
+            metrics.counter("raw_spool_thinned_frames_total", "Frames stored as repeats to stretch the raw spool.").set(
+                self.out.thinned_frames)
+        if self.replay_buffer:
+            metrics.gauge("replay_buffer_bytes", "Compressed video and audio held for instant replay.").set(
+                self.replay_buffer.bytes_used)
+            metrics.gauge("replay_buffer_seconds", "Recording time held for instant replay.").set(
+                round(self.replay_buffer.duration(), 2))
+
+        captured = stats.get("captured", 0)
+        if self._last_sample is not None:
+            last_time, last_captured, last_bytes = self._last_sample
+            interval = now - last_time
+            if interval > 0:
+                metrics.gauge("capture_fps", "Frames captured per second since the last sample.").set(
+                    round((captured - last_captured) / interval, 2))
+                metrics.gauge("disk_write_bytes_per_second", "Output growth since the last sample.").set(
+                    round((disk_bytes - last_bytes) / interval))
+        self._last_sample = (now, captured, disk_bytes)
+
+    def _on_metrics_sample(self, snapshot):
+        """
+        Reports the current capture rate, a few times a second instead of on every frame, and lets
+        the quality governor react to the sample.
+        """
+        if not self.is_recording or self.is_paused or "capture_fps" not in snapshot:
+            return
+        if self.governor:
+            self.governor.update(snapshot)
+        text = f"Recording... ({snapshot['capture_fps']:.1f} FPS)"
+        if snapshot["frames_dropped_total"]:
+            text += f", {snapshot['frames_dropped_total']} dropped"
+        if self.governor and self.governor.level:
+            text += f", reduced to {self.governor.effective_fps:.0f} fps"
+            if self.governor.quality is not None:
+                text += f" / quality {self.governor.quality}"
+        if snapshot.get("audio_silence_seconds_total"):
+            text += f", {snapshot['audio_silence_seconds_total']:.1f}s audio lost"
+        if "raw_spool_fill" in snapshot:
+            text += f", spool {snapshot['raw_spool_fill']:.0%} full"
+            if snapshot.get("raw_spool_thinned_frames_total"):
+                text += " (storing fewer frames)"
+            if self.out is not None and self.out.full and self.pipeline and not self.raw_spool_full:
+                self.raw_spool_full = True
+                # Out of budget: end the capture here instead of repeating the last frame indefinitely
+                self.pipeline.stop()
+                self._status("Raw spool full: capture stopped.")
+                if self.on_failure:
+                    self.on_failure() # Let the caller run stop() to finish the recording
+                return
+        if "replay_buffer_seconds" in snapshot:
+            text += (f", replay {snapshot['replay_buffer_seconds']:.0f}s"
+                     f" ({snapshot['replay_buffer_bytes'] / (1024 * 1024):.0f} MB)")
+        self._status(text)
+
+    def _record_audio(self):
+        """
+        Captures audio from the selected microphone and streams it to the temporary audio file.
+        This method runs in a separate thread; PortAudio delivers the audio on its own callback
+        thread into a ring buffer (see audio_capture.py), which this thread drains.
+        """
+        try:
+            self.audio_input = CallbackAudioInput(self.p, self.audio_device, self._audio_format, self.audio_channels,
+                                                  self.audio_rate, self.audio_chunk, self.audio_buffer_seconds,
+                                                  self.session_clock)
+            self.audio_input.paused = self.is_paused
+            sample_width = self.audio_input.sample_width
+            self._audio_sample_width = sample_width
+            if not self.replay_buffer: # Replay audio stays in memory with the frames
+                self.audio_sink = StreamingAudioSink(self.audio_filename_temp, self.audio_channels,
+                                                     sample_width, self.audio_rate,
+                                                     compression=self.audio_compression,
+                                                     stream=getattr(self.out, "audio_stream", None)).open()
+
+            # Audio piped live into the encoder cannot be shifted afterwards, so keep it aligned as it goes
+            align_live = getattr(self.out, "audio_stream", None) is not None
+            frame_bytes = self.audio_channels * sample_width
+            poll_interval = self.audio_chunk / self.audio_rate / 2
+            samples_read = 0
+            samples_sent = 0
+
+            self.audio_input.start()
+            while True:
+                running = self.is_recording or self.is_paused # Keep running even if paused to collect frames
+                if not running:
+                    self.audio_input.stop() # No more callbacks; what is in the ring is still written
+                chunk = self.audio_input.read()
+                while chunk is not None:
+                    # chunk_time is the session time of the first sample (silence for lost audio included)
+                    chunk_time, data = chunk
+                    if self.replay_buffer:
+                        self.replay_buffer.add_audio(chunk_time, data)
+                    else:
+                        samples = len(data) // frame_bytes
+                        self.timestamp_log.audio(samples_read, samples, chunk_time)
+                        samples_read += samples
+                        if align_live:
+                            data = align_audio_chunk(data, chunk_time, samples_sent, self.audio_rate, frame_bytes)
+                            samples_sent += len(data) // frame_bytes
+                        self.audio_sink.write(data)
+                    chunk = self.audio_input.read()
+                if not running:
+                    break
+                time.sleep(poll_interval)
+
+        except Exception as e:
+            self._error("Audio Recording Error", f"An error occurred during audio recording: {e}")
+        finally:
+            if self.audio_input:
+                self.audio_input.close() # The object stays, for its counters in the final metrics
+            if self.audio_sink is None and getattr(self.out, "audio_stream", None):
+                self.out.audio_stream.close() # Let FFmpeg finish the audio track without us
+
+    # --- Finalization ---
+
+    def _write_replay(self, video, audio, filename, on_done):
+        """Replay thread: writes a buffer snapshot to temporary AVI/WAV files and muxes them into filename."""
+        base = os.path.join(self.temp_dir, f"temp_replay_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+        video_temp, audio_temp = base + ".avi", base + ".wav"
+        audio_format = (self.audio_channels, self._audio_sample_width, self.audio_rate) if audio else None
+        saved = False
+        try:
+            self._status("Saving replay...")
+            frames = write_replay_files(video, audio, self.fps, video_temp, audio_temp, audio_format)
+            process = merge_recording(['-i', video_temp], filename,
+                                      audio_temp if os.path.exists(audio_temp) else None)
+            if process.returncode == 0:
+                saved = True
+                print(f"Replay saved: {filename} ({frames / self.fps:.1f}s)") # Debugging
+            else:
+                self._error("FFmpeg Error", f"Failed to save the replay. FFmpeg output:\n{process.stderr.decode(errors='ignore')}")
+        except FileNotFoundError:
+            self._error("FFmpeg Not Found", "FFmpeg is not installed or not found in your system's PATH. "
+                                            "Please install FFmpeg to save replays.")
+        except Exception as e:
+            self._error("Replay Error", f"Could not save the replay: {e}")
+        finally:
+            for temp in (video_temp, audio_temp):
+                if os.path.exists(temp):
+                    os.remove(temp)
+        if on_done:
+            on_done(saved)
+
+    def _finish_video_file(self, raw_filename, output_filename, on_progress=None):
+        """
+        Turns a raw video file into output_filename, merging in the recorded audio if there is any.
+        Returns (saved, the file now holding the video: output_filename, or raw_filename if kept).
+        """
+        # Merge video and audio using FFmpeg if audio was recorded
+        if self.audio_device is not None and os.path.exists(self.audio_filename_temp):
+            if self._merge_video_audio(['-i', raw_filename], self.audio_filename_temp, output_filename,
+                                       raw_filename, on_progress):
+                return True, output_filename
+            return False, raw_filename # If merging failed, keep the raw video for the user
+        # If no audio or audio failed, just rename the raw video
+        try:
+            os.rename(raw_filename, output_filename)
+            return True, output_filename
+        except OSError as e:
+            self._error("File Error", f"Could not rename video file: {e}. Raw video might be in {raw_filename}")
+            return False, raw_filename
+
+    def _index_output(self, output_filename, raw_filename=None):
+        """
+        Leaves the frame index sidecar next to a saved output: the raw MJPG writer's own index
+        when the raw file was renamed into the output, else one read from an MP4 output's sample
+        tables. A recording is never failed over its index.
+        """
+        if not self.write_index:
+            return
+        raw_index = index_filename(raw_filename) if raw_filename else None
+        try:
+            if raw_index and os.path.exists(raw_index) and not os.path.exists(raw_filename):
+                os.replace(raw_index, index_filename(output_filename)) # Same file, same offsets
+            elif os.path.splitext(output_filename)[1].lower() in MP4_EXTENSIONS:
+                build_index(output_filename)
+        except Exception as e:
+            print(f"Could not write the frame index of {output_filename}: {e}") # Debugging
+
+    def _merge_video_audio(self, video_args, audio_filename, output_filename, kept_path, on_progress=None):
+        """
+        Writes output_filename from the recorded video (FFmpeg input arguments) and audio, if any.
+        Returns True on success; otherwise reports why, naming kept_path, the raw recording left
+        for the user.
+        """
+        try:
+            self._status("Merging video and audio..." if audio_filename else "Joining video segments...")
+            process = merge_recording(video_args, output_filename, audio_filename,
+                                      self.timestamps_filename, self.audio_rate, on_progress)
+
+            if process.returncode == 0:
+                return True
+            error_message = process.stderr.decode(errors='ignore')
+            self._error("FFmpeg Error", f"Failed to merge video and audio. FFmpeg output:\n{error_message}\n\n"
+                                        f"Ensure FFmpeg is installed and accessible in your system's PATH. "
+                                        f"The raw video is at: {kept_path}")
+        except FileNotFoundError:
+            self._error("FFmpeg Not Found", "FFmpeg is not installed or not found in your system's PATH. "
+                                            "Please install FFmpeg to enable audio recording. "
+                                            f"Raw video saved to:\n{kept_path}")
+        except Exception as e:
+            self._error("Merging Error", f"An unexpected error occurred during merging: {e}\n"
+                                         f"Raw video saved to:\n{kept_path}")
+        return False
+
+    def _status(self, text):
+        if self.on_status:
+            self.on_status(text)
+
+    def _error(self, title, message):
+        if self.on_error:
+            self.on_error(title, message)
+        else:
+            print(f"{title}: {message}")
+
+
+def merge_recording(video_args, output_filename, audio_filename=None, timestamps_filename=None,
+                    audio_rate=RecorderEngine.AUDIO_RATE, on_progress=None):
+    """
+    Runs FFmpeg to write output_filename from the video input(s) video_args (e.g. ['-i', 'raw.avi']
+    or a concat list, see segments.concat_input_args) and an optional audio file. Returns the
+    CompletedProcess; raises FileNotFoundError when FFmpeg is missing. on_progress(seconds) receives
+    the output time written so far (see ffmpeg_tools.run_ffmpeg).
+    """
+    # FFmpeg command:
+    # -y (overwrite the output file)
+    # -i video_input.avi (input video)
+    # -i audio_input.wav (input audio)
+    # -c:v copy (copy video stream without re-encoding)
+    # -c:a aac (encode audio to AAC, a common codec for MP4)
+    # -strict experimental (needed for older AAC encoders, can often be removed)
+    # -b:a 192k (audio bitrate)
+    # -af asetpts/aresample (align the audio to the video timeline from the timestamp sidecar)
+    # final_output.mp4 (output file)
+    audio_input = []
+    audio_options = []
+    if audio_filename:
+        audio_input = ['-i', audio_filename]
+        # Place the audio on the video's timeline using the capture timestamps (start offset and
+        # microphone clock drift); without the sidecar the two files are muxed from t=0
+        if timestamps_filename and os.path.exists(timestamps_filename):
+            offset, actual_rate = estimate_audio_sync(TimestampLog.load(timestamps_filename)["audio"], audio_rate)
+            print(f"Audio sync: offset={offset:.3f}s, measured rate={actual_rate:.1f} Hz") # Debugging
+            audio_options = ['-af', audio_sync_filter(offset, actual_rate, audio_rate)]
+        audio_options += [
+            '-c:a', 'aac',
+            '-strict', 'experimental', # May not be needed on newer FFmpeg, but good for compatibility
+            '-b:a', '192k',
+        ]
+    command = [
+        '-y', # The output path was chosen (and any overwrite confirmed) when recording started
+        *video_args,
+        *audio_input,
+        '-c:v', 'copy',
+        *audio_options,
+        output_filename
+    ]
+    return run_ffmpeg(command, on_progress)
+
+
+def recover_recording(spool_dir, output_filename=None):
+    """
+    Rebuilds a playable file from the segments (and audio) left in a spool directory, e.g. after
+    a crash. Segments that were cut off mid-write are included up to their last complete frame.
+    Returns the output filename; raises RecorderError when nothing can be recovered.
+    """
+    manifest = load_manifest(spool_dir)
+    segment_files = list_segments(spool_dir)
+    if not segment_files:
+        raise RecorderError(f"No recorded segments found in {spool_dir}")
+    output_filename = output_filename or manifest.get("output") or spool_dir.rstrip("/\\") + ".mp4"
+    audio_filename = manifest.get("audio")
+    if audio_filename and not (os.path.exists(audio_filename) and os.path.getsize(audio_filename) > 44):
+        audio_filename = None # Never created, or only a WAV header
+
+    list_path = write_concat_list(segment_files, os.path.join(spool_dir, CONCAT_LIST_NAME))
+    try:
+        process = merge_recording(concat_input_args(list_path), output_filename, audio_filename,
+                                  manifest.get("timestamps"), manifest.get("audio_rate", RecorderEngine.AUDIO_RATE))
+    except FileNotFoundError:
+        raise RecorderError("FFmpeg is not installed or not found in your system's PATH.")
+    if process.returncode != 0:
+        raise RecorderError(f"FFmpeg could not rebuild the recording:\n{process.stderr.decode(errors='ignore')}")
+    return output_filename
+
+
+def encode_raw_spool(spool_dir, output_filename=None, encoder=None, workers=None, on_progress=None):
+    """
+    Encodes the raw frame spool of a recording (see RecorderEngine raw_spool_bytes) into
+    output_filename (default: the file the recording was meant to produce) with encoder (default:
+    the recording's), in parallel chunks on workers threads that are joined and merged with the
+    audio. on_progress(fraction) runs over both steps. The spool directory is removed once the
+    output is written. Returns the output filename; raises RecorderError on failure.
+    """
+    manifest = load_manifest(spool_dir)
+    spool_file = os.path.join(spool_dir, SPOOL_FILE_NAME)
+    if not os.path.exists(spool_file):
+        raise RecorderError(f"No raw frame spool found in {spool_dir}")
+    output_filename = output_filename or manifest.get("output") or spool_dir.rstrip("/\\") + ".mp4"
+    encoder = encoder or manifest.get("encoder", "mjpg")
+    audio_filename = manifest.get("audio")
+    if audio_filename and not (os.path.exists(audio_filename) and os.path.getsize(audio_filename) > 44):
+        audio_filename = None # Never created, or only a WAV header
+    if encoder in PIPE_ENCODERS:
+        codec = PIPE_ENCODERS[encoder]
+        if os.path.splitext(output_filename)[1].lower() not in PIPE_CONTAINERS[codec]:
+            raise RecorderError(f"The {encoder} encoder needs one of these outputs: {', '.join(PIPE_CONTAINERS[codec])}")
+        preset, crf = manifest.get("x264_preset", "veryfast"), manifest.get("x264_crf", 23)
+        create_writer = lambda filename, fps, size: FFmpegPipeWriter(filename, fps, size, codec=codec,
+                                                                     preset=preset, crf=crf)
+        extension = ".mkv"
+    elif encoder == "mjpg":
+        create_writer = MjpegAviWriter
+        extension = ".avi"
+    else:
+        raise RecorderError(f"Unknown encoder: {encoder}")
+
+    # Encoding takes most of the time; joining the chunks and merging the audio is a stream copy
+    encode_progress = (lambda fraction: on_progress(0.9 * fraction)) if on_progress else None
+    chunk_dir = os.path.join(spool_dir, "chunks")
+    os.makedirs(chunk_dir, exist_ok=True)
+    try:
+        chunk_files = encode_spool(spool_file, chunk_dir, create_writer, extension, workers, encode_progress)
+    except FileNotFoundError:
+        raise RecorderError("FFmpeg is not installed or not found in your system's PATH.")
+    except Exception as e:
+        raise RecorderError(f"Could not encode the raw spool: {e}") from e
+
+    list_path = write_concat_list(chunk_files, os.path.join(chunk_dir, CONCAT_LIST_NAME))
+    merge_progress = None
+    if on_progress:
+        spool = RawSpool(spool_file)
+        duration = spool.frame_count() / spool.fps
+        spool.close()
+        merge_progress = lambda seconds: on_progress(0.9 + 0.1 * min(1.0, seconds / duration) if duration else None)
+    try:
+        process = merge_recording(concat_input_args(list_path), output_filename, audio_filename,
+                                  manifest.get("timestamps"), manifest.get("audio_rate", RecorderEngine.AUDIO_RATE),
+                                  merge_progress)
+    except FileNotFoundError:
+        raise RecorderError("FFmpeg is not installed or not found in your system's PATH.")
+    if process.returncode != 0:
+        raise RecorderError(f"FFmpeg could not join the encoded chunks:\n{process.stderr.decode(errors='ignore')}")
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    return output_filename
@@ -0,0 +1,192 @@
+import collections
+import threading
+import wave
+
+import cv2
+
+from video_writers import MjpegAviWriter
+
+
+class ReplayBuffer:
+    """
+    Keeps the last `seconds` of a recording in memory, already compressed: JPEG packets for video
+    (every MJPG frame is a keyframe, so the window can start anywhere) and PCM chunks for audio,
+    each with its session-clock time. Entries older than the window are evicted as new ones
+    arrive, and so are the oldest entries whenever the total exceeds max_bytes, which is a hard
+    cap on the data held. snapshot() copies the current window (references only) so it can be
+    written out while recording carries on.
+    """
+    def __init__(self, seconds, max_bytes=256 * 1024 * 1024):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.evicted_for_memory = 0 # Entries dropped before their time because of max_bytes
+        # [time, packet, cost]: repeats reuse the previous packet and cost nothing, unless the
+        # packet's own entry was evicted, in which case the first repeat takes over its cost
+        self._video = collections.deque()
+        self._audio = collections.deque() # [time, pcm bytes]
+        self._latest = 0.0
+        self._lock = threading.Lock()
+
+    def add_video(self, timestamp, packet, repeat=False):
+        with self._lock:
+            cost = 0 if repeat else len(packet)
+            self._video.append([timestamp, packet, cost])
+            self.bytes_used += cost
+            self._latest = max(self._latest, timestamp)
+            self._evict()
+
+    def add_audio(self, timestamp, data):
+        with self._lock:
+            self._audio.append([timestamp, data])
+            self.bytes_used += len(data)
+            self._latest = max(self._latest, timestamp)
+            self._evict()
+
+    def snapshot(self):
+        """Returns (video entries, audio entries) of the current window, as (time, data) tuples."""
+        with self._lock:
+            video = [(timestamp, packet) for timestamp, packet, _ in self._video]
+            audio = [(timestamp, data) for timestamp, data in self._audio]
+        return video, audio
+
+    def duration(self):
+        with self._lock:
+            return self._latest - self._video[0][0] if self._video else 0.0
+
+    def _evict(self):
+        oldest_allowed = self._latest - self.seconds
+        while self._video and self._video[0][0] < oldest_allowed:
+            self._pop_video()
+        while self._audio and self._audio[0][0] < oldest_allowed:
+            self.bytes_used -= len(self._audio.popleft()[1])
+        while self.bytes_used > self.max_bytes and (self._video or self._audio):
+            # Drop whichever stream has the older head, keeping the two covering the same time
+            if self._audio and (not self._video or self._audio[0][0] <= self._video[0][0]):
+                self.bytes_used -= len(self._audio.popleft()[1])
+            else:
+                self._pop_video()
+            self.evicted_for_memory += 1
+
+    def _pop_video(self):
+        timestamp, packet, cost = self._video.popleft()
+        if cost and self._video and self._video[0][1] is packet:
+            self._video[0][2] = cost # A repeat still holds the packet in memory
+        else:
+            self.bytes_used -= cost
+
+
+class ReplayWriter:
+    """
+    Video writer (see video_writers) that JPEG-compresses frames into a ReplayBuffer instead of a
+    file. Frames are stamped with their slot time, frame n / fps, which is where FramePipeline's
+    scheduler puts them on the session clock.
+    """
+    def __init__(self, buffer, fps, quality=95):
+        self.buffer = buffer
+        self.fps = fps
+        self.quality = quality
+        self.filename = None
+        self.frames_written = 0
+        self.duplicate_frames = 0
+        self._last_packet = None
+
+    def isOpened(self):
+        return True
+
+    @property
+    def quality(self):
+        return self._encode_params[1]
+
+    @quality.setter
+    def quality(self, quality):
+        """JPEG quality of the frames encoded from now on; may change while recording."""
+        self._encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+
+    def encode(self, frame):
+        """Compresses a BGR frame to a JPEG packet; safe to call from several threads at once."""
+        ok, packet = cv2.imencode(".jpg", frame, self._encode_params)
+        if not ok:
+            raise RuntimeError("JPEG encoding failed.")
+        return packet # Kept as is: a 1-D uint8 array, len() is its size in bytes
+
+    def write(self, frame):
+        self.write_packet(self.encode(frame))
+
+    def write_packet(self, packet, keyframe=True):
+        self._last_packet = packet
+        self.buffer.add_video(self.frames_written / self.fps, packet)
+        self.frames_written += 1
+
+    def write_duplicate(self):
+        timestamp = self.frames_written / self.fps
+        self.frames_written += 1 # The slot passes either way, or later frames would be stamped early
+        self.duplicate_frames += 1
+        if self._last_packet is None:
+            return # Nothing to repeat yet
+        self.buffer.add_video(timestamp, self._last_packet, repeat=True)
+
+    def release(self):
+        pass
+
+
+def write_replay_files(video, audio, fps, video_filename, audio_filename=None, audio_format=None):
+    """
+    Writes a ReplayBuffer snapshot as an MJPG AVI and, if there is audio, a WAV starting at the
+    same moment (padded with silence or trimmed to the first frame's time), ready to be muxed
+    from t=0. audio_format is (channels, sample_width, rate). Returns the number of frames.
+    """
+    if not video:
+        raise ValueError("The replay buffer is empty.")
+    start_time = video[0][0]
+    writer = MjpegAviWriter(video_filename, fps, _frame_size(video[0][1]))
+    try:
+        previous = None
+        for _, packet in video:
+            if packet is previous:
+                writer.write_duplicate()
+            else:
+                writer.write_packet(packet)
+            previous = packet
+    finally:
+        writer.release()
+
+    if audio_filename and audio and audio_format:
+        channels, sample_width, rate = audio_format
+        frame_bytes = channels * sample_width
+        end_time = video[-1][0] + 1.0 / fps
+        with wave.open(audio_filename, "wb") as wav:
+            wav.setnchannels(channels)
+            wav.setsampwidth(sample_width)
+            wav.setframerate(rate)
+            written = 0 # Samples, counted from start_time
+            for timestamp, data in audio:
+                position = int(round((timestamp - start_time) * rate))
+                if position > written:
+                    wav.writeframes(b"\0" * ((position - written) * frame_bytes)) # Gap: silence
+                    written = position
+                elif position < written:
+                    data = data[(written - position) * frame_bytes:] # Overlap or before the first frame
+                if written + len(data) // frame_bytes > (end_time - start_time) * rate:
+                    data = data[:max(0, int((end_time - start_time) * rate) - written) * frame_bytes]
+                wav.writeframes(data)
+                written += len(data) // frame_bytes
+    return len(video)
+
+
+def _frame_size(packet):
+    """(width, height) of a JPEG packet, read from its header without decoding the image."""
+    data = bytes(packet[:65536]) if not isinstance(packet, bytes) else packet
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if marker in (0xC0, 0xC1, 0xC2):
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + length
+    raise ValueError("Not a JPEG frame.")
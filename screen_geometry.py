@@ -0,0 +1,109 @@
+import collections
+import io
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from capture_backends import mss, create_capture_backend
+
+# Bounds of the virtual desktop (all monitors) in screen coordinates; x and y are negative when a
+# monitor sits left of or above the primary one. monitors holds (x, y, width, height) per monitor.
+ScreenGeometry = collections.namedtuple("ScreenGeometry", "x y width height monitors")
+
+# GetSystemMetrics indexes of the virtual screen and the monitor count (Windows)
+SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN, SM_CMONITORS = 76, 77, 78, 79, 80
+
+
+def _windows_metrics():
+    import ctypes
+    metrics = ctypes.windll.user32.GetSystemMetrics
+    return tuple(metrics(index) for index in (SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN,
+                                               SM_CYVIRTUALSCREEN, SM_CMONITORS))
+
+
+def query_screen_geometry(widget=None):
+    """
+    Returns the ScreenGeometry of the desktop without capturing any pixels: from the monitor list
+    of mss (XRandR on X11, EnumDisplayMonitors on Windows, Quartz on macOS), else the Windows
+    virtual-screen metrics, else the Tk widget's screen size (primary screen only).
+    """
+    if mss is not None:
+        try:
+            with mss.mss() as sct:
+                # Entry 0 is the bounding box of all monitors
+                bounds, monitors = sct.monitors[0], sct.monitors[1:]
+            return ScreenGeometry(bounds["left"], bounds["top"], bounds["width"], bounds["height"],
+                                  tuple((m["left"], m["top"], m["width"], m["height"]) for m in monitors))
+        except Exception as e:
+            print(f"Could not list monitors with mss: {e}") # Debugging; fall back below
+    if sys.platform == "win32":
+        x, y, width, height, _ = _windows_metrics()
+        return ScreenGeometry(x, y, width, height, ((x, y, width, height),))
+    if widget is None:
+        raise RuntimeError("The screen size cannot be determined without mss or a Tk window.")
+    width, height = widget.winfo_screenwidth(), widget.winfo_screenheight()
+    return ScreenGeometry(0, 0, width, height, ((0, 0, width, height),))
+
+
+class ScreenGeometryCache:
+    """
+    Keeps the ScreenGeometry between area selections, so opening the selection overlay costs no
+    query at all. It is queried again when a cheap fingerprint changes (Tk's screen size, and on
+    Windows the virtual-screen metrics and monitor count), which is what adding, removing or
+    rearranging monitors changes; after max_age seconds, for changes the fingerprint misses (Tk
+    may not see XRandR changes on X11); or after invalidate().
+    """
+    def __init__(self, max_age=60.0):
+        self.max_age = max_age
+        self._geometry = None
+        self._fingerprint = None
+        self._time = 0.0
+
+    def get(self, widget=None):
+        fingerprint = self._fingerprint_of(widget)
+        if (self._geometry is None or fingerprint != self._fingerprint
+                or time.monotonic() - self._time > self.max_age):
+            self._geometry = query_screen_geometry(widget)
+            self._fingerprint = fingerprint
+            self._time = time.monotonic()
+        return self._geometry
+
+    def invalidate(self):
+        self._geometry = None
+
+    @staticmethod
+    def _fingerprint_of(widget):
+        fingerprint = ()
+        if widget is not None:
+            fingerprint += (widget.winfo_screenwidth(), widget.winfo_screenheight())
+        if sys.platform == "win32":
+            fingerprint += _windows_metrics()
+        return fingerprint
+
+
+def grab_snapshot(geometry, max_width=1920):
+    """
+    Grabs the whole desktop once with the fastest capture backend and shrinks it by the smallest
+    whole factor that makes it at most max_width wide. Returns (PIL RGB image, factor); Tk can
+    scale the image back up with PhotoImage.zoom(factor), which needs a whole factor.
+    """
+    with create_capture_backend("auto", (geometry.x, geometry.y, geometry.width, geometry.height)) as backend:
+        frame = np.empty(backend.frame_shape, dtype=np.uint8)
+        backend.grab_into(frame)
+    factor = max(1, -(-geometry.width // max_width)) # Ceiling division
+    if factor > 1:
+        frame = cv2.resize(frame, (geometry.width // factor, geometry.height // factor), interpolation=cv2.INTER_AREA)
+    to_rgb = {"BGRA": cv2.COLOR_BGRA2RGB, "BGR": cv2.COLOR_BGR2RGB}.get(backend.pixel_format)
+    if to_rgb is not None:
+        frame = cv2.cvtColor(frame, to_rgb)
+    return Image.fromarray(frame), factor
+
+
+def snapshot_ppm(image):
+    """The image as PPM data, which tkinter.PhotoImage(data=...) reads without PIL's ImageTk."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PPM")
+    return buffer.getvalue()
@@ -0,0 +1,184 @@
+import glob
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+MANIFEST_NAME = "recording.json" # Describes the recording, so a spool directory can be recovered on its own
+CONCAT_LIST_NAME = "segments.txt"
+SEGMENT_PREFIX = "segment_"
+
+
+class SegmentedWriter:
+    """
+    Writes a recording as a series of fixed-duration segment files in a spool directory.
+
+    Each segment is a complete file of its own, opened with create_writer(filename), and a new one
+    is started every segment_seconds of video (counted in frames, repeats included, so every
+    segment has exactly the same duration). A finished segment is closed on a background thread
+    (patching an AVI index or waiting for FFmpeg takes a while), so the writing thread goes on
+    with the next segment straight away. A crash therefore loses at most the unfinished segment
+    and the one being closed. When the recording stops, the
+    segments are joined without re-encoding by the FFmpeg concat demuxer (see concat_input_args).
+    Segment filenames sort in recording order.
+    """
+    def __init__(self, spool_dir, fps, frame_size, segment_seconds, create_writer, extension):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.spool_dir = spool_dir
+        self.filename = spool_dir
+        self.fps = fps
+        self.frame_size = frame_size
+        self.frames_per_segment = max(1, int(round(segment_seconds * fps)))
+        self.segment_files = []
+        self.frames_written = 0
+        self.duplicate_frames = 0
+
+        self._create_writer = create_writer
+        self._extension = extension
+        self._writer = None
+        self._frames_in_segment = 0
+        self._last_packet = None # Last compressed frame, to start a segment that begins with a repeat
+        self._last_frame = None  # Same for writers that take raw frames
+        self._borrowed = False   # _last_frame is the caller's frame (write_borrowed), not our copy
+        self._quality = None     # Quality set on this writer, applied to every new segment
+        self.copied_bytes = 0
+        self._closing = queue.Queue() # Finished segment writers, released by the closer thread
+        self._close_errors = []
+        self._closer = threading.Thread(target=self._close_segments, name="segment-closer", daemon=True)
+        self._closer.start()
+
+        self._start_segment()
+        if hasattr(self._writer, "encode"):
+            self.encode = self._encode # Packets can be compressed on the encoder threads
+        if hasattr(self._writer, "write_borrowed"):
+            self.write_borrowed = self._write_borrowed
+
+    def isOpened(self):
+        return self._writer is not None or bool(self.segment_files)
+
+    @property
+    def quality(self):
+        return getattr(self._writer_for_encoding, "quality", None)
+
+    @quality.setter
+    def quality(self, quality):
+        self._quality = quality
+        self._writer_for_encoding.quality = quality
+
+    def write(self, frame):
+        if self._last_frame is None or self._borrowed:
+            self._last_frame = np.empty_like(frame)
+            self._borrowed = False
+        np.copyto(self._last_frame, frame)
+        self.copied_bytes += frame.nbytes
+        self._current().write(frame)
+        self._advance()
+
+    def _write_borrowed(self, frame):
+        self._last_frame = frame # Unchanged until the next frame is written (see FFmpegPipeWriter.write_borrowed)
+        self._borrowed = True
+        self._current().write_borrowed(frame)
+        self._advance()
+
+    def write_packet(self, packet, keyframe=True):
+        self._last_packet = packet
+        self._current().write_packet(packet, keyframe)
+        self._advance()
+
+    def write_duplicate(self):
+        writer = self._current()
+        if self._frames_in_segment == 0 and self._last_packet is not None:
+            writer.write_packet(self._last_packet) # Every segment starts with a real frame
+        elif self._frames_in_segment == 0 and self._last_frame is not None:
+            writer.write(self._last_frame)
+        else:
+            writer.write_duplicate()
+        self.duplicate_frames += 1
+        self._advance()
+
+    def release(self):
+        """Closes the last segment, waits for the earlier ones to be closed and writes the concat list."""
+        if self._writer is not None:
+            self._closing.put(self._writer)
+            self._writer = None
+        if self._closer is not None:
+            self._closing.put(None)
+            self._closer.join()
+            self._closer = None
+        write_concat_list(self.segment_files, os.path.join(self.spool_dir, CONCAT_LIST_NAME))
+        if self._close_errors:
+            raise self._close_errors[0]
+
+    def _encode(self, frame):
+        return self._writer_for_encoding.encode(frame)
+
+    def _current(self):
+        if self._writer is None:
+            self._start_segment()
+        return self._writer
+
+    def _start_segment(self):
+        filename = os.path.join(self.spool_dir, f"{SEGMENT_PREFIX}{len(self.segment_files):05d}{self._extension}")
+        self._writer = self._create_writer(filename)
+        if self._quality is not None:
+            self._writer.quality = self._quality
+        self._writer_for_encoding = self._writer # encode() is stateless; keeps working across rotations
+        self._frames_in_segment = 0
+        self.segment_files.append(filename)
+        print(f"Recording segment: {filename}") # Debugging
+
+    def _advance(self):
+        self.frames_written += 1
+        self._frames_in_segment += 1
+        if self._frames_in_segment >= self.frames_per_segment:
+            # Closed off the write path; the next segment is opened by the next write, so stopping leaves no empty file
+            self._closing.put(self._writer)
+            self._writer = None
+
+    def _close_segments(self):
+        """Closer thread: releases finished segment writers in order until release() sends None."""
+        while True:
+            writer = self._closing.get()
+            if writer is None:
+                return
+            try:
+                writer.release()
+            except Exception as e:
+                print(f"Could not close a segment: {e}") # Debugging; raised again by release()
+                self._close_errors.append(e)
+
+
+def list_segments(spool_dir):
+    """Non-empty segment files of a spool directory, in recording order."""
+    return [path for path in sorted(glob.glob(os.path.join(spool_dir, SEGMENT_PREFIX + "*")))
+            if os.path.getsize(path) > 0]
+
+
+def write_concat_list(segment_files, list_path):
+    """Writes an FFmpeg concat demuxer list of segment_files."""
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_files:
+            escaped = os.path.abspath(path).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+
+def concat_input_args(list_path):
+    """FFmpeg input arguments reading the segments of a concat list as one stream."""
+    return ["-f", "concat", "-safe", "0", "-i", list_path]
+
+
+def write_manifest(spool_dir, **info):
+    with open(os.path.join(spool_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+
+def load_manifest(spool_dir):
+    """The manifest written when recording started, or {} when it is missing or unreadable."""
+    try:
+        with open(os.path.join(spool_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
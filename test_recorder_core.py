@@ -0,0 +1,1046 @@
+# Unit tests of the recorder's parts: no display or microphone needed; tests that run FFmpeg are
+# skipped when it is not installed.
+#   python -m unittest test_recorder_core
+# (test_screen.py is the GUI, not a test module.)
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import wave
+from unittest import mock
+
+import numpy as np
+
+import encoder_calibration
+import ffmpeg_tools
+import frame_index
+import quality_governor
+import raw_spool
+import replay_buffer
+import segments
+import video_writers
+from audio_capture import AudioRingBuffer
+from audio_sink import StreamingAudioSink
+from engine_process import RecorderProcess
+from frame_clock import FrameScheduler, SessionClock, align_audio_chunk, estimate_audio_sync
+from frame_pipeline import FrameChangeDetector, FrameRingBuffer, BACKPRESSURE_BLOCK, BACKPRESSURE_DROP_OLDEST, scaled_frame_size
+from mjpeg_pool import MjpegProcessPool
+from multi_region import RegionSplitWriter, union_region
+from recorder_engine import RecorderError
+from video_writers import MjpegAviWriter, AVIIF_KEYFRAME
+
+
+def box(box_type, *payload):
+    """An MP4 box."""
+    payload = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, version, *payload):
+    """An MP4 full box (version and flags first)."""
+    return box(box_type, bytes([version, 0, 0, 0]), *payload)
+
+
+def table(box_type, entry_format, entries, version=0):
+    return full_box(box_type, version, struct.pack(">I", len(entries)),
+                    *(struct.pack(">" + entry_format, *entry) for entry in entries))
+
+
+def write_fixture_mp4(filename, sizes, chunks):
+    """
+    A minimal MP4 with an audio track, then a video track of four frames in decode order I P B B
+    (timescale 1000, 100 ms apart), reordered by ctts and moved back to 0 by an edit list like
+    FFmpeg writes for B-frames. chunks is the number of frames in each chunk of 'mdat'.
+    """
+    ftyp = box(b"ftyp", b"isom", struct.pack(">I", 512), b"isomiso2")
+    media = bytes(range(256))[:sum(sizes)]
+    chunk_offsets = []
+    offset = len(ftyp) + 8
+    for count, first in zip(chunks, np.cumsum([0] + chunks[:-1])):
+        chunk_offsets.append(offset)
+        offset += sum(sizes[first:first + count])
+
+    audio = box(b"trak", box(b"mdia", full_box(b"hdlr", 0, bytes(4), b"soun", bytes(13))))
+    stbl = box(b"stbl",
+               full_box(b"stsd", 0, struct.pack(">I", 0)),
+               table(b"stts", "II", [(4, 100)]),
+               table(b"ctts", "II", [(1, 200), (1, 400), (2, 100)]),
+               table(b"stss", "I", [(1,)]),
+               full_box(b"stsz", 0, struct.pack(">II", 0, len(sizes)), struct.pack(f">{len(sizes)}I", *sizes)),
+               table(b"stsc", "III", [(1, chunks[0], 1), (2, chunks[1], 1)]),
+               table(b"stco", "I", [(offset,) for offset in chunk_offsets]))
+    mdia = box(b"mdia",
+               full_box(b"mdhd", 0, struct.pack(">IIIIHH", 0, 0, 1000, 400, 0, 0)),
+               full_box(b"hdlr", 0, bytes(4), b"vide", bytes(13)),
+               box(b"minf", stbl))
+    edts = box(b"edts", table(b"elst", "IiI", [(100, -1, 0x10000), (400, 200, 0x10000)])) # Empty edit first
+    moov = box(b"moov", audio, box(b"trak", edts, mdia))
+    with open(filename, "wb") as f:
+        f.write(ftyp + box(b"mdat", media) + moov)
+    return chunk_offsets
+
+
+def read_chunks(data, start, end):
+    """(fourcc, payload start, payload size) of the RIFF chunks in data[start:end]."""
+    chunks = []
+    while start + 8 <= end:
+        fourcc, size = struct.unpack_from("<4sI", data, start)
+        chunks.append((fourcc, start + 8, size))
+        start += 8 + size + (size & 1)
+    return chunks
+
+
+class FakeTime:
+    """Clock and sleep for FrameScheduler: sleeping only advances the time."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class MjpegAviWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="recorder_test_")
+        self.filename = os.path.join(self.directory, "clip.avi")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_clip(self, frames, duplicates_after=(), repeats=1, max_repeat=None):
+        writer = MjpegAviWriter(self.filename, 10, (32, 24), max_repeat=max_repeat)
+        for index in range(frames):
+            writer.write(np.full((24, 32, 3), index * 20, dtype=np.uint8))
+            if index in duplicates_after:
+                for _ in range(repeats):
+                    writer.write_duplicate()
+        writer.release()
+        with open(self.filename, "rb") as f:
+            return writer, f.read()
+
+    def chunk_sizes(self, data):
+        movi = data.index(b"movi") - 8
+        movi_size = struct.unpack_from("<I", data, movi + 4)[0]
+        return [size for fourcc, _, size in read_chunks(data, movi + 12, movi + 8 + movi_size) if fourcc == b"00dc"]
+
+    def test_frame_counts_and_duplicates(self):
+        writer, data = self.write_clip(5, duplicates_after=(1, 3))
+        self.assertEqual(writer.frames_written, 7)
+        self.assertEqual(writer.duplicate_frames, 2)
+        self.assertEqual(data[:4], b"RIFF")
+        self.assertEqual(struct.unpack_from("<I", data, 4)[0], len(data) - 8)
+
+        avih = data.index(b"avih") + 8
+        self.assertEqual(struct.unpack_from("<I", data, avih + 16)[0], 7) # Total frames of the first part
+        strh = data.index(b"strh") + 8
+        self.assertEqual(struct.unpack_from("<I", data, strh + 32)[0], 7) # Stream length
+        dmlh = data.index(b"dmlh") + 8
+        self.assertEqual(struct.unpack_from("<I", data, dmlh)[0], 7)
+
+    def test_idx1_points_at_every_chunk(self):
+        _, data = self.write_clip(4, duplicates_after=(0,))
+        movi = data.index(b"movi") - 8 # Start of the LIST chunk
+        movi_size = struct.unpack_from("<I", data, movi + 4)[0]
+        chunks = [c for c in read_chunks(data, movi + 12, movi + 8 + movi_size) if c[0] == b"00dc"]
+        self.assertEqual([size for _, _, size in chunks][1], 0) # The duplicate is an empty chunk
+
+        idx1 = data.index(b"idx1")
+        count = struct.unpack_from("<I", data, idx1 + 4)[0] // 16
+        self.assertEqual(count, 5)
+        for i in range(count):
+            fourcc, flags, offset, size = struct.unpack_from("<4sIII", data, idx1 + 8 + 16 * i)
+            chunk = movi + 8 + offset # Offsets count from the 'movi' fourcc
+            self.assertEqual(fourcc, b"00dc")
+            self.assertEqual(data[chunk:chunk + 4], b"00dc")
+            self.assertEqual(struct.unpack_from("<I", data, chunk + 4)[0], size)
+            self.assertEqual(size, chunks[i][2])
+            self.assertEqual(bool(flags & AVIIF_KEYFRAME), size > 0)
+            if size:
+                self.assertEqual(data[chunk + 8:chunk + 10], b"\xff\xd8") # A JPEG
+
+    def test_opendml_indexes_across_riff_parts(self):
+        limit = video_writers.RIFF_SIZE_LIMIT
+        video_writers.RIFF_SIZE_LIMIT = 4096 # A few frames per part
+        try:
+            writer, data = self.write_clip(12, duplicates_after=(5,))
+        finally:
+            video_writers.RIFF_SIZE_LIMIT = limit
+        self.assertGreater(data.count(b"AVIX"), 0)
+
+        indx = data.index(b"indx") + 8
+        _, _, index_type, entries = struct.unpack_from("<HBBI", data, indx)
+        self.assertEqual(index_type, video_writers.AVI_INDEX_OF_INDEXES)
+        total = 0
+        for i in range(entries):
+            ix_offset, ix_size, frames = struct.unpack_from("<QII", data, indx + 24 + 16 * i)
+            self.assertEqual(data[ix_offset:ix_offset + 4], b"ix00")
+            _, _, _, count, _, base = struct.unpack_from("<HBBI4sQ", data, ix_offset + 8)
+            self.assertEqual(count, frames)
+            for j in range(count):
+                offset, size = struct.unpack_from("<II", data, ix_offset + 32 + 8 * j)
+                size &= 0x7FFFFFFF # Top bit: not a keyframe
+                # Standard index offsets point at the chunk data, past its 8-byte header
+                self.assertEqual(data[base + offset - 8:base + offset - 4], b"00dc")
+                self.assertEqual(struct.unpack_from("<I", data, base + offset - 4)[0], size)
+            total += frames
+        self.assertEqual(total, writer.frames_written)
+        self.assertEqual(total, 13)
+
+
+    def test_last_repeat_is_stored_in_full(self):
+        writer, data = self.write_clip(2, duplicates_after=(1,), repeats=3)
+        sizes = self.chunk_sizes(data)
+        self.assertEqual(writer.frames_written, 5)
+        self.assertEqual(writer.duplicate_frames, 3)
+        self.assertEqual(sizes[2:4], [0, 0])
+        self.assertEqual(sizes[4], sizes[1]) # The previous JPEG again, so the repeats before it survive
+
+    def test_long_runs_store_a_frame_every_max_repeat(self):
+        writer, data = self.write_clip(2, duplicates_after=(0,), repeats=7, max_repeat=3)
+        sizes = self.chunk_sizes(data)
+        self.assertEqual(writer.frames_written, 9)
+        self.assertEqual([size > 0 for size in sizes],
+                         [True, False, False, True, False, False, True, False, True])
+        self.assertEqual(sizes[3], sizes[0])
+
+    @unittest.skipUnless(shutil.which(ffmpeg_tools.FFMPEG), "needs FFmpeg")
+    def test_held_frames_keep_their_duration_after_a_remux(self):
+        self.write_clip(5, duplicates_after=range(5), repeats=9) # 5 frames held for 1 s each
+        output = os.path.join(self.directory, "clip.mp4")
+        process = ffmpeg_tools.run_ffmpeg(["-y", "-i", self.filename, "-c:v", "copy", output])
+        self.assertEqual(process.returncode, 0, process.stderr)
+        entries = frame_index.read_mp4_index(output)
+        self.assertEqual([entry.pts for entry in entries], [0.0, 1.0, 2.0, 3.0, 4.0, 4.9]) # Ends at 5.0 s
+
+
+class FrameSchedulerTest(unittest.TestCase):
+    def make_scheduler(self, fps=10):
+        fake = FakeTime()
+        scheduler = FrameScheduler(fps, SessionClock(fake), sleep=fake.sleep)
+        scheduler.start()
+        return scheduler, fake
+
+    def test_on_time_frames_miss_nothing(self):
+        scheduler, fake = self.make_scheduler()
+        self.assertEqual([scheduler.wait_for_next_frame() for _ in range(5)], [0] * 5)
+        self.assertAlmostEqual(fake.now, 0.4) # Slept until each deadline, no drift
+
+    def test_late_capture_reports_missed_slots(self):
+        scheduler, fake = self.make_scheduler()
+        scheduler.wait_for_next_frame() # Slot 0 at t=0
+        fake.now = 0.35                 # The capture took 3.5 frame intervals
+        self.assertEqual(scheduler.wait_for_next_frame(), 2) # Slots 1 and 2 went by
+        self.assertEqual(scheduler.frame_index, 4)           # Slot 3 was claimed
+        self.assertEqual(scheduler.wait_for_next_frame(), 0)
+        self.assertAlmostEqual(fake.now, 0.4)
+
+    def test_frames_written_match_recording_time(self):
+        scheduler, fake = self.make_scheduler(fps=20)
+        written = 0
+        for step in range(50):
+            written += scheduler.wait_for_next_frame() + 1
+            fake.now += 0.013 * (step % 7) # Captures of varying cost
+        self.assertEqual(written, scheduler.frame_index)
+        self.assertLessEqual(abs(written - fake.now * 20), 1)
+
+
+class AudioSyncTest(unittest.TestCase):
+    rate = 48000
+
+    def audio_rows(self, offset, actual_rate, seconds, chunk=1024, jitter=0.002):
+        """TimestampLog audio rows of a microphone running at actual_rate, stamped with some jitter."""
+        random = np.random.default_rng(7)
+        rows = []
+        for first_sample in range(0, int(seconds * self.rate), chunk):
+            stamp = offset + first_sample / actual_rate + random.uniform(-jitter, jitter)
+            rows.append((first_sample, chunk, stamp))
+        return rows
+
+    def test_offset_and_drift(self):
+        rows = self.audio_rows(0.25, 48096.0, 60) # Starts 250 ms in, runs 0.2% fast
+        offset, actual_rate = estimate_audio_sync(rows, self.rate)
+        self.assertAlmostEqual(offset, 0.25, delta=0.001)
+        self.assertAlmostEqual(actual_rate, 48096.0, delta=1.0)
+
+    def test_short_recording_keeps_the_nominal_rate(self):
+        rows = self.audio_rows(0.1, 48096.0, 5, jitter=0)
+        self.assertEqual(estimate_audio_sync(rows, self.rate), (0.1, self.rate))
+        self.assertEqual(estimate_audio_sync([], self.rate), (0.0, self.rate))
+
+    def test_implausible_drift_is_not_applied(self):
+        rows = self.audio_rows(0.0, 40000.0, 30, jitter=0) # 20% off: a stall, not a clock
+        _, actual_rate = estimate_audio_sync(rows, self.rate)
+        self.assertEqual(actual_rate, self.rate)
+
+    def test_align_audio_chunk(self):
+        data = bytes(range(8)) * 100 # 400 stereo 16-bit samples
+        # Within 40 ms of where it belongs: sent as is
+        self.assertIs(align_audio_chunk(data, 1.03, 48000, self.rate, 4), data)
+        # 100 ms behind the clock: 4800 samples of silence first
+        padded = align_audio_chunk(data, 1.1, 48000, self.rate, 4)
+        self.assertEqual(padded, b"\0" * 4800 * 4 + data)
+        # 50 ms ahead: the 2400 samples already covered are skipped
+        self.assertEqual(align_audio_chunk(data, 0.95, 48000, self.rate, 4), b"")
+        self.assertEqual(align_audio_chunk(data * 10, 0.95, 48000, self.rate, 4), (data * 10)[2400 * 4:])
+
+
+class FrameRingBufferTest(unittest.TestCase):
+    def test_frames_come_out_in_capture_order(self):
+        ring = FrameRingBuffer(3, (2, 2, 3))
+        for value in range(2):
+            slot = ring.acquire()
+            ring.frames[slot][:] = value
+            ring.commit(slot, meta=value)
+        ring.commit_duplicate(meta="repeat")
+        taken = [ring.take() for _ in range(3)]
+        self.assertEqual([ticket for _, ticket, _ in taken], [0, 1, 2])
+        self.assertEqual([meta for _, _, meta in taken], [0, 1, "repeat"])
+        self.assertIsNone(taken[2][0]) # Repeats take no slot
+        self.assertEqual(int(ring.frames[taken[1][0]][0, 0, 0]), 1)
+
+    def test_drop_oldest_turns_the_oldest_frame_into_a_repeat(self):
+        ring = FrameRingBuffer(2, (1, 1, 3), backpressure=BACKPRESSURE_DROP_OLDEST)
+        first, second = ring.acquire(), ring.acquire()
+        ring.commit(first, "a")
+        ring.commit(second, "b")
+        reused = ring.acquire() # Nothing free: the oldest queued frame gives up its slot
+        self.assertEqual(reused, first)
+        self.assertEqual(ring.dropped_frames, 1)
+        ring.commit(reused, "c")
+        self.assertEqual(ring.take(), (None, 0, "a"))
+        self.assertEqual(ring.take(), (second, 1, "b"))
+        self.assertEqual(ring.take(), (first, 2, "c"))
+
+    def test_block_waits_for_a_release(self):
+        ring = FrameRingBuffer(2, (1, 1, 3), backpressure=BACKPRESSURE_BLOCK)
+        slots = [ring.acquire(), ring.acquire()]
+        for slot in slots:
+            ring.commit(slot)
+        acquired = []
+        producer = threading.Thread(target=lambda: acquired.append(ring.acquire()))
+        producer.start()
+        producer.join(timeout=0.2)
+        self.assertTrue(producer.is_alive()) # Blocked: no frame is ever dropped
+        slot, _, _ = ring.take()
+        ring.release(slot)
+        producer.join(timeout=5)
+        self.assertEqual(acquired, [slot])
+        self.assertEqual(ring.dropped_frames, 0)
+
+    def test_close_drains_then_ends(self):
+        ring = FrameRingBuffer(2, (1, 1, 3), backpressure=BACKPRESSURE_BLOCK)
+        slot = ring.acquire()
+        ring.commit(slot)
+        ring.close()
+        self.assertIsNone(ring.acquire())
+        self.assertEqual(ring.take()[0], slot)
+        self.assertIsNone(ring.take())
+
+    def test_pinned_slot_is_kept_until_unpinned(self):
+        ring = FrameRingBuffer(2, (1, 1, 3))
+        slot = ring.acquire()
+        ring.pin(slot)
+        ring.commit(slot)
+        ring.release(ring.take()[0])
+        other = ring.acquire()
+        self.assertNotEqual(other, slot)
+        ring.unpin()
+        self.assertEqual(ring.acquire(), slot)
+
+
+class ScaledFrameSizeTest(unittest.TestCase):
+    CASES = [
+        # frame size, target size, scale -> output size
+        ((1920, 1080), None, None, (1920, 1080)),
+        ((3840, 2160), (1920, 1080), None, (1920, 1080)),
+        ((3840, 2160), (1920, None), None, (1920, 1080)),   # Height follows the aspect ratio
+        ((3840, 2160), (None, 1080), None, (1920, 1080)),
+        ((1366, 768), (None, 720), None, (1280, 720)),      # 1280.6 wide, rounded to even
+        ((2880, 1800), None, 0.5, (1440, 900)),
+        ((1001, 667), None, 0.5, (500, 334)),               # Odd captures come out even
+        ((1920, 1080), (1280, 1080), None, (1280, 1080)),   # Each axis on its own when both are given
+        ((800, 600), (1920, 1080), None, (800, 600)),       # Never upscaled
+        ((801, 601), None, 2.0, (801, 601)),                # Unchanged capture: the writer pads it
+        ((3, 3), None, 0.1, (2, 2)),
+    ]
+
+    def test_sizes(self):
+        for frame_size, target_size, scale, expected in self.CASES:
+            with self.subTest(frame_size=frame_size, target_size=target_size, scale=scale):
+                size = scaled_frame_size(frame_size, target_size, scale)
+                self.assertEqual(size, expected)
+                if size != frame_size:
+                    self.assertEqual((size[0] % 2, size[1] % 2), (0, 0))
+
+
+class FrameChangeDetectorTest(unittest.TestCase):
+    def setUp(self):
+        self.frame = np.full((24, 32, 3), 100, dtype=np.uint8)
+
+    def test_identical_frames_are_unchanged(self):
+        detector = FrameChangeDetector(self.frame.shape)
+        self.assertTrue(detector.is_changed(self.frame)) # The first frame is always encoded
+        self.assertFalse(detector.is_changed(self.frame.copy()))
+
+    def test_threshold(self):
+        detector = FrameChangeDetector(self.frame.shape, threshold=4)
+        detector.is_changed(self.frame)
+        noisy = self.frame.copy()
+        noisy[5, 7, 1] += 4 # Largest difference still "unchanged"
+        self.assertFalse(detector.is_changed(noisy))
+        noisy[5, 7, 1] += 1
+        self.assertTrue(detector.is_changed(noisy))
+        self.assertFalse(detector.is_changed(noisy)) # The changed frame is the new reference
+
+    def test_reference_is_a_copy(self):
+        detector = FrameChangeDetector(self.frame.shape)
+        detector.is_changed(self.frame)
+        self.frame[0, 0] = 0 # The capture buffer is reused for the next frame
+        self.assertTrue(detector.is_changed(self.frame))
+
+    def test_meta_change_and_max_repeat_force_a_frame(self):
+        detector = FrameChangeDetector(self.frame.shape, max_repeat=2)
+        detector.is_changed(self.frame, meta=(1, 1))
+        self.assertTrue(detector.is_changed(self.frame, meta=(2, 1))) # The cursor moved
+        results = [detector.is_changed(self.frame, meta=(2, 1)) for _ in range(6)]
+        self.assertEqual(results, [False, False, True, False, False, True])
+
+    def test_reset_forces_the_next_frame(self):
+        detector = FrameChangeDetector(self.frame.shape)
+        detector.is_changed(self.frame)
+        detector.reset()
+        self.assertTrue(detector.is_changed(self.frame))
+
+
+class AudioRingBufferTest(unittest.TestCase):
+    def test_chunks_in_order_with_timestamps(self):
+        ring = AudioRingBuffer(4, 8)
+        ring.put(b"abcd", 0.5)
+        ring.put(b"efgh1234", 0.6, overflow=True)
+        self.assertEqual(len(ring), 2)
+        self.assertEqual(ring.get(), (0.5, b"abcd", 0, False))
+        self.assertEqual(ring.get(), (0.6, b"efgh1234", 0, True))
+        self.assertIsNone(ring.get())
+
+    def test_overrun_drops_and_reports_lost_bytes(self):
+        ring = AudioRingBuffer(2, 4)
+        self.assertTrue(ring.put(b"aaaa", 0.0))
+        self.assertTrue(ring.put(b"bbbb", 0.1))
+        self.assertFalse(ring.put(b"cccc", 0.2)) # Full: dropped, never waits
+        self.assertFalse(ring.put(b"dd", 0.3))
+        self.assertEqual(ring.overruns, 2)
+        ring.get()
+        self.assertTrue(ring.put(b"eeee", 0.4))
+        ring.get()
+        self.assertEqual(ring.get(), (0.4, b"eeee", 6, False)) # The gap travels with the next chunk
+
+    def test_wraps_around(self):
+        ring = AudioRingBuffer(3, 2)
+        for i in range(10):
+            ring.put(bytes([i, i]), float(i))
+            self.assertEqual(ring.get(), (float(i), bytes([i, i]), 0, False))
+
+
+class FrameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="recorder_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_read_mp4_index(self):
+        filename = os.path.join(self.directory, "clip.mp4")
+        sizes = [40, 20, 10, 30]
+        first, second = write_fixture_mp4(filename, sizes, [3, 1])
+        entries = frame_index.read_mp4_index(filename)
+        self.assertEqual([entry.frame for entry in entries], [0, 1, 2, 3])
+        self.assertEqual([entry.pts for entry in entries], [0.0, 0.3, 0.1, 0.2]) # ctts minus the edit
+        self.assertEqual([entry.offset for entry in entries], [first, first + 40, first + 60, second])
+        self.assertEqual([entry.size for entry in entries], sizes)
+        self.assertEqual([entry.keyframe for entry in entries], [True, False, False, False])
+
+        self.assertEqual(frame_index.frame_at(entries, 0.25).frame, 3) # Presented at 0.2
+        self.assertEqual(frame_index.frame_at(entries, 0.3).frame, 1)
+        self.assertEqual(frame_index.keyframe_at(entries, 0.35).frame, 0)
+
+    def test_get_index_writes_and_reuses_the_sidecar(self):
+        filename = os.path.join(self.directory, "clip.mp4")
+        write_fixture_mp4(filename, [40, 20, 10, 30], [2, 2])
+        entries = frame_index.get_index(filename)
+        sidecar = frame_index.index_filename(filename)
+        self.assertTrue(os.path.exists(sidecar))
+        self.assertEqual(frame_index.load_index(sidecar), entries)
+        os.remove(filename) # Only the sidecar is read now
+        open(filename, "wb").close()
+        os.utime(sidecar) # At least as new as the video
+        self.assertEqual(frame_index.get_index(filename), entries)
+
+    def test_not_an_mp4(self):
+        filename = os.path.join(self.directory, "clip.mp4")
+        with open(filename, "wb") as f:
+            f.write(box(b"ftyp", b"isom") + box(b"mdat", bytes(16))) # Unfinished: no 'moov'
+        with self.assertRaises(ValueError):
+            frame_index.read_mp4_index(filename)
+        self.assertIsNone(frame_index.get_index(filename))
+
+    def test_mjpeg_writer_index_points_at_each_jpeg(self):
+        filename = os.path.join(self.directory, "clip.avi")
+        sidecar = frame_index.index_filename(filename)
+        writer = MjpegAviWriter(filename, 10, (32, 24), index_filename=sidecar)
+        writer.write(np.full((24, 32, 3), 0, dtype=np.uint8))
+        writer.write_duplicate()
+        for value in (100, 200):
+            writer.write(np.full((24, 32, 3), value, dtype=np.uint8))
+        writer.release()
+        entries = frame_index.load_index(sidecar)
+        with open(filename, "rb") as f:
+            data = f.read()
+        self.assertEqual([entry.pts for entry in entries], [0.0, 0.1, 0.2, 0.3])
+        self.assertEqual([entry.keyframe for entry in entries], [True, False, True, True])
+        self.assertEqual(entries[1].size, 0)
+        for entry in entries[:1] + entries[2:]:
+            jpeg = data[entry.offset:entry.offset + entry.size]
+            self.assertTrue(jpeg.startswith(b"\xff\xd8") and jpeg.endswith(b"\xff\xd9"))
+
+        # A JPEG thumbnail is the frame's own bytes: no decoding, no FFmpeg
+        image = os.path.join(self.directory, "thumb.jpg")
+        frame_index.extract_thumbnail(filename, image, seconds=0.15) # Shows frame 0 (frame 1 repeats it)
+        with open(image, "rb") as f:
+            self.assertEqual(f.read(), data[entries[0].offset:entries[0].offset + entries[0].size])
+
+
+class RawSpoolTest(unittest.TestCase):
+    frame_size = (32, 24)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="recorder_test_")
+        self.filename = os.path.join(self.directory, raw_spool.SPOOL_FILE_NAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def spool_writer(self, capacity):
+        max_bytes = raw_spool.HEADER_SIZE + capacity * raw_spool.record_size(self.frame_size)
+        return raw_spool.RawSpoolWriter(self.filename, 10, self.frame_size, max_bytes)
+
+    def frame(self, value):
+        return np.full((24, 32, 3), value, dtype=np.uint8)
+
+    def records(self):
+        spool = raw_spool.RawSpool(self.filename)
+        try:
+            records = []
+            for index in range(spool.records):
+                _, repeats, frame = spool.record(index)
+                records.append((int(frame[0, 0, 0]), repeats))
+                del frame
+            return records, spool.frame_count()
+        finally:
+            spool.close()
+
+    def encode(self, create_writer, workers=2):
+        return raw_spool.encode_spool(self.filename, self.directory, create_writer, ".avi", workers=workers)
+
+    def test_leading_duplicates_stay_on_the_timeline(self):
+        writer = self.spool_writer(8)
+        writer.write_duplicate() # Before the first frame, e.g. slots missed while capture started
+        writer.write_duplicate()
+        for value in (10, 20, 30):
+            writer.write_timed(self.frame(value), value / 100)
+        writer.write_duplicate()
+        writer.release()
+        self.assertEqual(self.records(), ([(10, 2), (20, 0), (30, 1)], 6))
+
+        writers = []
+        def create_writer(filename, fps, frame_size):
+            writers.append(MjpegAviWriter(filename, fps, frame_size))
+            return writers[-1]
+        chunk_files = self.encode(create_writer)
+        self.assertEqual(len(chunk_files), 2)
+        self.assertEqual(sum(writer.frames_written for writer in writers), 6)
+
+    def test_thinning_then_full(self):
+        writer = self.spool_writer(10)
+        for value in range(25):
+            writer.write(self.frame(value))
+        writer.release()
+        records, frame_count = self.records()
+        # Every frame up to 50% of the budget, then every 2nd, every 4th past 75%, every 8th past 90%
+        self.assertEqual([value for value, _ in records], [0, 1, 2, 3, 4, 6, 8, 10, 14, 22])
+        self.assertEqual([repeats for _, repeats in records], [0, 0, 0, 0, 1, 1, 1, 3, 7, 2])
+        self.assertEqual(frame_count, 25)
+        self.assertEqual(writer.thinned_frames, 13)
+        self.assertEqual(writer.duplicate_frames, 15)
+        self.assertTrue(writer.full)
+
+    def test_budget_is_capped_by_free_disk_space(self):
+        size = raw_spool.record_size(self.frame_size)
+        usage = shutil.disk_usage(self.directory)
+        free = raw_spool.HEADER_SIZE + 64 * 1024 * 1024 + 3 * size
+        with mock.patch("raw_spool.shutil.disk_usage", return_value=usage._replace(free=free)):
+            writer = self.spool_writer(100)
+        writer.release()
+        self.assertEqual(writer.capacity, 3)
+        with mock.patch("raw_spool.shutil.disk_usage", return_value=usage._replace(free=size)):
+            with self.assertRaises(RuntimeError):
+                self.spool_writer(100)
+
+    def test_encoder_error_propagates(self):
+        writer = self.spool_writer(4)
+        for value in range(4):
+            writer.write(self.frame(value))
+        writer.release()
+
+        class FailingWriter:
+            frames = []
+            def __init__(self, filename, fps, frame_size):
+                pass
+            def write(self, frame):
+                self.frames.append(frame) # Holds views of the spool, like a writer that failed mid-frame
+                raise RuntimeError("encoder exploded")
+            def release(self):
+                pass
+
+        with self.assertRaisesRegex(RuntimeError, "encoder exploded"):
+            self.encode(FailingWriter)
+        FailingWriter.frames.clear()
+
+
+class SegmentedWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="recorder_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def segmented_writer(self, create_writer):
+        return segments.SegmentedWriter(self.directory, 10, (32, 24), 0.5, create_writer, ".avi")
+
+    def test_rotation_and_closer_thread(self):
+        released_on = []
+        class RecordingWriter(MjpegAviWriter):
+            def release(self):
+                released_on.append(threading.current_thread().name)
+                super().release()
+
+        writer = self.segmented_writer(lambda filename: RecordingWriter(filename, 10, (32, 24)))
+        writer.write(np.full((24, 32, 3), 50, dtype=np.uint8))
+        for _ in range(13): # A static screen across two segment boundaries
+            writer.write_duplicate()
+        writer.release()
+        self.assertEqual(writer.frames_written, 14)
+        self.assertEqual(writer.duplicate_frames, 13)
+        self.assertEqual(len(writer.segment_files), 3)
+        self.assertEqual(released_on, ["segment-closer"] * 3) # Never on the writing thread
+        self.assertEqual(segments.list_segments(self.directory), writer.segment_files)
+        with open(os.path.join(self.directory, segments.CONCAT_LIST_NAME)) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_close_error_is_raised_by_release(self):
+        class FailingWriter(MjpegAviWriter):
+            def release(self):
+                super().release()
+                if self.filename.endswith("00000.avi"):
+                    raise RuntimeError("disk full")
+
+        writer = self.segmented_writer(lambda filename: FailingWriter(filename, 10, (32, 24)))
+        for value in range(12):
+            writer.write(np.full((24, 32, 3), value, dtype=np.uint8))
+        with self.assertRaisesRegex(RuntimeError, "disk full"):
+            writer.release()
+        self.assertEqual(len(segments.list_segments(self.directory)), 3) # The others were still closed
+
+    @unittest.skipUnless(shutil.which(ffmpeg_tools.FFMPEG), "needs FFmpeg")
+    def test_joined_segments_keep_every_frame(self):
+        writer = self.segmented_writer(lambda filename: MjpegAviWriter(filename, 10, (32, 24)))
+        for value in (0, 100):
+            writer.write(np.full((24, 32, 3), value, dtype=np.uint8))
+            for _ in range(6):
+                writer.write_duplicate()
+        writer.release()
+        output = os.path.join(self.directory, "joined.mp4")
+        list_path = os.path.join(self.directory, segments.CONCAT_LIST_NAME)
+        process = ffmpeg_tools.run_ffmpeg(["-y"] + segments.concat_input_args(list_path) + ["-c", "copy", output])
+        self.assertEqual(process.returncode, 0, process.stderr)
+        entries = frame_index.read_mp4_index(output)
+        # Each 0.5 s segment starts and ends with a stored frame, so the join lasts 14 frames (1.4 s)
+        self.assertEqual([entry.pts for entry in entries], [0.0, 0.4, 0.5, 0.7, 0.9, 1.0, 1.3])
+
+
+class MultiRegionTest(unittest.TestCase):
+    class FrameListWriter:
+        """Keeps a copy of every frame it is given."""
+        def __init__(self, name):
+            self.filename = name
+            self.frames = []
+            self.frames_written = self.duplicate_frames = 0
+
+        def encode(self, frame):
+            return frame.copy()
+
+        def write(self, frame):
+            self.write_packet(self.encode(frame))
+
+        def write_packet(self, packet, keyframe=True):
+            self.frames.append(packet)
+            self.frames_written += 1
+
+        def write_duplicate(self):
+            self.write_packet(self.frames[-1])
+            self.duplicate_frames += 1
+
+        def release(self):
+            pass
+
+    def test_one_grab_split_into_regions(self):
+        regions = [(110, 20, 16, 8), (140, 4, 8, 12)] # Screen coordinates
+        left, top, width, height = union_region(regions)
+        self.assertEqual((left, top, width, height), (110, 4, 38, 24))
+
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        frame[16:24, 0:16] = 1  # First region, at (110, 20) on screen
+        frame[0:12, 30:38] = 2  # Second region, at (140, 4)
+        writers = [self.FrameListWriter("a"), self.FrameListWriter("b")]
+        split = RegionSplitWriter(writers, [(x - left, y - top, w, h) for x, y, w, h in regions])
+        self.assertEqual(split.filenames, ["a", "b"])
+        split.write(frame)
+        split.write_packet(split.encode(frame))
+        split.write_duplicate()
+        split.release()
+
+        for writer, (_, _, w, h), value in zip(writers, regions, (1, 2)):
+            self.assertEqual(len(writer.frames), 3)
+            for crop in writer.frames:
+                self.assertEqual(crop.shape, (h, w, 3))
+                self.assertTrue((crop == value).all())
+        self.assertEqual(split.frames_written, 3)
+        self.assertEqual(split.duplicate_frames, 1)
+
+
+class ReplayBufferTest(unittest.TestCase):
+    def test_window_evicts_by_time(self):
+        buffer = replay_buffer.ReplayBuffer(1.0)
+        for i in range(21):
+            buffer.add_video(i / 10, bytes([i]) * 10)
+            buffer.add_audio(i / 10, b"\0" * 4)
+        video, audio = buffer.snapshot()
+        self.assertEqual([round(t, 1) for t, _ in video], [round(i / 10, 1) for i in range(10, 21)])
+        self.assertEqual(len(audio), 11)
+        self.assertAlmostEqual(buffer.duration(), 1.0)
+        self.assertEqual(buffer.bytes_used, 11 * 10 + 11 * 4)
+        self.assertEqual(buffer.evicted_for_memory, 0)
+
+    def test_repeats_keep_an_evicted_packet_accounted(self):
+        buffer = replay_buffer.ReplayBuffer(0.15)
+        packet = b"x" * 100
+        buffer.add_video(0.0, packet)
+        buffer.add_video(0.1, packet, repeat=True)
+        buffer.add_video(0.2, packet, repeat=True) # Evicts the packet's own entry
+        self.assertEqual(len(buffer.snapshot()[0]), 2)
+        self.assertEqual(buffer.bytes_used, 100) # Still held by the repeats
+        buffer.add_video(0.4, b"y" * 10)
+        self.assertEqual(buffer.bytes_used, 10)
+
+    def test_memory_cap_evicts_the_oldest_entries(self):
+        buffer = replay_buffer.ReplayBuffer(60.0, max_bytes=250)
+        for i in range(5):
+            buffer.add_audio(i / 10, b"\0" * 20)
+            buffer.add_video(i / 10 + 0.01, bytes([i]) * 100)
+        video, audio = buffer.snapshot()
+        self.assertLessEqual(buffer.bytes_used, 250)
+        self.assertEqual([packet[0] for _, packet in video], [3, 4])
+        self.assertEqual([round(t, 1) for t, _ in audio], [0.3, 0.4]) # The same stretch of time
+        self.assertEqual(buffer.bytes_used, 240)
+        self.assertEqual(buffer.evicted_for_memory, 6)
+
+    def test_leading_duplicates_keep_later_timestamps(self):
+        buffer = replay_buffer.ReplayBuffer(10.0)
+        writer = replay_buffer.ReplayWriter(buffer, 10)
+        writer.write_duplicate() # Before the first packet
+        writer.write_duplicate()
+        writer.write(np.zeros((24, 32, 3), dtype=np.uint8))
+        writer.write_duplicate()
+        video, _ = buffer.snapshot()
+        self.assertEqual([round(t, 1) for t, _ in video], [0.2, 0.3])
+        self.assertEqual(writer.frames_written, 4)
+        self.assertEqual(writer.duplicate_frames, 3)
+
+
+class QualityGovernorTest(unittest.TestCase):
+    class Stub:
+        quality = 90
+        capture_interval = 1
+
+    def setUp(self):
+        self.pipeline, self.writer = self.Stub(), self.Stub()
+        self.governor = quality_governor.QualityGovernor(self.pipeline, self.writer, 20, min_fps=10, min_quality=70)
+        self.now = 0.0
+        self.totals = {"frames_late_total": 0, "grab_seconds": {"sum": 0.0}}
+        self.sample(0.0) # Baseline
+
+    def sample(self, load, late=0):
+        """Feeds one metrics sample, one second after the previous, with the capture thread load busy."""
+        self.now += 1.0
+        self.totals["frames_late_total"] += late
+        self.totals["grab_seconds"]["sum"] += load
+        with mock.patch("quality_governor.time.monotonic", return_value=self.now):
+            self.governor.update(self.totals)
+        return self.pipeline.capture_interval, self.writer.quality
+
+    def test_degrades_quality_first_then_fps(self):
+        self.assertEqual(self.governor.levels, [(1, 90), (1, 80), (1, 70), (2, 70)])
+        steps = [self.sample(0.5, late=2), self.sample(0.95), self.sample(0.5, late=1), self.sample(1.0)]
+        self.assertEqual(steps, [(1, 80), (1, 70), (2, 70), (2, 70)]) # Stops at the last step
+        self.assertEqual(self.governor.effective_fps, 10)
+        self.assertEqual(len(self.governor.adjustments), 3)
+
+    def test_recovers_one_step_after_calm_samples(self):
+        for _ in range(3):
+            self.sample(0.5, late=1)
+        self.assertEqual(self.governor.level, 3)
+        # 40% busy at every 2nd slot would be 80% at every slot: too close to recover
+        self.assertEqual([self.sample(0.4) for _ in range(5)], [(2, 70)] * 5)
+        # 20% busy (40% at every slot): three calm samples in a row, then one step up
+        self.assertEqual([self.sample(0.2) for _ in range(3)], [(2, 70), (2, 70), (1, 70)])
+        # A busy sample in between starts the count again
+        self.assertEqual([self.sample(0.2), self.sample(0.7), self.sample(0.2), self.sample(0.2)], [(1, 70)] * 4)
+        self.assertEqual(self.sample(0.2), (1, 80))
+
+
+class MjpegProcessPoolTest(unittest.TestCase):
+    def test_more_encoder_threads_than_workers(self):
+        directory = tempfile.mkdtemp(prefix="recorder_test_")
+        self.addCleanup(shutil.rmtree, directory, True)
+        writer = MjpegAviWriter(os.path.join(directory, "clip.avi"), 10, (32, 24))
+        pool = MjpegProcessPool(writer, (32, 24), workers=1, encoder_threads=4)
+        try:
+            buffers = [pool.allocate_frame() for _ in range(4)] # One per encoder thread
+            packets = []
+            def encode(value):
+                # Frames from outside the slots borrow a spare; with all of them in use this waits
+                packet = pool.encode(np.full((24, 32, 3), value, dtype=np.uint8))
+                packets.append(bytes(packet[:2]))
+            threads = [threading.Thread(target=encode, args=(value,)) for value in range(12)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=60)
+            self.assertEqual(packets, [b"\xff\xd8"] * 12)
+            buffers[0][:] = 255
+            pool.write(buffers[0]) # Straight from its slot
+            del buffers
+        finally:
+            pool.release()
+        self.assertEqual(writer.frames_written, 1)
+
+
+class StubEngine:
+    """Stands in for RecorderEngine in the RecorderProcess child: no capture, same surface."""
+    def __init__(self, region, on_status=None, on_error=None, on_failure=None, fail=None, output_filename=None):
+        if fail == "init":
+            raise ValueError("no such encoder")
+        self.on_status = on_status
+        self.fail = fail
+        self.encoder_choice = None
+        self.final_output_filename = output_filename
+        self.output_filenames = None
+        self.frames = 0
+
+    def start(self):
+        if self.fail == "start":
+            raise RecorderError("FFmpeg is missing")
+        self.on_status("Recording...")
+
+    def pause(self):
+        self.on_status("paused")
+
+    def resume(self):
+        self.on_status("resumed")
+
+    def stats(self):
+        if self.fail == "crash":
+            os._exit(3) # Like a crash in a native library
+        self.frames += 10
+        return {"written": self.frames}
+
+    def save_replay(self, filename, on_done=None):
+        on_done(True)
+
+    def stop_capture(self):
+        pass
+
+    def finalize(self, on_progress=None):
+        on_progress(1.0)
+        return True
+
+
+class RecorderProcessTest(unittest.TestCase):
+    def recorder(self, **options):
+        events = []
+        recorder = RecorderProcess((0, 0, 32, 24), on_status=lambda text: events.append(("status", text)),
+                                   on_error=lambda title, message: events.append(("error", message)),
+                                   on_failure=lambda: events.append(("failure",)), engine_class=StubEngine,
+                                   output_filename="clip.mp4", **options)
+        self.addCleanup(recorder._process.join, 30)
+        return recorder, events
+
+    def call(self, function, *args):
+        """Runs function on a thread, so a call that never returns fails the test instead of hanging it."""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.run_catching(function, *args)), daemon=True)
+        thread.start()
+        thread.join(timeout=30)
+        self.assertFalse(thread.is_alive(), f"{function.__name__}() did not return")
+        value, error = result[0]
+        if error is not None:
+            raise error
+        return value
+
+    @staticmethod
+    def run_catching(function, *args):
+        try:
+            return function(*args), None
+        except Exception as e:
+            return None, e
+
+    def test_commands_and_replies(self):
+        recorder, events = self.recorder()
+        self.call(recorder.start)
+        self.assertTrue(recorder.is_recording)
+        self.assertEqual(recorder.final_output_filename, "clip.mp4")
+        recorder.pause()
+        recorder.resume()
+        self.assertEqual(self.call(recorder.stats), {"written": 10}) # Replies come in order after the commands
+        saved = []
+        self.call(recorder.save_replay, "replay.mp4", saved.append)
+        recorder.stop_capture()
+        progress = []
+        self.assertTrue(self.call(recorder.finalize, progress.append))
+        self.assertEqual(progress, [1.0])
+        self.assertEqual(saved, [True])
+        self.assertEqual([text for kind, text in events], ["Recording...", "paused", "resumed"])
+
+    def test_startup_error_is_reported_by_start(self):
+        recorder, events = self.recorder(fail="init")
+        with self.assertRaisesRegex(RecorderError, "no such encoder"): # Sent just before the child exited
+            self.call(recorder.start)
+        for _ in range(2): # Every later call sees the exit, none waits for a reply that never comes
+            with self.assertRaisesRegex(RecorderError, "has exited"):
+                self.call(recorder.save_replay, "replay.mp4")
+        self.assertEqual(self.call(recorder.stats), {})
+        self.assertFalse(self.call(recorder.finalize))
+        self.assertEqual(events, [("error", "The recording process has exited.")])
+
+    def test_start_error(self):
+        recorder, events = self.recorder(fail="start")
+        with self.assertRaisesRegex(RecorderError, "FFmpeg is missing"):
+            self.call(recorder.start)
+        self.assertFalse(recorder.is_recording)
+
+    def test_child_exit_while_recording(self):
+        recorder, events = self.recorder(fail="crash")
+        self.call(recorder.start)
+        with self.assertRaisesRegex(RecorderError, "has exited"):
+            self.call(recorder.stats)
+        recorder._reader.join(timeout=30)
+        self.assertFalse(recorder.is_recording)
+        self.assertEqual(events[1:], [("error", "The recording process exited unexpectedly."), ("failure",)])
+        self.assertFalse(self.call(recorder.finalize)) # Already reported: no second error
+        self.assertEqual(len(events), 3)
+
+
+class StreamingAudioSinkTest(unittest.TestCase):
+    def test_wav_is_valid_after_every_batch(self):
+        directory = tempfile.mkdtemp(prefix="recorder_test_")
+        self.addCleanup(shutil.rmtree, directory, True)
+        filename = os.path.join(directory, "audio.wav")
+        sink = StreamingAudioSink(filename, 2, 2, 44100).open()
+        try:
+            for batch in range(1, 4):
+                for _ in range(batch):
+                    sink.write(b"\x01\x00\x02\x00" * 1000)
+                expected = 4000 * batch * (batch + 1) // 2
+                deadline = time.monotonic() + 10
+                while sink.bytes_written < expected and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(sink.bytes_written, expected)
+                # Read while the sink is still open, like after a crash
+                with open(filename, "rb") as f:
+                    data = f.read()
+                self.assertEqual(data[:4] + data[8:12], b"RIFFWAVE")
+                self.assertEqual(struct.unpack_from("<I", data, 4)[0], len(data) - 8)
+                data_chunk = data.index(b"data")
+                self.assertEqual(struct.unpack_from("<I", data, data_chunk + 4)[0], sink.bytes_written)
+                with wave.open(filename, "rb") as wav:
+                    self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), (2, 2, 44100))
+                    self.assertEqual(wav.getnframes(), sink.bytes_written // 4)
+        finally:
+            sink.close()
+        with wave.open(filename, "rb") as wav:
+            self.assertEqual(wav.getnframes(), 6000)
+            self.assertEqual(wav.readframes(1), b"\x01\x00\x02\x00")
+
+
+class EncoderSelectionTest(unittest.TestCase):
+    RESULTS = [
+        {"name": "mjpg", "encoder": "mjpg", "preset": None,
+         "fps": 200.0, "bytes_per_frame": 50000, "cpu_percent": 90.0},
+        {"name": "xvid", "encoder": "xvid", "preset": None, "error": "FFmpeg not found"},
+        {"name": "ffv1", "encoder": "ffv1", "preset": None,
+         "fps": 100.0, "bytes_per_frame": 30000, "cpu_percent": 90.0},
+        {"name": "x264-ultrafast", "encoder": "x264", "preset": "ultrafast",
+         "fps": 60.0, "bytes_per_frame": 8000, "cpu_percent": 90.0},
+        {"name": "x264-veryfast", "encoder": "x264", "preset": "veryfast",
+         "fps": 25.0, "bytes_per_frame": 5000, "cpu_percent": 90.0},
+    ]
+
+    def select(self, fps, container=".mp4"):
+        result, _ = encoder_calibration.select_encoder(self.RESULTS, fps, container=container)
+        return result and result["name"]
+
+    def test_smallest_output_that_keeps_up(self):
+        self.assertEqual(self.select(30), "x264-ultrafast") # veryfast is smaller but below 45 fps
+        self.assertEqual(self.select(10), "x264-veryfast")
+        self.assertEqual(self.select(100), "mjpg")           # Only one sustains 150 fps
+
+    def test_fastest_when_none_keeps_up(self):
+        result, reason = encoder_calibration.select_encoder(self.RESULTS, 200)
+        self.assertEqual(result["name"], "mjpg")
+        self.assertIn("none sustains 300 fps", reason)
+
+    def test_container_limits_the_choice(self):
+        self.assertEqual(self.select(60, container=".mp4"), "mjpg")  # ffv1 cannot go into MP4
+        self.assertEqual(self.select(60, container=".mkv"), "ffv1")  # Sustains 90 fps, smaller than mjpg
+        self.assertIsNone(self.select(30, container=".webm"))
+
+    def test_choose_encoder_calibrates_once_and_falls_back_to_mjpg(self):
+        directory = tempfile.mkdtemp(prefix="recorder_test_")
+        self.addCleanup(shutil.rmtree, directory, True)
+        cache_file = os.path.join(directory, "calibration.json")
+        by_name = {result["name"]: result for result in self.RESULTS}
+        measure = lambda candidate, frame_size, **options: by_name.get(candidate[0]) or {
+            "name": candidate[0], "encoder": candidate[1], "preset": candidate[2], "error": "not measured"}
+        with mock.patch("encoder_calibration.measure_encoder", side_effect=measure) as measured:
+            choice = encoder_calibration.choose_encoder((320, 240), 30, cache_file=cache_file)
+            self.assertEqual((choice.encoder, choice.preset), ("x264", "ultrafast"))
+            calls = measured.call_count
+            again = encoder_calibration.choose_encoder((320, 240), 10, cache_file=cache_file)
+            self.assertEqual(measured.call_count, calls) # Read from the cache
+            self.assertEqual((again.encoder, again.preset), ("x264", "veryfast"))
+
+        failed = lambda candidate, frame_size, **options: {"name": candidate[0], "encoder": candidate[1],
+                                                             "preset": candidate[2], "error": "FFmpeg not found"}
+        with mock.patch("encoder_calibration.measure_encoder", side_effect=failed):
+            choice = encoder_calibration.choose_encoder((320, 240), 30, refresh=True, cache_file=cache_file)
+        self.assertEqual((choice.encoder, choice.preset, choice.result), ("mjpg", None, None))
+        self.assertIn("using mjpg", choice.reason)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,25 +1,25 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import threading
-import time
-from PIL import ImageGrab
-import cv2
-import numpy as np
 import datetime
 import os
 import sys
-import pyautogui # For getting mouse position
 
 import pyaudio # For audio recording
-import wave    # For saving audio to WAV file
-import subprocess # For calling FFmpeg to merge video and audio
+import subprocess # For opening the output folder
+
+from finalizer import JOB_DONE, FinalizationQueue
+from frame_pipeline import BACKPRESSURE_DROP_OLDEST
+from recorder_engine import RecorderEngine, RecorderError, list_audio_devices # Capture, encoding and merging
+from engine_process import RecorderProcess # The engine in a child process, off this process's GIL
+from screen_geometry import ScreenGeometryCache, grab_snapshot, snapshot_ppm # Overlay size without a screenshot
 
 # ScreenRecorderApp class for the main application window
 class ScreenRecorderApp:
     def __init__(self, master):
         self.master = master
         master.title("Enhanced Screen Recorder")
-        master.geometry("450x450") # Larger initial window size to accommodate new options
+        master.geometry("450x560") # Larger initial window size to accommodate new options
         master.resizable(False, False) # Prevent resizing
 
         # Configure styles for a more modern look
@@ -48,27 +48,61 @@ class ScreenRecorderApp:
 
         self.is_recording = False
         self.is_paused = False
-        self.recording_thread = None
-        self.audio_thread = None # New: Thread for audio recording
-        self.out = None  # VideoWriter object
-        self.video_filename_raw = "" # New: Path for raw video before merging
-        self.audio_filename_temp = "" # New: Path for temporary audio file
+        self.engine = None # RecorderEngine (or RecorderProcess hosting one) doing the actual recording
+        # Stopped recordings are merged here in the background, so a new one can start right away
+        self.finalizer = FinalizationQueue(on_update=lambda job: self.master.after(0, self._on_finalization_update, job))
         self.final_output_filename = "" # New: Path for final merged video
         self.recording_area = None # (x, y, width, height) of selected area
         self.countdown_active = False
+        self.engine_starting = False # engine.start() is running on its worker thread
 
         # Variables for new options
         self.fps_var = tk.StringVar(value="20") # Default FPS
         self.highlight_mouse_var = tk.BooleanVar(value=False) # Default to no mouse highlight
+        self.instant_replay_var = tk.BooleanVar(value=False) # Keep the last seconds in memory instead of recording to a file
         self.audio_source_var = tk.StringVar(value="No Audio") # New: Default to no audio
         self.audio_device_var = tk.StringVar(value="No Microphone Detected") # New: Stores selected audio device
         self.p = None # PyAudio instance
-        self.audio_stream = None
-        self.audio_frames = []
-        self.FORMAT = pyaudio.paInt16
-        self.CHANNELS = 1
-        self.RATE = 44100 # Standard sample rate
-        self.CHUNK = 1024 # Audio buffer size
+        self.mic_devices_map = {} # Microphone name -> PyAudio device index
+        self.AUDIO_COMPRESSION = None # "flac" to compress audio while recording (needs FFmpeg)
+        self.AUDIO_RATE = 44100 # Microphone sample rate
+        self.AUDIO_SAMPLE_FORMAT = "int16" # Or "int24" / "int32"
+        self.AUDIO_CHUNK = 1024 # Frames per PortAudio buffer
+        self.AUDIO_BUFFER_SECONDS = 2.0 # Audio held in the ring buffer while the writer is busy
+        self.RECORD_IN_CHILD_PROCESS = True # Capture and encode in a child process so the UI never competes for the GIL
+        self.FRAME_QUEUE_DEPTH = 8 # Frames buffered between the capture and encoder threads
+        self.FRAME_BACKPRESSURE = BACKPRESSURE_DROP_OLDEST # Or BACKPRESSURE_BLOCK to never drop frames
+        self.ENCODER_THREADS = 1 # Threads converting and writing captured frames
+        self.ENCODE_PROCESSES = 0 # Worker processes compressing MJPG frames, e.g. os.cpu_count() for 4K (0 = off)
+        self.CAPTURE_BACKEND = "auto" # "mss" when installed, else "imagegrab"; "synthetic" for tests
+        self.SKIP_UNCHANGED_FRAMES = True # Store static screens as repeated frames instead of re-encoding them
+        self.MAX_REPEATED_FRAMES = None # Force a real frame after this many repeats (None = never)
+        self.VIDEO_ENCODER = "mjpg" # "x264" encodes straight to MP4 through FFmpeg while recording; "auto" picks from a calibration
+        self.X264_PRESET = "veryfast" # libx264 speed/size trade-off for the "x264" encoder
+        self.X264_CRF = 23 # libx264 quality for the "x264" encoder (lower is better and larger)
+        self.SEGMENT_SECONDS = None # Record in crash-safe segments of this many seconds, joined at the end (None = one file)
+        self.SPOOL_DIR = None # Where segments are kept while recording (None = next to the output file)
+        self.RAW_SPOOL_GB = None # Capture uncompressed frames into a spool of this size, encoded when stopped (None = off)
+        self.ENCODE_WORKERS = None # Parallel encoders for the raw spool (None = one per CPU)
+        self.WRITE_FRAME_INDEX = True # Write the <output>.index.csv sidecar used to trim / extract thumbnails
+        self.ADAPTIVE_QUALITY = False # Lower JPEG quality, then the captured fps, while the machine cannot keep up
+        self.ADAPTIVE_MIN_FPS = None # Lowest captured fps (None = a quarter of the chosen fps)
+        self.ADAPTIVE_MIN_QUALITY = 50 # Lowest JPEG quality
+        self.CURSOR_SAMPLE_RATE = 120 # Cursor samples per second for "Highlight Mouse Cursor"
+        self.CURSOR_TRAIL_SECONDS = 0.0 # Draw the cursor's path over this many seconds (0 = no trail)
+        self.CLICK_RIPPLES = True # Draw a ripple at mouse clicks (needs pynput)
+        self.STATUS_INTERVAL = 0.5 # Seconds between status label updates (metrics sampling rate)
+        self.METRICS_JSONL = None # Path to append recording metrics to as JSON lines (None = off)
+        self.METRICS_PROMETHEUS = None # Path of a Prometheus textfile kept up to date while recording
+        self.OUTPUT_SIZE = None # Downscale the video to (width, height), e.g. (1920, None) for HiDPI regions (None = native)
+        self.OUTPUT_SCALE = None # Or downscale by a factor, e.g. 0.5
+        self.SCALE_INTERPOLATION = "area" # "area" (sharpest text) or "linear" (cheaper)
+        self.REPLAY_SECONDS = 30 # Length of the instant replay window
+        self.REPLAY_MAX_MB = 256 # Memory cap of the instant replay buffer
+        self.REPLAY_DIR = None # Where "Save Replay" writes its files (None = current directory)
+        self.FROZEN_SELECTION = False # Select the area on a still snapshot instead of a see-through overlay
+        self.SELECTION_SNAPSHOT_WIDTH = 1920 # The snapshot is shrunk to about this width
+        self.screen_geometry = ScreenGeometryCache() # Desktop size, re-queried only when monitors change
 
         # --- UI Elements ---
 
@@ -76,6 +110,10 @@ class ScreenRecorderApp:
         self.status_label = ttk.Label(master, text="Ready to record", font=("Inter", 12))
         self.status_label.pack(pady=10)
 
+        # Recordings still being finalized, with their progress
+        self.jobs_label = ttk.Label(master, text="", font=("Inter", 9))
+        self.jobs_label.pack()
+
         # Frame for main action buttons
         button_frame = ttk.Frame(master)
         button_frame.pack(pady=5)
@@ -92,6 +130,10 @@ class ScreenRecorderApp:
         self.stop_button = ttk.Button(button_frame, text="Stop Recording", command=self.stop_recording, state=tk.DISABLED, style='Stop.TButton')
         self.stop_button.grid(row=0, column=2, padx=5, pady=5)
 
+        # Save Replay Button (instant replay mode only)
+        self.save_replay_button = ttk.Button(button_frame, text="Save Replay", command=self.save_replay, state=tk.DISABLED)
+        self.save_replay_button.grid(row=1, column=1, padx=5, pady=5)
+
         # Frame for settings/options
         options_frame = ttk.LabelFrame(master, text="Recording Options", padding="10 10")
         options_frame.pack(pady=10, padx=10, fill=tk.X)
@@ -108,6 +150,11 @@ class ScreenRecorderApp:
                                                         variable=self.highlight_mouse_var)
         self.highlight_mouse_checkbox.grid(row=1, column=0, columnspan=2, padx=5, pady=5, sticky="w")
 
+        # Instant Replay Checkbox
+        self.instant_replay_checkbox = ttk.Checkbutton(options_frame, text=f"Instant Replay (keep the last {self.REPLAY_SECONDS}s)",
+                                                       variable=self.instant_replay_var)
+        self.instant_replay_checkbox.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+
         # Audio Options LabelFrame
         audio_options_frame = ttk.LabelFrame(options_frame, text="Audio Source", padding="5 5")
         audio_options_frame.grid(row=2, column=0, columnspan=2, pady=5, padx=5, sticky="ew")
@@ -138,14 +185,8 @@ class ScreenRecorderApp:
         """Initializes PyAudio and populates the microphone device list."""
         try:
             self.p = pyaudio.PyAudio()
-            info = self.p.get_host_api_info_by_index(0)
-            num_devices = info.get('deviceCount')
-            mic_devices = []
-            for i in range(0, num_devices):
-                if (self.p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
-                    device_name = self.p.get_device_info_by_host_api_device_index(0, i).get('name')
-                    mic_devices.append((device_name, i)) # Store (name, index)
-            
+            mic_devices = list_audio_devices(self.p)
+
             if mic_devices:
                 self.mic_device_combobox['values'] = [name for name, _ in mic_devices]
                 self.audio_device_var.set(mic_devices[0][0]) # Set first device as default
@@ -186,7 +227,9 @@ class ScreenRecorderApp:
             self.fps_var.set("20") # Reset combobox to default
 
         self.master.withdraw() # Hide main window
-        self.area_selector = AreaSelectionWindow(self.master, self._on_area_selected)
+        self.area_selector = AreaSelectionWindow(self.master, self._on_area_selected, self.screen_geometry,
+                                                 frozen=self.FROZEN_SELECTION,
+                                                 snapshot_width=self.SELECTION_SNAPSHOT_WIDTH)
 
     def _on_area_selected(self, area):
         """Callback from AreaSelectionWindow when an area is selected or cancelled."""
@@ -208,6 +251,7 @@ class ScreenRecorderApp:
         self.open_folder_button.config(state=tk.DISABLED)
         self.fps_combobox.config(state=tk.DISABLED) # Disable options during countdown/recording
         self.highlight_mouse_checkbox.config(state=tk.DISABLED)
+        self.instant_replay_checkbox.config(state=tk.DISABLED)
         self.no_audio_radio.config(state=tk.DISABLED) # Disable audio options
         self.mic_audio_radio.config(state=tk.DISABLED)
         self.mic_device_combobox.config(state=tk.DISABLED)
@@ -229,26 +273,116 @@ class ScreenRecorderApp:
     def _start_recording_process(self):
         """Starts the actual screen recording after countdown."""
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Paths for raw video and temporary audio
-        self.video_filename_raw = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"temp_video_{timestamp}.avi")
-        self.audio_filename_temp = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"temp_audio_{timestamp}.wav")
+        instant_replay = self.instant_replay_var.get()
+
         # Final output filename will be .mp4
         default_final_filename = f"screen_recording_{timestamp}.mp4"
 
-        # Ask user for final output file location (will be .mp4)
-        self.final_output_filename = filedialog.asksaveasfilename(
-            defaultextension=".mp4",
-            initialfile=default_final_filename,
-            filetypes=[("MP4 files", "*.mp4"), ("All files", "*.*")],
-            title="Save Recorded Video As"
-        )
+        # Ask user for final output file location (will be .mp4); replays are named when saved
+        if not instant_replay:
+            self.final_output_filename = filedialog.asksaveasfilename(
+                defaultextension=".mp4",
+                initialfile=default_final_filename,
+                filetypes=[("MP4 files", "*.mp4"), ("All files", "*.*")],
+                title="Save Recorded Video As"
+            )
 
-        if not self.final_output_filename:
+        if not instant_replay and not self.final_output_filename:
             self.status_label.config(text="Recording cancelled (no file selected)")
             self.start_button.config(state=tk.NORMAL)
             self.fps_combobox.config(state="readonly") # Re-enable options
             self.highlight_mouse_checkbox.config(state=tk.NORMAL)
+            self.instant_replay_checkbox.config(state=tk.NORMAL)
+            self.no_audio_radio.config(state=tk.NORMAL) # Re-enable audio options
+            self.mic_audio_radio.config(state=tk.NORMAL)
+            self._update_audio_controls() # Update mic device combobox state
+            return
+
+        audio_device = None
+        if self.audio_source_var.get() == "Microphone":
+            if self.p:
+                audio_device = self.mic_devices_map.get(self.audio_device_var.get())
+                if audio_device is None:
+                    messagebox.showerror("Audio Error", "Selected microphone device not found.")
+            else:
+                messagebox.showwarning("Audio Warning", "PyAudio was not initialized. Audio recording will be skipped.")
+                self.audio_source_var.set("No Audio") # Fallback
+
+        # All options are read here, on the Tk thread; the engine's threads never touch tkinter
+        try:
+            engine_factory = RecorderProcess if self.RECORD_IN_CHILD_PROCESS else RecorderEngine
+            self.engine = engine_factory(self.recording_area, fps=self.fps,
+                                         output_filename=None if instant_replay else self.final_output_filename,
+                                         backend=self.CAPTURE_BACKEND,
+                                         audio_device=audio_device,
+                                         highlight_mouse=self.highlight_mouse_var.get(),
+                                         encoder=self.VIDEO_ENCODER,
+                                         x264_preset=self.X264_PRESET,
+                                         x264_crf=self.X264_CRF,
+                                         audio_compression=self.AUDIO_COMPRESSION,
+                                         queue_depth=self.FRAME_QUEUE_DEPTH,
+                                         backpressure=self.FRAME_BACKPRESSURE,
+                                         encoder_threads=self.ENCODER_THREADS,
+                                         encode_processes=self.ENCODE_PROCESSES,
+                                         skip_unchanged=self.SKIP_UNCHANGED_FRAMES,
+                                         max_repeat=self.MAX_REPEATED_FRAMES,
+                                         pyaudio_instance=self.p,
+                                         on_status=self._on_engine_status,
+                                         on_error=self._on_engine_error,
+                                         on_failure=lambda: self.master.after(0, self.stop_recording),
+                                         status_interval=self.STATUS_INTERVAL,
+                                         metrics_jsonl=self.METRICS_JSONL,
+                                         metrics_prometheus=self.METRICS_PROMETHEUS,
+                                         segment_seconds=self.SEGMENT_SECONDS,
+                                         spool_dir=self.SPOOL_DIR,
+                                         raw_spool_bytes=int(self.RAW_SPOOL_GB * 1024 ** 3) if self.RAW_SPOOL_GB else None,
+                                         encode_workers=self.ENCODE_WORKERS,
+                                         write_index=self.WRITE_FRAME_INDEX,
+                                         replay_seconds=self.REPLAY_SECONDS if instant_replay else None,
+                                         replay_max_bytes=self.REPLAY_MAX_MB * 1024 * 1024,
+                                         output_size=self.OUTPUT_SIZE,
+                                         output_scale=self.OUTPUT_SCALE,
+                                         scale_interpolation=self.SCALE_INTERPOLATION,
+                                         audio_rate=self.AUDIO_RATE,
+                                         audio_sample_format=self.AUDIO_SAMPLE_FORMAT,
+                                         audio_chunk=self.AUDIO_CHUNK,
+                                         audio_buffer_seconds=self.AUDIO_BUFFER_SECONDS,
+                                         adaptive_quality=self.ADAPTIVE_QUALITY,
+                                         adaptive_min_fps=self.ADAPTIVE_MIN_FPS,
+                                         adaptive_min_quality=self.ADAPTIVE_MIN_QUALITY,
+                                         cursor_sample_rate=self.CURSOR_SAMPLE_RATE,
+                                         cursor_trail_seconds=self.CURSOR_TRAIL_SECONDS,
+                                         click_ripples=self.CLICK_RIPPLES)
+        except (RecorderError, ValueError) as e: # ValueError: settings the engine cannot combine
+            self._on_engine_started(instant_replay, e)
+            return
+
+        # Starting waits for the capture, audio and encoder to open (in the child process, which
+        # may calibrate encoders first), so it runs off the Tk thread; the countdown's disabled
+        # controls stay disabled until it is done
+        self.engine_starting = True
+        engine = self.engine
+        def start_engine():
+            error = None
+            try:
+                engine.start()
+            except Exception as e: # Any failure must reach the UI, or it waits for ever
+                error = e
+            self.master.after(0, self._on_engine_started, instant_replay, error)
+        threading.Thread(target=start_engine, name="recorder-start", daemon=True).start()
+
+    def _on_engine_started(self, instant_replay, error=None):
+        """Back on the Tk thread once the engine has started, or could not be created or started."""
+        self.engine_starting = False
+        if error is not None:
+            self.engine = None
+            messagebox.showerror("Recording Error", str(error))
+            self.status_label.config(text="Recording cancelled (invalid settings)" if isinstance(error, ValueError)
+                                     else "Recording cancelled (encoder error)")
+            self.start_button.config(state=tk.NORMAL)
+            self.fps_combobox.config(state="readonly") # Re-enable options
+            self.highlight_mouse_checkbox.config(state=tk.NORMAL)
+            self.instant_replay_checkbox.config(state=tk.NORMAL)
             self.no_audio_radio.config(state=tk.NORMAL) # Re-enable audio options
             self.mic_audio_radio.config(state=tk.NORMAL)
             self._update_audio_controls() # Update mic device combobox state
@@ -258,27 +392,23 @@ class ScreenRecorderApp:
         self.start_button.config(state=tk.DISABLED)
         self.pause_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.NORMAL)
+        if instant_replay:
+            self.save_replay_button.config(state=tk.NORMAL)
         self.open_folder_button.config(state=tk.DISABLED) # Disable while recording
         self.fps_combobox.config(state=tk.DISABLED) # Keep disabled during recording
         self.highlight_mouse_checkbox.config(state=tk.DISABLED)
+        self.instant_replay_checkbox.config(state=tk.DISABLED)
         self.no_audio_radio.config(state=tk.DISABLED) # Keep audio options disabled
         self.mic_audio_radio.config(state=tk.DISABLED)
         self.mic_device_combobox.config(state=tk.DISABLED)
 
-        self.status_label.config(text="Recording...")
-
-        # Start video recording thread
-        self.recording_thread = threading.Thread(target=self._record_screen)
-        self.recording_thread.start()
-
-        # Start audio recording thread if selected
-        if self.audio_source_var.get() == "Microphone" and self.p:
-            self.audio_frames = [] # Clear previous audio frames
-            self.audio_thread = threading.Thread(target=self._record_audio)
-            self.audio_thread.start()
-        elif self.audio_source_var.get() == "Microphone" and not self.p:
-            messagebox.showwarning("Audio Warning", "PyAudio was not initialized. Audio recording will be skipped.")
-            self.audio_source_var.set("No Audio") # Fallback
+        choice = self.engine.encoder_choice
+        if choice and choice.result:
+            # VIDEO_ENCODER "auto": show what was picked and why until the first status update
+            self.status_label.config(text=f"Recording with {choice.result['name']} "
+                                          f"({choice.result['fps']:g} fps measured)...")
+        else:
+            self.status_label.config(text="Recording...")
 
     def toggle_pause(self):
         """Toggles the recording between paused and resumed states."""
@@ -290,112 +420,47 @@ class ScreenRecorderApp:
         if self.is_paused:
             self.pause_button.config(text="Resume")
             self.status_label.config(text="Recording Paused.")
-            if self.audio_stream:
-                self.audio_stream.stop_stream() # Pause audio stream
+            self.engine.pause() # Stops capture, the clock and the audio stream
         else:
             self.pause_button.config(text="Pause")
             self.status_label.config(text="Recording Resumed.")
-            if self.audio_stream:
-                self.audio_stream.start_stream() # Resume audio stream
+            self.engine.resume()
 
-    def _record_screen(self):
-        """
-        Captures screen frames from the selected area and writes them to a video file.
-        This method runs in a separate thread.
-        """
-        x, y, width, height = self.recording_area
-        print(f"Recording area: x={x}, y={y}, w={width}, h={height}") # Debugging
-
-        try:
-            # Define the codec and create VideoWriter object
-            fourcc = cv2.VideoWriter_fourcc(*'MJPG') # MJPG for broad AVI compatibility
-            self.out = cv2.VideoWriter(self.video_filename_raw, fourcc, self.fps, (width, height))
-
-            start_time = time.time()
-            frame_count = 0
-
-            while self.is_recording:
-                if not self.is_paused:
-                    # Capture screenshot of the defined area
-                    img = ImageGrab.grab(bbox=(x, y, x + width, y + height))
-
-                    # Convert PIL Image to numpy array (RGB to BGR for OpenCV)
-                    frame = np.array(img)
-                    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-
-                    # Highlight mouse cursor if option is enabled
-                    if self.highlight_mouse_var.get():
-                        mouse_x, mouse_y = pyautogui.position()
-                        # Adjust mouse coordinates relative to the recording area
-                        relative_mouse_x = mouse_x - x
-                        relative_mouse_y = mouse_y - y
-
-                        # Ensure mouse is within the captured frame boundaries
-                        # We also check if the mouse position is reasonable within the desktop bounds
-                        # to avoid drawing a highlight if cursor is on an uncaptured monitor area.
-                        if 0 <= relative_mouse_x < width and 0 <= relative_mouse_y < height:
-                            # Draw a red circle around the mouse pointer
-                            cv2.circle(frame, (relative_mouse_x, relative_mouse_y), 15, (0, 0, 255), 2) # Red circle, 2px thickness
-
-                    # Write the frame to the video file
-                    self.out.write(frame)
-
-                    frame_count += 1
-                    elapsed_time = time.time() - start_time
-                    if elapsed_time > 0:
-                        current_fps = frame_count / elapsed_time
-                        self.master.after(0, self.status_label.config, {"text": f"Recording... ({current_fps:.1f} FPS)"})
-
-                # Maintain desired FPS by sleeping for the remaining time
-                time_per_frame = 1.0 / self.fps
-                sleep_duration = time_per_frame - (time.time() - start_time - (frame_count -1) * time_per_frame)
-                if sleep_duration > 0 and not self.is_paused: # Only sleep if not paused
-                    time.sleep(sleep_duration)
-                elif self.is_paused:
-                    time.sleep(0.1) # Small sleep to prevent busy-waiting when paused
-
-
-        except Exception as e:
-            messagebox.showerror("Recording Error", f"An error occurred during video recording: {e}")
-            self.stop_recording() # Ensure stop_recording cleans up even on error
-
-    def _record_audio(self):
-        """
-        Captures audio from the selected microphone and appends to a list.
-        This method runs in a separate thread.
-        """
-        if not self.p: # Check if PyAudio initialized successfully
+    def save_replay(self):
+        """Saves the instant replay window to an MP4 while recording carries on."""
+        if not self.is_recording or not self.engine or not self.engine.replay_seconds:
+            messagebox.showwarning("Warning", "Instant replay is not running.")
             return
-
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = os.path.abspath(os.path.join(self.REPLAY_DIR or os.getcwd(), f"replay_{timestamp}.mp4"))
         try:
-            device_name = self.audio_device_var.get()
-            device_index = self.mic_devices_map.get(device_name)
-            if device_index is None:
-                messagebox.showerror("Audio Error", "Selected microphone device not found.")
-                return
-
-            self.audio_stream = self.p.open(format=self.FORMAT,
-                                            channels=self.CHANNELS,
-                                            rate=self.RATE,
-                                            input=True,
-                                            input_device_index=device_index,
-                                            frames_per_buffer=self.CHUNK)
-
-            while self.is_recording or self.is_paused: # Keep running even if paused to collect frames
-                if not self.is_paused:
-                    data = self.audio_stream.read(self.CHUNK)
-                    self.audio_frames.append(data)
-                else:
-                    time.sleep(0.1) # Small sleep during pause
+            # The window is taken now; the file is written on a background thread
+            self.engine.save_replay(filename, on_done=lambda saved: self.master.after(0, self._on_replay_saved, filename, saved))
+        except RecorderError as e:
+            messagebox.showerror("Replay Error", str(e))
+
+    def _on_replay_saved(self, filename, saved):
+        if saved:
+            self.final_output_filename = filename # "Open Output Folder" shows the replays
+            self.status_label.config(text=f"Replay saved to:\n{filename}")
+
+    def _on_engine_status(self, text):
+        """Shows engine progress; called from the engine's threads as well as this one."""
+        if threading.current_thread() is threading.main_thread():
+            self.status_label.config(text=text)
+            self.master.update_idletasks() # Force UI update
+        else:
+            self.master.after(0, self.status_label.config, {"text": text})
 
-        except Exception as e:
-            messagebox.showerror("Audio Recording Error", f"An error occurred during audio recording: {e}")
-        finally:
-            if self.audio_stream:
-                self.audio_stream.stop_stream()
-                self.audio_stream.close()
-            # PyAudio instance should only be terminated on app close
-            # self.p.terminate() # DO NOT terminate here, only on app close
+    def _on_engine_error(self, title, message):
+        """Shows an engine error; dialogs are only ever opened from the Tk thread."""
+        if threading.current_thread() is threading.main_thread():
+            messagebox.showerror(title, message)
+        else:
+            try:
+                self.master.after(0, messagebox.showerror, title, message)
+            except Exception: # The window is gone while a recording is still being finalized
+                print(f"{title}: {message}", file=sys.stderr)
 
     def stop_recording(self):
         """Stops the screen recording process and finalizes the video file."""
@@ -405,51 +470,22 @@ class ScreenRecorderApp:
 
         self.is_recording = False
         self.is_paused = False # Reset pause state
-        self.status_label.config(text="Stopping recording...")
-
-        # Wait for both video and audio threads to finish
-        if self.recording_thread and self.recording_thread.is_alive():
-            self.recording_thread.join()
-        if self.audio_thread and self.audio_thread.is_alive():
-            self.audio_thread.join()
-
-        # Release the VideoWriter object
-        if self.out:
-            self.out.release()
-            self.out = None
-
-        # Save audio if recorded
-        if self.audio_source_var.get() == "Microphone" and self.audio_frames:
-            try:
-                wf = wave.open(self.audio_filename_temp, 'wb')
-                wf.setnchannels(self.CHANNELS)
-                wf.setsampwidth(self.p.get_sample_size(self.FORMAT))
-                wf.setframerate(self.RATE)
-                wf.writeframes(b''.join(self.audio_frames))
-                wf.close()
-            except Exception as e:
-                messagebox.showerror("Audio Save Error", f"Could not save audio file: {e}")
-                self.audio_filename_temp = "" # Invalidate temp audio file path
-
-        self.status_label.config(text="Processing video and audio...")
-        self.master.update_idletasks() # Force UI update
-
-        # Merge video and audio using FFmpeg if audio was recorded
-        if self.audio_source_var.get() == "Microphone" and os.path.exists(self.audio_filename_temp):
-            self._merge_video_audio()
+        self.pause_button.config(text="Pause")
+
+        # Stops capture and audio now; the video is finished (and the audio merged in) in the background
+        self.save_replay_button.config(state=tk.DISABLED)
+        engine, self.engine = self.engine, None
+        engine.stop_capture()
+        if engine.replay_seconds:
+            # Only waits for replays already being saved, but never on the Tk thread; not a daemon,
+            # so exiting still lets them finish
+            threading.Thread(target=engine.finalize, name="replay-stop").start()
+            status = "Instant replay stopped."
         else:
-            # If no audio or audio failed, just rename the raw video
-            try:
-                os.rename(self.video_filename_raw, self.final_output_filename)
-                messagebox.showinfo("Recording Finished", f"Screen recording saved successfully to:\n{self.final_output_filename}")
-            except OSError as e:
-                messagebox.showerror("File Error", f"Could not rename video file: {e}. Raw video might be in {self.video_filename_raw}")
-
-        # Cleanup temporary files
-        if os.path.exists(self.video_filename_raw):
-            os.remove(self.video_filename_raw)
-        if os.path.exists(self.audio_filename_temp):
-            os.remove(self.audio_filename_temp)
+            engine.on_status = None # The jobs label shows its progress from now on
+            self.finalizer.submit(os.path.basename(engine.final_output_filename),
+                                  lambda report_progress: (engine.finalize(report_progress), engine.final_output_filename))
+            status = "Recording stopped. Finalizing in the background..."
 
         self.start_button.config(state=tk.NORMAL)
         self.pause_button.config(state=tk.DISABLED)
@@ -457,68 +493,27 @@ class ScreenRecorderApp:
         self.open_folder_button.config(state=tk.NORMAL) # Enable after recording stops
         self.fps_combobox.config(state="readonly") # Re-enable options
         self.highlight_mouse_checkbox.config(state=tk.NORMAL)
+        self.instant_replay_checkbox.config(state=tk.NORMAL)
         self.no_audio_radio.config(state=tk.NORMAL) # Re-enable audio options
         self.mic_audio_radio.config(state=tk.NORMAL)
         self._update_audio_controls() # Update mic device combobox state
 
-        self.status_label.config(text=f"Recording stopped. Final output:\n{self.final_output_filename}")
-
+        self.status_label.config(text=status)
 
-    def _merge_video_audio(self):
-        """Merges the recorded video and audio using FFmpeg."""
-        try:
-            # FFmpeg command:
-            # -i video_input.avi (input video)
-            # -i audio_input.wav (input audio)
-            # -c:v copy (copy video stream without re-encoding)
-            # -c:a aac (encode audio to AAC, a common codec for MP4)
-            # -strict experimental (needed for older AAC encoders, can often be removed)
-            # -b:a 192k (audio bitrate)
-            # final_output.mp4 (output file)
-
-            command = [
-                'ffmpeg',
-                '-i', self.video_filename_raw,
-                '-i', self.audio_filename_temp,
-                '-c:v', 'copy',
-                '-c:a', 'aac',
-                '-strict', 'experimental', # May not be needed on newer FFmpeg, but good for compatibility
-                '-b:a', '192k',
-                self.final_output_filename
-            ]
-
-            self.status_label.config(text="Merging video and audio...")
-            self.master.update_idletasks() # Force UI update
-
-            # Execute FFmpeg command
-            # Use `creationflags=subprocess.CREATE_NO_WINDOW` on Windows to hide console window
-            if sys.platform == "win32":
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                process = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                         startupinfo=startupinfo)
-            else:
-                process = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            if process.returncode == 0:
-                messagebox.showinfo("Recording Finished", f"Screen recording saved successfully to:\n{self.final_output_filename}")
-            else:
-                error_message = process.stderr.decode(errors='ignore')
-                messagebox.showerror("FFmpeg Error", f"Failed to merge video and audio. FFmpeg output:\n{error_message}\n\n"
-                                                      f"Ensure FFmpeg is installed and accessible in your system's PATH. "
-                                                      f"The raw video is at: {self.video_filename_raw}")
-                # If merging failed, keep the raw video for user
-                self.final_output_filename = self.video_filename_raw
-        except FileNotFoundError:
-            messagebox.showerror("FFmpeg Not Found", "FFmpeg is not installed or not found in your system's PATH. "
-                                                    "Please install FFmpeg to enable audio recording. "
-                                                    f"Raw video saved to:\n{self.video_filename_raw}")
-            # If FFmpeg is not found, keep the raw video for user
-            self.final_output_filename = self.video_filename_raw
-        except Exception as e:
-            messagebox.showerror("Merging Error", f"An unexpected error occurred during merging: {e}\n"
-                                                  f"Raw video saved to:\n{self.video_filename_raw}")
-            self.final_output_filename = self.video_filename_raw # Keep raw video if merging fails
+    def _on_finalization_update(self, job):
+        """Shows the progress of the recordings being finalized, and the result of each one."""
+        self.jobs_label.config(text="\n".join(pending.describe() for pending in self.finalizer.pending()))
+        if job.state != JOB_DONE:
+            return # Failures were reported by the engine
+        saved, filename = job.result
+        self.final_output_filename = filename # The output, or whatever was kept of it
+        if not saved:
+            return
+        if self.is_recording:
+            self.jobs_label.config(text=f"Saved: {filename}") # No dialog in the middle of a recording
+        else:
+            self.status_label.config(text=f"Recording stopped. Final output:\n{filename}")
+            messagebox.showinfo("Recording Finished", f"Screen recording saved successfully to:\n{filename}")
 
 
     def open_output_folder(self):
@@ -543,59 +538,81 @@ class ScreenRecorderApp:
 
     def on_closing(self):
         """Handles the window closing event, stopping recording if active."""
+        if self.engine_starting:
+            messagebox.showinfo("Please Wait", "The recording is starting; stop it once it has started.")
+            return
         if self.is_recording or self.countdown_active:
             if messagebox.askyesno("Quit", "Recording/countdown is in progress. Do you want to stop and quit?"):
                 if self.countdown_active:
                     self.countdown_active = False # Stop countdown if active
                     self.master.after_cancel(self._update_countdown) # Cancel pending after call
                 self.stop_recording()
-                if self.p:
-                    self.p.terminate() # Terminate PyAudio instance
-                self.master.destroy()
+                self._quit()
             else:
                 pass # Do nothing, keep the window open
         else:
-            if self.p:
-                self.p.terminate() # Terminate PyAudio instance
-            self.master.destroy()
+            self._quit()
+
+    def _quit(self):
+        if self.finalizer.pending():
+            # The finalizer thread is not a daemon: the process stays alive until they are saved
+            print(f"Finishing {len(self.finalizer.pending())} recording(s) before exiting...") # Debugging
+            self.finalizer.on_update = None
+        if self.p:
+            self.p.terminate() # Terminate PyAudio instance
+        self.master.destroy()
 
 
 # AreaSelectionWindow class for selecting a screen region
 class AreaSelectionWindow:
-    def __init__(self, parent, callback):
+    """
+    Full-desktop overlay for dragging out the recording area. Its size comes from screen_geometry
+    (a ScreenGeometryCache), so opening it captures nothing. With frozen, the overlay is opaque and
+    shows one downscaled snapshot of the desktop (at most about snapshot_width wide) instead of
+    being see-through: it appears at once even where the window manager is slow to composite a
+    translucent full-screen window, and nothing is left for it to fade out once recording starts.
+    """
+    def __init__(self, parent, callback, screen_geometry=None, frozen=False, snapshot_width=1920):
         self.parent = parent
         self.callback = callback
         self.root = tk.Toplevel(parent)
         self.root.overrideredirect(True) # Remove window decorations (border, title bar)
-        self.root.attributes('-alpha', 0.3) # Make it transparent
         self.root.attributes('-topmost', True) # Keep it on top
 
-        # Attempt to get the virtual screen dimensions by taking a full screenshot.
-        # On Windows, ImageGrab.grab() without bbox typically captures the entire virtual desktop across monitors.
-        # On macOS/Linux, its behavior might be limited to the primary display or require specific display settings.
         try:
-            full_screen_img = ImageGrab.grab()
-            virtual_screen_width, virtual_screen_height = full_screen_img.size
-            # For simplicity, assume the virtual desktop's top-left is at (0,0) for the purpose of placing the transparent window.
-            # IMPORTANT LIMITATION: If you have monitors with negative coordinates (e.g., a monitor to the left or above the primary display),
-            # this transparent window might not extend to cover those areas. Tkinter's ability to precisely query
-            # and position windows across a complex multi-monitor setup (especially with negative coordinates) is limited
-            # without additional platform-specific libraries or detailed system queries.
-            x_offset, y_offset = 0, 0
+            geometry = (screen_geometry or ScreenGeometryCache()).get(parent)
+            virtual_screen_width, virtual_screen_height = geometry.width, geometry.height
+            # Monitors left of or above the primary one have negative coordinates
+            x_offset, y_offset = geometry.x, geometry.y
         except Exception as e:
-            # Fallback to primary screen dimensions if full screen grab fails or isn't appropriate
+            # Fallback to primary screen dimensions if the desktop cannot be queried
             messagebox.showwarning("Screen Detection Error", f"Could not determine full virtual screen size: {e}. "
                                                             "Defaulting to primary monitor for selection area. "
                                                             "Multi-monitor selection may be limited.")
             virtual_screen_width = parent.winfo_screenwidth()
             virtual_screen_height = parent.winfo_screenheight()
             x_offset, y_offset = 0, 0
+            geometry = None
+        self.x_offset, self.y_offset = x_offset, y_offset
 
         self.root.geometry(f"{virtual_screen_width}x{virtual_screen_height}+{x_offset}+{y_offset}")
 
         self.canvas = tk.Canvas(self.root, bg='gray', highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
 
+        self.snapshot = None # PhotoImage behind the canvas in frozen mode; Tk needs the reference kept
+        if frozen and geometry is not None:
+            try:
+                image, factor = grab_snapshot(geometry, snapshot_width)
+                self.snapshot = tk.PhotoImage(data=snapshot_ppm(image))
+                if factor > 1:
+                    self.snapshot = self.snapshot.zoom(factor) # Back to desktop size, scaled inside Tk
+                self.canvas.create_image(0, 0, image=self.snapshot, anchor="nw")
+            except Exception as e:
+                print(f"Could not take the selection snapshot: {e}") # Debugging; fall back to see-through
+                self.snapshot = None
+        self.root.attributes('-alpha', 1.0 if self.snapshot else 0.3) # See-through unless frozen
+
         self.start_x = None
         self.start_y = None
         self.rect_id = None
@@ -622,15 +639,17 @@ class AreaSelectionWindow:
 
     def on_button_press(self, event):
         """Records the starting point of the drag."""
-        self.start_x = event.x_root
-        self.start_y = event.y_root
+        # Canvas coordinates: the overlay's top-left corner is at (x_offset, y_offset) on screen
+        self.start_x = event.x_root - self.x_offset
+        self.start_y = event.y_root - self.y_offset
         self.rect_id = self.canvas.create_rectangle(self.start_x, self.start_y, self.start_x, self.start_y,
                                                     outline='red', width=2, dash=(5, 2))
 
     def on_mouse_drag(self, event):
         """Updates the rectangle as the mouse is dragged."""
         if self.rect_id:
-            self.canvas.coords(self.rect_id, self.start_x, self.start_y, event.x_root, event.y_root)
+            self.canvas.coords(self.rect_id, self.start_x, self.start_y,
+                               event.x_root - self.x_offset, event.y_root - self.y_offset)
 
     def on_button_release(self, event):
         """Finalizes the selected area on mouse release."""
@@ -658,7 +677,8 @@ class AreaSelectionWindow:
                                                         outline='blue', width=3) # Highlight final selection
 
             # Make the window non-transparent temporarily to make the controls more visible
-            self.root.attributes('-alpha', 0.9)
+            if not self.snapshot:
+                self.root.attributes('-alpha', 0.9)
             # Reposition the control frame to be visible within the selected area, or always bottom-right
             # If the selected area is very small, placing controls within might be hard.
             # Keeping them at the bottom-right of the full screen for now.
@@ -666,7 +686,8 @@ class AreaSelectionWindow:
     def confirm_selection(self):
         """Confirms the selected area and passes it back to the main app."""
         if self.rect_id and self.current_width > 0 and self.current_height > 0:
-            self.callback((self.current_x, self.current_y, self.current_width, self.current_height))
+            self.callback((self.current_x + self.x_offset, self.current_y + self.y_offset,
+                           self.current_width, self.current_height))
             self.root.destroy()
         else:
             messagebox.showwarning("No Selection", "Please select an area by dragging your mouse before confirming.")
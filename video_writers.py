@@ -0,0 +1,376 @@
+import collections
+import os
+import struct
+import subprocess
+import threading
+
+import cv2
+import numpy as np
+
+from ffmpeg_tools import PCM_FORMATS, ffmpeg_popen
+from frame_index import FrameIndexLog
+
+# AVI/OpenDML constants
+AVIF_HASINDEX = 0x10
+AVIF_ISINTERLEAVED = 0x100
+AVIIF_KEYFRAME = 0x10
+AVI_INDEX_OF_INDEXES = 0x00
+AVI_INDEX_OF_CHUNKS = 0x01
+
+RIFF_SIZE_LIMIT = 1 << 30 # Start a new RIFF-AVIX part after ~1 GB, like most OpenDML writers
+SUPER_INDEX_ENTRIES = 256 # Reserved 'indx' slots, one per RIFF part (~256 GB per file)
+
+# Encoders recorded through FFmpegPipeWriter, by the engine's encoder name: the FFmpeg codec and the
+# containers it can be written to ("xvid" is FFmpeg's XviD-compatible MPEG-4 Part 2 encoder)
+PIPE_ENCODERS = {"x264": "libx264", "xvid": "mpeg4", "ffv1": "ffv1"}
+PIPE_CONTAINERS = {"libx264": (".mp4", ".mkv", ".mov", ".avi"), "mpeg4": (".mp4", ".mkv", ".mov", ".avi"),
+                   "ffv1": (".mkv", ".avi")}
+
+
+class MjpegAviWriter:
+    """
+    Motion-JPEG AVI writer with the same write()/release() surface as cv2.VideoWriter.
+
+    Frames are JPEG-compressed with cv2.imencode and appended as '00dc' chunks; files larger than
+    1 GB continue in OpenDML RIFF-AVIX parts. Because every MJPG frame is an independent packet,
+    write_duplicate() can repeat the previous frame without encoding anything: it appends a
+    zero-length chunk, the AVI convention for a dropped/held frame, which demuxers (ffmpeg, VLC,
+    DirectShow) turn into a gap in the timestamps. Unchanged screens therefore cost 8 bytes each.
+    Repeats only last until the next stored frame, though: demuxers drop a run of empty chunks at
+    the end of the file, and remuxing (-c:v copy) or re-encoding it loses them too. So the last
+    repeat is held back and written by release() as the previous JPEG again, and one repeat in
+    every max_repeat (default: one second of frames) is written in full, so a long static stretch
+    still has real frames to seek to and the file keeps its duration through any conversion.
+
+    With index_filename, every chunk is also logged to a frame index sidecar (see frame_index) as
+    it is written: frame number, PTS, byte offset and size of the JPEG data, keyframe flag.
+    """
+    def __init__(self, filename, fps, frame_size, quality=95, index_filename=None, max_repeat=None):
+        self.filename = filename
+        self.fps = fps
+        self.width, self.height = frame_size
+        self.quality = quality
+        self.max_repeat = max_repeat or max(1, int(round(fps))) # Repeats in a row before one is stored in full
+        self.frames_written = 0   # Frames in the file, including duplicates (a held repeat counts once written)
+        self.duplicate_frames = 0 # Frames that repeat the previous one
+
+        self._file = open(filename, "wb")
+        self._lock = threading.Lock()
+        self._max_chunk = 0
+        self._riff_parts = [] # [riff_start, movi_start, [(offset, size, keyframe), ...]] per RIFF part
+        self._super_index = [] # (ix00 offset, ix00 size, frame count) per finished part
+        self._index_log = FrameIndexLog(index_filename) if index_filename else None
+        self._last_packet = None # Last stored JPEG, written again to end a run of repeats
+        self._repeats = 0        # Repeats since the last stored JPEG
+        self._held_repeat = False # A repeat not written yet; release() stores it in full
+        self._write_headers()
+        self._start_part(first=True)
+
+    def isOpened(self):
+        return self._file is not None
+
+    @property
+    def quality(self):
+        return self._encode_params[1]
+
+    @quality.setter
+    def quality(self, quality):
+        """JPEG quality of the frames encoded from now on; may change while recording."""
+        self._encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)] # Replaced whole, safe for concurrent encode()
+
+    def encode(self, frame):
+        """Compresses a BGR frame to a JPEG packet; safe to call from several threads at once."""
+        ok, packet = cv2.imencode(".jpg", frame, self._encode_params)
+        if not ok:
+            raise RuntimeError("JPEG encoding failed.")
+        return packet
+
+    def write(self, frame):
+        """Encodes and appends a BGR frame."""
+        self.write_packet(self.encode(frame))
+
+    def write_packet(self, packet, keyframe=True):
+        """Appends an already compressed JPEG frame."""
+        with self._lock:
+            self._write_held_repeat()
+            self._write_chunk(memoryview(packet).cast("B"), keyframe)
+            self._last_packet = packet # imencode and the process pool hand over packets they no longer use
+            self._repeats = 0
+
+    def write_duplicate(self):
+        """Repeats the previous frame without encoding it again (see the class docstring)."""
+        with self._lock:
+            self._write_held_repeat()
+            self.duplicate_frames += 1
+            if self._last_packet is None:
+                self._write_chunk(b"", keyframe=False) # Nothing to repeat yet
+                return
+            self._repeats += 1
+            if self._repeats >= self.max_repeat:
+                self._write_chunk(memoryview(self._last_packet).cast("B"), keyframe=True)
+                self._repeats = 0
+            else:
+                self._held_repeat = True
+
+    def release(self):
+        """Finishes the index and headers and closes the file."""
+        with self._lock:
+            if self._file is None:
+                return
+            if self._held_repeat:
+                # The last frame of the file must be a stored one, or the repeats before it are lost
+                self._write_chunk(memoryview(self._last_packet).cast("B"), keyframe=True)
+                self._held_repeat = False
+            self._finish_part()
+            self._patch_headers()
+            self._file.close()
+            self._file = None
+            if self._index_log is not None:
+                self._index_log.close()
+
+    def _write_held_repeat(self):
+        if self._held_repeat:
+            self._write_chunk(b"", keyframe=False)
+            self._held_repeat = False
+
+    # --- RIFF layout ---
+
+    def _write_headers(self):
+        f = self._file
+        f.write(b"RIFF\0\0\0\0AVI ")
+        hdrl_start = f.tell()
+        f.write(b"LIST\0\0\0\0hdrl")
+
+        # MainAVIHeader; frame counts, buffer size and rates are patched in release()
+        self._avih_pos = f.tell() + 8
+        f.write(b"avih" + struct.pack("<I", 56))
+        f.write(struct.pack("<10I4I", int(round(1000000 / self.fps)), 0, 0,
+                            AVIF_HASINDEX | AVIF_ISINTERLEAVED, 0, 0, 1, 0,
+                            self.width, self.height, 0, 0, 0, 0))
+
+        strl_start = f.tell()
+        f.write(b"LIST\0\0\0\0strl")
+        self._strh_pos = f.tell() + 8
+        scale, rate = 1000, int(round(self.fps * 1000))
+        f.write(b"strh" + struct.pack("<I", 56))
+        f.write(b"vidsMJPG" + struct.pack("<IHHIIIIIIiI4h", 0, 0, 0, 0, scale, rate, 0, 0, 0, -1, 0,
+                                          0, 0, self.width, self.height))
+        f.write(b"strf" + struct.pack("<I", 40))
+        f.write(struct.pack("<IiiHH4sIiiII", 40, self.width, self.height, 1, 24, b"MJPG",
+                            self.width * self.height * 3, 0, 0, 0, 0))
+        # OpenDML super index, filled in release()
+        self._indx_pos = f.tell()
+        indx_size = 24 + 16 * SUPER_INDEX_ENTRIES
+        f.write(b"indx" + struct.pack("<I", indx_size) + b"\0" * indx_size)
+        self._patch_list_size(strl_start)
+
+        odml_start = f.tell()
+        f.write(b"LIST\0\0\0\0odml")
+        self._dmlh_pos = f.tell() + 8
+        f.write(b"dmlh" + struct.pack("<I", 248) + b"\0" * 248)
+        self._patch_list_size(odml_start)
+        self._patch_list_size(hdrl_start)
+
+    def _start_part(self, first=False):
+        f = self._file
+        riff_start = f.tell()
+        if not first:
+            f.write(b"RIFF\0\0\0\0AVIX")
+        else:
+            riff_start = 0
+        movi_start = f.tell()
+        f.write(b"LIST\0\0\0\0movi")
+        self._riff_parts.append([riff_start, movi_start, []])
+
+    def _write_chunk(self, data, keyframe):
+        f = self._file
+        if f is None:
+            raise ValueError("Writer has been released.")
+        size = len(data)
+        if f.tell() - self._riff_parts[-1][0] + size > RIFF_SIZE_LIMIT:
+            self._finish_part()
+            self._start_part()
+
+        offset = f.tell()
+        f.write(b"00dc" + struct.pack("<I", size))
+        f.write(data)
+        if size & 1:
+            f.write(b"\0") # Chunks are word aligned
+        self._riff_parts[-1][2].append((offset, size, keyframe))
+        self._max_chunk = max(self._max_chunk, size)
+        if self._index_log is not None:
+            self._index_log.add(self.frames_written, self.frames_written / self.fps, offset + 8, size, keyframe)
+        self.frames_written += 1
+
+    def _finish_part(self):
+        f = self._file
+        riff_start, movi_start, chunks = self._riff_parts[-1]
+
+        # OpenDML standard index for this part, stored at the end of its movi list
+        ix_offset = f.tell()
+        base = movi_start
+        f.write(b"ix00" + struct.pack("<I", 24 + 8 * len(chunks)))
+        f.write(struct.pack("<HBBI4sQI", 2, 0, AVI_INDEX_OF_CHUNKS, len(chunks), b"00dc", base, 0))
+        for offset, size, keyframe in chunks:
+            f.write(struct.pack("<II", offset + 8 - base, size if keyframe else size | 0x80000000))
+        self._super_index.append((ix_offset, f.tell() - ix_offset, len(chunks)))
+        self._patch_list_size(movi_start)
+
+        if riff_start == 0:
+            # Legacy AVI 1.0 index for the first part, offsets relative to the 'movi' fourcc
+            f.write(b"idx1" + struct.pack("<I", 16 * len(chunks)))
+            for offset, size, keyframe in chunks:
+                f.write(b"00dc" + struct.pack("<III", AVIIF_KEYFRAME if keyframe else 0,
+                                              offset - (movi_start + 8), size))
+        self._patch_list_size(riff_start)
+
+    def _patch_headers(self):
+        f = self._file
+        end = f.tell()
+        total_frames = self.frames_written
+        first_part_frames = len(self._riff_parts[0][2])
+        suggested_buffer = self._max_chunk + 8
+
+        f.seek(self._avih_pos + 4)
+        f.write(struct.pack("<I", int(suggested_buffer * self.fps)))
+        f.seek(self._avih_pos + 16)
+        f.write(struct.pack("<I", first_part_frames))
+        f.seek(self._avih_pos + 28)
+        f.write(struct.pack("<I", suggested_buffer))
+        f.seek(self._strh_pos + 32)
+        f.write(struct.pack("<II", total_frames, suggested_buffer))
+        f.seek(self._dmlh_pos)
+        f.write(struct.pack("<I", total_frames))
+
+        if len(self._super_index) > SUPER_INDEX_ENTRIES:
+            raise RuntimeError("Recording exceeds the maximum AVI size supported by this writer.")
+        f.seek(self._indx_pos + 8)
+        f.write(struct.pack("<HBBI4s3I", 4, 0, AVI_INDEX_OF_INDEXES, len(self._super_index), b"00dc", 0, 0, 0))
+        for ix_offset, ix_size, frames in self._super_index:
+            f.write(struct.pack("<QII", ix_offset, ix_size, frames))
+        f.seek(end)
+
+    def _patch_list_size(self, start):
+        """Writes the size field of the RIFF/LIST chunk starting at start, which ends here."""
+        f = self._file
+        end = f.tell()
+        f.seek(start + 4)
+        f.write(struct.pack("<I", end - start - 8))
+        f.seek(end)
+
+
+class FFmpegPipeWriter:
+    """
+    Encodes straight to the final file with a long-running FFmpeg process fed through pipes.
+
+    Raw BGR frames go to FFmpeg's stdin and are compressed while recording (libx264 by default,
+    with a configurable preset and CRF), so the output is complete as soon as release() returns:
+    no temporary AVI and no second pass. With audio_format=(channels, sample_width, rate) a second
+    pipe carries PCM audio into the same process; see audio_stream. Repeated frames are sent again
+    as raw pixels, which x264 encodes as nearly free skip blocks. Other codecs of PIPE_CONTAINERS
+    work the same way (mpeg4 at a fixed quantiser, ffv1 lossless).
+    """
+    # Inheriting an extra pipe into FFmpeg ("pipe:3") only works with POSIX file descriptors
+    SUPPORTS_AUDIO_PIPE = os.name == "posix"
+
+    def __init__(self, filename, fps, frame_size, codec="libx264", preset="veryfast", crf=23,
+                 audio_format=None, audio_codec="aac", audio_bitrate="192k"):
+        self.filename = filename
+        self.fps = fps
+        self.width, self.height = frame_size
+        self.frames_written = 0
+        self.duplicate_frames = 0
+        self.audio_stream = None # Binary file object accepting raw PCM, when audio_format is set
+
+        self._last_frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self._previous = self._last_frame # Frame write_duplicate() sends: _last_frame, or a borrowed frame
+        self.copied_bytes = 0 # Frames copied into _last_frame by write()
+        self._stderr_tail = collections.deque(maxlen=20)
+
+        # Raw inputs need no probing; without these FFmpeg waits for seconds of live audio before starting
+        probe = ["-probesize", "32", "-analyzeduration", "0"]
+        command = ["-y"] + probe + [
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{self.width}x{self.height}",
+                   "-framerate", str(fps), "-i", "pipe:0"]
+        pass_fds = ()
+        audio_read_fd = None
+        if audio_format is not None:
+            if not self.SUPPORTS_AUDIO_PIPE:
+                raise RuntimeError("Piping audio into FFmpeg is not supported on this platform.")
+            channels, sample_width, rate = audio_format
+            audio_read_fd, audio_write_fd = os.pipe()
+            pass_fds = (audio_read_fd,)
+            command += probe + ["-f", PCM_FORMATS[sample_width], "-ar", str(rate), "-ac", str(channels),
+                        "-i", f"pipe:{audio_read_fd}"]
+        command += ["-map", "0:v",
+                    # yuv420p needs even dimensions; pad odd selections by one pixel
+                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                    "-c:v", codec, "-pix_fmt", "yuv420p"]
+        if codec == "libx264":
+            command += ["-preset", preset, "-crf", str(crf)]
+        elif codec == "mpeg4":
+            command += ["-q:v", "3"] # Visually close to the MJPG default
+        if audio_format is not None:
+            command += ["-map", "1:a", "-c:a", audio_codec, "-b:a", audio_bitrate]
+        command.append(filename)
+
+        try:
+            self._process = ffmpeg_popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.PIPE, pass_fds=pass_fds)
+        finally:
+            if audio_read_fd is not None:
+                os.close(audio_read_fd) # FFmpeg holds its own copy now
+        if audio_format is not None:
+            self.audio_stream = os.fdopen(audio_write_fd, "wb")
+        threading.Thread(target=self._drain_stderr, args=(self._process.stderr,),
+                         name="ffmpeg-stderr", daemon=True).start()
+
+    def isOpened(self):
+        return self._process is not None and self._process.poll() is None
+
+    def write(self, frame):
+        """Sends a contiguous BGR frame of the configured size to FFmpeg."""
+        np.copyto(self._last_frame, frame) # Kept for write_duplicate()
+        self.copied_bytes += frame.nbytes
+        self._previous = self._last_frame
+        self._send(self._last_frame)
+
+    def write_borrowed(self, frame):
+        """
+        Like write(), without the copy: the caller leaves frame unchanged until another frame has
+        been written (see FramePipeline), so write_duplicate() can send it again.
+        """
+        self._previous = frame
+        self._send(frame)
+
+    def write_duplicate(self):
+        """Sends the previous frame again."""
+        self._send(self._previous)
+        self.duplicate_frames += 1
+
+    def release(self):
+        """Closes the pipes and waits for FFmpeg to finish the file."""
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        if self.audio_stream is not None and not self.audio_stream.closed:
+            self.audio_stream.close()
+        try:
+            process.stdin.close()
+        except OSError:
+            pass # FFmpeg already exited; its error is reported below
+        if process.wait() != 0:
+            raise RuntimeError(f"FFmpeg failed to encode {self.filename}:\n" + "\n".join(self._stderr_tail))
+
+    def _send(self, frame):
+        try:
+            self._process.stdin.write(memoryview(frame).cast("B"))
+        except (BrokenPipeError, OSError):
+            self._process.wait()
+            raise RuntimeError("FFmpeg stopped accepting frames:\n" + "\n".join(self._stderr_tail))
+        self.frames_written += 1
+
+    def _drain_stderr(self, stderr):
+        """Keeps FFmpeg's stderr pipe from filling up and remembers the last lines for errors."""
+        for line in stderr:
+            self._stderr_tail.append(line.decode(errors="ignore").rstrip())